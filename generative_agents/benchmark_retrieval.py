@@ -0,0 +1,115 @@
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from modules.storage.vector_store import NumpyVectorStore, QuantizedVectorStore
+
+
+# 读取存档中记录的记忆向量
+def load_memories(name):
+    storage_root = f"results/checkpoints/{name}/storage"
+    matrices = []
+    for agent in sorted(os.listdir(storage_root)):
+        path = os.path.join(storage_root, agent, "associate")
+        if os.path.exists(os.path.join(path, "default__vector_store.json")):
+            store = NumpyVectorStore.from_persist_dir(path)
+            if store.nodes_num:
+                matrices.append(np.asarray(store.matrix))
+    if not matrices:
+        raise ValueError(f"no recorded memories found in {storage_root}")
+    return np.concatenate(matrices)
+
+
+# 没有存档时，生成聚簇分布的向量
+def synthetic_memories(count, dim=1024, topics=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    labels = rng.integers(0, topics, count)
+    return centers[labels] + 1.5 * rng.standard_normal((count, dim)).astype(np.float32)
+
+
+def build_store(vectors, ann=None, store_cls=NumpyVectorStore, **kwargs):
+    store = store_cls(ann=ann, **kwargs)
+    nodes = [
+        TextNode(text="", id_=f"node_{i}", embedding=v.tolist(), metadata={"node_type": "event"})
+        for i, v in enumerate(vectors)
+    ]
+    store.add(nodes)
+    return store
+
+
+def run_queries(store, queries, top_k):
+    # Associate restricts the search to the node ids of its memory, newest first
+    node_ids = [f"node_{i}" for i in reversed(range(store.nodes_num))]
+    results, start = [], time.perf_counter()
+    for query in queries:
+        res = store.query(
+            VectorStoreQuery(
+                query_embedding=query.tolist(), similarity_top_k=top_k, node_ids=node_ids
+            )
+        )
+        results.append(set(res.ids))
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall(results, truth):
+    return np.mean([len(r & t) / max(len(t), 1) for r, t in zip(results, truth)])
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--name", type=str, default="", help="the name of the simulation")
+parser.add_argument("--synthetic", type=int, default=20000, help="memories to generate without --name")
+parser.add_argument("--queries", type=int, default=200, help="number of queries")
+parser.add_argument("--top_k", type=int, default=10, help="similarity top k")
+parser.add_argument("--nlist", type=int, default=64, help="buckets of the ann index")
+parser.add_argument("--nprobe", type=str, default="1,2,4,8,16", help="buckets to probe, comma separated")
+parser.add_argument("--rerank", type=str, default="0,1,2,4", help="int8 rerank factors, comma separated")
+args = parser.parse_args()
+
+
+if __name__ == "__main__":
+    vectors = load_memories(args.name) if args.name else synthetic_memories(args.synthetic)
+    rng = np.random.default_rng(1)
+    # 以记录的记忆加噪声作为查询
+    picked = vectors[rng.choice(len(vectors), args.queries)]
+    queries = picked + 0.1 * picked.std() * rng.standard_normal(picked.shape).astype(np.float32)
+    print(f"memories: {len(vectors)}, dim: {vectors.shape[1]}, queries: {args.queries}")
+
+    exact = build_store(vectors)
+    truth, exact_ms = run_queries(exact, queries, args.top_k)
+    print(f"{'exact':<16} recall@{args.top_k} 1.000  {exact_ms:.3f} ms/query")
+
+    store = build_store(vectors, ann={"enable": True, "nlist": args.nlist, "min_train": 0})
+    run_queries(store, queries[:1], args.top_k)  # train the buckets
+    for nprobe in [int(n) for n in args.nprobe.split(",")]:
+        store.ann.nprobe = nprobe
+        results, ann_ms = run_queries(store, queries, args.top_k)
+        print(
+            f"{'nprobe=' + str(nprobe):<16} recall@{args.top_k} {recall(results, truth):.3f}"
+            f"  {ann_ms:.3f} ms/query"
+        )
+
+    # int8 量化：内存占用与召回率
+    float_bytes = exact.matrix.nbytes
+    for rerank in [int(r) for r in args.rerank.split(",")]:
+        with tempfile.TemporaryDirectory() as folder:
+            # 保存后重新加载，与存档恢复时一致：新加入的float32向量写入磁盘并以内存映射读取
+            built = build_store(vectors, store_cls=QuantizedVectorStore, rerank=rerank)
+            built.persist(os.path.join(folder, "default__vector_store.json"))
+            del built
+            store = QuantizedVectorStore.from_persist_dir(folder, rerank=rerank)
+            pending = sum(v.nbytes for v in store._pending.values())
+            int8_bytes = store.matrix.nbytes + store._scales[: store.nodes_num].nbytes + pending
+            mapped = f"  +{float_bytes / 1024:.1f} KB mapped for rerank" if rerank else ""
+            results, int8_ms = run_queries(store, queries, args.top_k)
+            print(
+                f"{'int8 rerank=' + str(rerank):<16} recall@{args.top_k} {recall(results, truth):.3f}"
+                f"  {int8_ms:.3f} ms/query  {int8_bytes / 1024:.1f}/{float_bytes / 1024:.1f} KB"
+                f" ({1 - int8_bytes / float_bytes:.0%} saved in memory){mapped}"
+            )
+            del store
@@ -4,11 +4,101 @@ import os
 import math
 import random
 import datetime
+import contextlib
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from modules import memory, prompt, utils
 from modules.model.llm_model import create_llm_model
 from modules.memory.associate import Concept
 
+DISCARDED_COMPLETIONS_TOTAL = utils.get_or_create_counter(
+    "generative_agents_discarded_completions_total",
+    "Total number of speculative completions thrown away",
+    ["agent"],
+)
+
+_EXECUTOR = None
+
+# the memory accesses of the completions in the context, None to touch the
+# nodes at once, or a list of (agent, node ids) to touch once the output is used
+_ACCESSES = contextvars.ContextVar("accesses", default=None)
+
+
+def _executor():
+    """The thread pool shared by the concurrent completions of all agents"""
+
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="completion")
+    return _EXECUTOR
+
+
+class Ref:
+    """Refer to the output of an earlier call in Agent.completion_many"""
+
+    def __init__(self, idx):
+        self.idx = idx
+
+
+@contextlib.contextmanager
+def collect_accesses():
+    """Collect the memory accesses of the completions started in the context.
+
+    The nodes retrieved to build the prompts are not touched, the collected
+    accesses are applied with touch_accesses once the outputs are used.
+    """
+
+    accesses = []
+    token = _ACCESSES.set(accesses)
+    try:
+        yield accesses
+    finally:
+        _ACCESSES.reset(token)
+
+
+def current_accesses():
+    """The list collecting the memory accesses of the context, None to touch at once"""
+
+    return _ACCESSES.get()
+
+
+def touch_accesses(accesses):
+    for agent, node_ids in accesses:
+        agent.touch_memory(node_ids)
+
+
+class _Speculative:
+    """A speculative completion, its memory accesses are touched once its result is asked"""
+
+    def __init__(self, future, accesses):
+        self._future, self._accesses = future, accesses
+
+    def result(self):
+        output = self._future.result()
+        accesses, self._accesses = self._accesses, []
+        touch_accesses(accesses)
+        return output
+
+    def cancel(self):
+        return self._future.cancel()
+
+
+class _Deferred:
+    """Run the call once its result is asked, the sequential counterpart of a future"""
+
+    def __init__(self, func, *args, **kwargs):
+        self._call, self._done, self._result = (func, args, kwargs), False, None
+
+    def result(self):
+        if not self._done:
+            func, args, kwargs = self._call
+            self._result, self._done = func(*args, **kwargs), True
+        return self._result
+
+    def cancel(self):
+        return not self._done
+
 
 class Agent:
     def __init__(self, config, maze, conversation, logger):
@@ -32,7 +122,12 @@ class Agent:
         self.concepts, self.chats = [], config.get("chats", [])
 
         # prompt
-        self.scratch = prompt.Scratch(self.name, config["currently"], config["scratch"])
+        self.scratch = prompt.Scratch(
+            self.name,
+            config["currently"],
+            config["scratch"],
+            layout=self.think_config.get("prompt_layout", "default"),
+        )
 
         # status
         status = {"poignancy": 0}
@@ -95,6 +190,7 @@ class Agent:
         ), "Can not find func prompt_{} from scratch".format(func_hint)
         func = getattr(self.scratch, "prompt_" + func_hint)
         prompt = func(*args, **kwargs)
+        accessed = prompt.pop("accessed", None)
         title, msg = "{}.{}".format(self.name, func_hint), {}
         if self.llm_available():
             self.logger.info("{} -> {}".format(self.name, func_hint))
@@ -111,18 +207,86 @@ class Agent:
             output = prompt.get("failsafe")
         msg["<OUTPUT>"] = "\n" + str(output) + "\n"
         self.logger.debug(utils.block_msg(title, msg))
+        if accessed:
+            accesses = _ACCESSES.get()
+            if accesses is None:
+                self.touch_memory(accessed)
+            else:
+                accesses.append((self, accessed))
         return output
 
+    def touch_memory(self, node_ids):
+        """Set the access of the nodes retrieved for a completion to now"""
+
+        self.associate.touch(node_ids)
+
+    def completion_async(self, func_hint, *args, **kwargs):
+        """Run the completion on the shared pool, return a future"""
+
+        context = contextvars.copy_context()
+        return _executor().submit(context.run, self.completion, func_hint, *args, **kwargs)
+
+    def completion_many(self, calls):
+        """Run a group of completions, concurrently where they do not depend on each other.
+
+        Parameters
+        ----------
+        calls: list
+            Each call is a tuple of (func_hint, *args), or (agent, func_hint, *args)
+            to complete on another agent. Arguments can be Ref(idx) of an earlier
+            call, the call then waits for that output.
+
+        Returns
+        -------
+        outputs: list
+            The outputs, in the order of calls.
+        """
+
+        # the agent of a call can also be the proxy of an agent on another shard
+        calls = [(self,) + tuple(c) if isinstance(c[0], str) else c for c in calls]
+        deps = [{a.idx for a in c[2:] if isinstance(a, Ref)} for c in calls]
+        for idx, dep in enumerate(deps):
+            assert all(d < idx for d in dep), "call {} refers to a later call".format(idx)
+        outputs = [None] * len(calls)
+
+        def _args(call):
+            return [outputs[a.idx] if isinstance(a, Ref) else a for a in call[2:]]
+
+        if not self.think_config.get("concurrent_completions", False):
+            for idx, call in enumerate(calls):
+                outputs[idx] = call[0].completion(call[1], *_args(call))
+            return outputs
+
+        pending, running, done = list(range(len(calls))), {}, set()
+        while pending or running:
+            for idx in [i for i in pending if deps[i] <= done]:
+                call = calls[idx]
+                running[call[0].completion_async(call[1], *_args(call))] = idx
+                pending.remove(idx)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                idx = running.pop(future)
+                outputs[idx] = future.result()
+                done.add(idx)
+        return outputs
+
     def think(self, status, agents):
-        events = self.move(status["coord"], status.get("path"))
-        plan, _ = self.make_schedule()
+        with utils.agent_scope(self.name), utils.profile("think"):
+            return self._think(status, agents)
+
+    def _think(self, status, agents):
+        with utils.profile("move", "think"):
+            events = self.move(status["coord"], status.get("path"))
+        with utils.profile("make_schedule", "think"):
+            plan, _ = self.make_schedule()
 
         if (plan["describe"] == "sleeping" or "睡" in plan["describe"]) and self.is_awake():
             self.logger.info("{} is going to sleep...".format(self.name))
             address = self.spatial.find_address("Sleep", as_list=True)
             tiles = self.maze.get_address_tiles(address)
             coord = random.choice(list(tiles))
-            events = self.move(coord)
+            with utils.profile("move", "think"):
+                events = self.move(coord)
             self.action = memory.Action(
                 memory.Event(self.name, "正在", "Sleep", address=address, emoji="😴"),
                 memory.Event(
@@ -136,12 +300,16 @@ class Agent:
                 start=utils.get_timer().daily_time(plan["start"]),
             )
         if self.is_awake():
-            self.percept()
-            self.make_plan(agents)
-            self.reflect()
+            with utils.profile("percept", "think"):
+                self.percept()
+            with utils.profile("make_plan", "think"):
+                self.make_plan(agents)
+            with utils.profile("reflect", "think"):
+                self.reflect()
         else:
             if self.action.finished():
-                self.action = self._determine_action()
+                with utils.profile("make_plan", "think"):
+                    self.action = self._determine_action()
 
         emojis = {}
         if self.action:
@@ -150,9 +318,11 @@ class Agent:
             if eve.subject in agents:
                 continue
             emojis[":".join(eve.address)] = {"emoji": eve.emoji, "coord": coord}
+        with utils.profile("find_path", "think"):
+            path = self.find_path(agents)
         self.plan = {
             "name": self.name,
-            "path": self.find_path(agents),
+            "path": path,
             "emojis": emojis,
         }
         return self.plan
@@ -202,10 +372,12 @@ class Agent:
                     "{} retrieved {} concepts".format(self.name, len(retrieved))
                 )
                 if retrieved:
-                    plan = self.completion("retrieve_plan", retrieved)
-                    thought = self.completion("retrieve_thought", retrieved)
-                    self.scratch.currently = self.completion(
-                        "retrieve_currently", plan, thought
+                    _, _, self.scratch.currently = self.completion_many(
+                        [
+                            ("retrieve_plan", retrieved),
+                            ("retrieve_thought", retrieved),
+                            ("retrieve_currently", Ref(0), Ref(1)),
+                        ]
                     )
             # make init schedule
             self.schedule.create = utils.get_timer().get_date()
@@ -266,15 +438,15 @@ class Agent:
                     }
                 )
                 start += duration
-            plan["decompose"] = decompose
+            self.schedule.set_decompose(plan, decompose)
         return self.schedule.current_plan()
 
     def revise_schedule(self, event, start, duration):
         self.action = memory.Action(event, start=start, duration=duration)
         plan, _ = self.schedule.current_plan()
         if len(plan["decompose"]) > 0:
-            plan["decompose"] = self.completion(
-                "schedule_revise", self.action, self.schedule
+            self.schedule.set_decompose(
+                plan, self.completion("schedule_revise", self.action, self.schedule)
             )
 
     def percept(self):
@@ -294,24 +466,29 @@ class Agent:
                     events[event] = dist
         events = list(sorted(events.keys(), key=lambda k: events[k]))
         # get concepts
-        self.concepts, valid_num = [], 0
+        self.concepts, pending = [], []
+        recent_nodes = self.associate.retrieve_events() + self.associate.retrieve_chats()
+        recent_nodes = set(n.describe for n in recent_nodes)
         for idx, event in enumerate(events[: self.percept_config["att_bandwidth"]]):
-            recent_nodes = (
-                self.associate.retrieve_events() + self.associate.retrieve_chats()
-            )
-            recent_nodes = set(n.describe for n in recent_nodes)
-            if event.get_describe() not in recent_nodes:
-                if event.object == "idle" or event.object == "Idle":
-                    node = Concept.from_event(
-                        "idle_" + str(idx), "event", event, poignancy=1
-                    )
-                else:
-                    valid_num += 1
-                    node_type = "chat" if event.fit(self.name, "Conversation") else "event"
-                    node = self._add_concept(node_type, event)
-                    self.status["poignancy"] += node.poignancy
-                self.concepts.append(node)
-        self.concepts = [c for c in self.concepts if c.event.subject != self.name]
+            if event.get_describe() in recent_nodes:
+                continue
+            if event.object == "idle" or event.object == "Idle":
+                self.concepts.append(
+                    Concept.from_event("idle_" + str(idx), "event", event, poignancy=1)
+                )
+            else:
+                recent_nodes.add(event.get_describe())
+                node_type = "chat" if event.fit(self.name, "Conversation") else "event"
+                pending.append((len(self.concepts), (node_type, event, None)))
+                self.concepts.append(None)
+        valid_num = len(pending)
+        # one batched insertion for the step
+        nodes = self._add_concepts([p[1] for p in pending]) if pending else []
+        for (pos, _), node in zip(pending, nodes):
+            self.concepts[pos] = node
+            if node:
+                self.status["poignancy"] += node.poignancy
+        self.concepts = [c for c in self.concepts if c and c.event.subject != self.name]
         self.logger.info(
             "{} percept {}/{} concepts".format(self.name, valid_num, len(self.concepts))
         )
@@ -350,7 +527,9 @@ class Agent:
             #     address=self.get_tile().get_address(),
             # )
             event = self.make_event(self.name, thought, self.get_tile().get_address())
-            return self._add_concept("thought", event, filling=evidence)
+            thoughts.append(("thought", event, evidence))
+
+        thoughts = []
 
         if self.status["poignancy"] < self.think_config["poignancy_max"]:
             return
@@ -371,9 +550,11 @@ class Agent:
         # summary thought
         focus = self.completion("reflect_focus", nodes, 3)
         retrieved = self.associate.retrieve_focus(focus, reduce_all=False)
-        for r_nodes in retrieved.values():
-            thoughts = self.completion("reflect_insights", r_nodes, 5)
-            for thought, evidence in thoughts:
+        insights = self.completion_many(
+            [("reflect_insights", r_nodes, 5) for r_nodes in retrieved.values()]
+        )
+        for batch in insights:
+            for thought, evidence in batch:
                 _add_thought(thought, evidence)
         # summary chats
         if self.chats:
@@ -385,10 +566,16 @@ class Agent:
                 if res and len(res) > 0:
                     node = res[-1]
                     evidence.append(node.node_id)
-            thought = self.completion("reflect_chat_planing", self.chats)
-            _add_thought(f"对于 {self.name} 的Plan：{thought}", evidence)
-            thought = self.completion("reflect_chat_memory", self.chats)
-            _add_thought(f"{self.name} {thought}", evidence)
+            planing, memory_thought = self.completion_many(
+                [
+                    ("reflect_chat_planing", self.chats),
+                    ("reflect_chat_memory", self.chats),
+                ]
+            )
+            _add_thought(f"对于 {self.name} 的Plan：{planing}", evidence)
+            _add_thought(f"{self.name} {memory_thought}", evidence)
+        if thoughts:
+            self._add_concepts(thoughts)
         self.status["poignancy"] = 0
         self.chats = []
 
@@ -533,54 +720,15 @@ class Agent:
             return False
 
         self.logger.info("{} decides chat with {}".format(self.name, other.name))
-        start, chats = utils.get_timer().get_date(), []
-        relations = [
-            self.completion("summarize_relation", self, other.name),
-            other.completion("summarize_relation", other, self.name),
-        ]
-
-        for i in range(self.chat_iter):
-            text = self.completion(
-                "generate_chat", self, other, relations[0], chats
-            )
-
-            if i > 0:
-                # 对于发起Conversation的Agent，从第2轮Conversation开始，检查是否出现“复读”现象
-                end = self.completion(
-                    "generate_chat_check_repeat", self, chats, text
-                )
-                if end:
-                    break
-
-                # 对于发起Conversation的Agent，从第2轮Conversation开始，检查话题是否结束
-                chats.append((self.name, text))
-                end = self.completion(
-                    "decide_chat_terminate", self, other, chats
-                )
-                if end:
-                    break
-            else :
-                chats.append((self.name, text))
-
-            text = other.completion(
-                "generate_chat", other, self, relations[1], chats
-            )
-            if i > 0:
-                # 对于响应Conversation的Agent，从第2轮开始，检查是否出现“复读”现象
-                end = self.completion(
-                    "generate_chat_check_repeat", other, chats, text
-                )
-                if end:
-                    break
-
-            chats.append((other.name, text))
+        start = utils.get_timer().get_date()
+        relations = self.completion_many(
+            [
+                ("summarize_relation", self, other.name),
+                (other, "summarize_relation", other, self.name),
+            ]
+        )
 
-            # 对于响应Conversation的Agent，从第1轮开始，检查话题是否结束
-            end = other.completion(
-                "decide_chat_terminate", other, self, chats
-            )
-            if end:
-                break
+        chats = self._generate_chats(other, relations)
 
         key = utils.get_timer().get_date("%Y%m%d-%H:%M")
         if key not in self.conversation.keys():
@@ -602,6 +750,72 @@ class Agent:
         other.schedule_chat(chats, chat_summary, start, duration, self)
         return True
 
+    def _generate_chats(self, other, relations):
+        """Let self and other take turns to chat.
+
+        With think.speculative_chat, the repeat and terminate checks of a turn
+        run concurrently with the next turn of the partner, and the next turn
+        is thrown away if the checks end the conversation. Otherwise every
+        call runs in series, in the same order as the checks need them.
+        """
+
+        speculative = self.think_config.get("speculative_chat", False)
+
+        def _call(agent, func_hint, *args):
+            if speculative:
+                # a discarded turn leaves the memory of the agent untouched
+                with collect_accesses() as accesses:
+                    return _Speculative(agent.completion_async(func_hint, *args), accesses)
+            return _Deferred(agent.completion, func_hint, *args)
+
+        def _discard(*calls):
+            for call in calls:
+                if call and speculative:
+                    call.cancel()
+                    DISCARDED_COMPLETIONS_TOTAL.labels(agent=self.name).inc()
+
+        chats = []
+        text = self.completion("generate_chat", self, other, relations[0], [])
+        for i in range(self.chat_iter):
+            turn = chats + [(self.name, text)]
+            reply = _call(other, "generate_chat", other, self, relations[1], turn)
+            if i > 0:
+                # 对于发起Conversation的Agent，从第2轮Conversation开始，检查是否出现“复读”现象
+                repeat = _call(self, "generate_chat_check_repeat", self, list(chats), text)
+                # 对于发起Conversation的Agent，从第2轮Conversation开始，检查话题是否结束
+                terminate = _call(self, "decide_chat_terminate", self, other, turn)
+                if repeat.result():
+                    _discard(terminate, reply)
+                    break
+                chats.append((self.name, text))
+                if terminate.result():
+                    _discard(reply)
+                    break
+            else:
+                chats.append((self.name, text))
+
+            text = reply.result()
+            turn = chats + [(other.name, text)]
+            next_text = None
+            if i + 1 < self.chat_iter:
+                next_text = _call(self, "generate_chat", self, other, relations[0], turn)
+            repeat = None
+            if i > 0:
+                # 对于响应Conversation的Agent，从第2轮开始，检查是否出现“复读”现象
+                repeat = _call(self, "generate_chat_check_repeat", other, list(chats), text)
+            # 对于响应Conversation的Agent，从第1轮开始，检查话题是否结束
+            terminate = _call(other, "decide_chat_terminate", other, self, turn)
+            if repeat and repeat.result():
+                _discard(terminate, next_text)
+                break
+            chats.append((other.name, text))
+            if terminate.result():
+                _discard(next_text)
+                break
+            if next_text:
+                text = next_text.result()
+        return chats
+
     def _wait_other(self, other, focus):
         if self._skip_react(other):
             return False
@@ -646,14 +860,8 @@ class Agent:
         expire=None,
         filling=None,
     ):
-        if event.fit(None, "is", "idle"):
-            poignancy = 1
-        elif event.fit(None, "Now", "Idle"):
-            poignancy = 1
-        elif e_type == "chat":
-            poignancy = self.completion("poignancy_chat", event)
-        else:
-            poignancy = self.completion("poignancy_event", event)
+        func_hint = self._poignancy_hint(e_type, event)
+        poignancy = self.completion(func_hint, event) if func_hint else 1
         self.logger.debug("{} add associate {}".format(self.name, event))
         return self.associate.add_node(
             e_type,
@@ -664,6 +872,33 @@ class Agent:
             filling=filling,
         )
 
+    def _add_concepts(self, concepts):
+        """Add concepts of (e_type, event, filling) with one associate insertion"""
+
+        hints = [self._poignancy_hint(e_type, event) for e_type, event, _ in concepts]
+        outputs = iter(
+            self.completion_many(
+                [(h, c[1]) for h, c in zip(hints, concepts) if h]
+            )
+        )
+        nodes = []
+        for hint, (e_type, event, filling) in zip(hints, concepts):
+            self.logger.debug("{} add associate {}".format(self.name, event))
+            nodes.append(
+                {
+                    "node_type": e_type,
+                    "event": event,
+                    "poignancy": next(outputs) if hint else 1,
+                    "filling": filling,
+                }
+            )
+        return self.associate.add_nodes(nodes)
+
+    def _poignancy_hint(self, e_type, event):
+        if event.fit(None, "is", "idle") or event.fit(None, "Now", "Idle"):
+            return None
+        return "poignancy_chat" if e_type == "chat" else "poignancy_event"
+
     def get_tile(self):
         return self.maze.tile_at(self.coord)
 
@@ -5,6 +5,7 @@ import copy
 
 from modules.utils import GenerativeAgentsMap, GenerativeAgentsKey
 from modules import utils
+from modules.storage.vector_store import set_shared_events
 from .maze import Maze
 from .agent import Agent
 
@@ -12,7 +13,7 @@ from .agent import Agent
 class Game:
     """The Game"""
 
-    def __init__(self, name, static_root, config, conversation, logger=None):
+    def __init__(self, name, static_root, config, conversation, logger=None, shared_events=None):
         self.name = name
         self.static_root = static_root
         self.record_iterval = config.get("record_iterval", 30)
@@ -20,6 +21,8 @@ class Game:
         self.maze = Maze(self.load_static(config["maze"]["path"]), self.logger)
         self.conversation = conversation
         self.agents = {}
+        # agents of the other shards, see modules.shard
+        self.remote_agents = {}
         if "agent_base" in config:
             agent_base = config["agent_base"]
         else:
@@ -27,6 +30,8 @@ class Game:
         storage_root = os.path.join(f"results/checkpoints/{name}", "storage")
         if not os.path.isdir(storage_root):
             os.makedirs(storage_root)
+        # embeddings of the event texts, shared by the agents with shared_events
+        set_shared_events(shared_events or os.path.join(storage_root, "_shared"))
         for name, agent in config["agents"].items():
             agent_config = utils.update_dict(
                 copy.deepcopy(agent_base), self.load_static(agent["config_path"])
@@ -41,7 +46,10 @@ class Game:
 
     def agent_think(self, name, status):
         agent = self.get_agent(name)
-        plan = agent.think(status, self.agents)
+        agents = self.agents
+        if self.remote_agents:
+            agents = dict(self.agents, **self.remote_agents)
+        plan = agent.think(status, agents)
         info = {
             "currently": agent.scratch.currently,
             "associate": agent.associate.abstract(),
@@ -69,6 +77,16 @@ class Game:
         self.logger.info("\n{}\n{}\n".format(utils.split_line(title), agent))
         return {"plan": plan, "info": info}
 
+    def step(self, statuses):
+        """Let the agents think in turn, return the think result and checkpoint of each agent"""
+
+        results = {}
+        for name, status in statuses.items():
+            results[name] = self.agent_think(name, status)
+            with utils.agent_scope(name), utils.profile("checkpoint", "agent"):
+                results[name]["checkpoint"] = self.get_agent(name).to_dict()
+        return results
+
     def load_static(self, path):
         return utils.load_dict(os.path.join(self.static_root, path))
 
@@ -79,11 +97,14 @@ class Game:
             self.logger.info("\n{}\n{}\n".format(utils.split_line(title), agent))
 
 
-def create_game(name, static_root, config, conversation, logger=None):
+def create_game(name, static_root, config, conversation, logger=None, shared_events=None):
     """Create the game"""
 
     utils.set_timer(**config.get("time", {}))
-    GenerativeAgentsMap.set(GenerativeAgentsKey.GAME, Game(name, static_root, config, conversation, logger=logger))
+    GenerativeAgentsMap.set(
+        GenerativeAgentsKey.GAME,
+        Game(name, static_root, config, conversation, logger=logger, shared_events=shared_events),
+    )
     return GenerativeAgentsMap.get(GenerativeAgentsKey.GAME)
 
 
@@ -210,6 +210,40 @@ class Maze:
             valid_coords.append(candidate)
         return valid_coords
 
+    def events_state(self):
+        """The events on the tiles as dicts, keyed by the coord of the tiles"""
+
+        return {
+            tile.coord: [e.to_dict() for e in tile.get_events()]
+            for row in self.tiles
+            for tile in row
+            if tile.events
+        }
+
+    @staticmethod
+    def events_diff(before, after):
+        """The events removed from and added to each tile between two events_state"""
+
+        diff = {}
+        for coord in set(before) | set(after):
+            old, new = before.get(coord, []), after.get(coord, [])
+            removed = [e for e in old if e not in new]
+            added = [e for e in new if e not in old]
+            if removed or added:
+                diff[coord] = {"remove": removed, "add": added}
+        return diff
+
+    def apply_events_diff(self, diff):
+        for coord, change in diff.items():
+            tile = self.tile_at(coord)
+            for event in change["remove"]:
+                tile.remove_events(event=Event.from_dict(dict(event)))
+            # a subject keeps one event on a tile, the latest change wins
+            for event in change["add"]:
+                event = Event.from_dict(dict(event))
+                if not tile.update_events(event):
+                    tile.add_event(event)
+
     def get_address_tiles(self, address):
         addr = ":".join(address)
         if addr in self.address_tiles:
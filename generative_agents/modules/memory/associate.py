@@ -1,6 +1,8 @@
 """generative_agents.memory.associate"""
 
 import datetime
+import functools
+import threading
 from llama_index.core.retrievers import BaseRetriever
 from llama_index.core.vector_stores import MetadataFilters, ExactMatchFilter
 from llama_index.core.indices.vector_store.retrievers import VectorIndexRetriever
@@ -9,8 +11,29 @@ from modules.storage.index import LlamaIndex
 from modules import utils
 from .event import Event
 
+ASSOCIATE_MEMO_TOTAL = utils.get_or_create_counter(
+    "generative_agents_associate_memo_total",
+    "Total number of associate retrievals looked up in the memo",
+    ["method", "result"],
+)
+
+
+def _locked(method):
+    """Run the method under the lock of the associate"""
+
+    @functools.wraps(method)
+    def _method(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return _method
+
 
 class Concept:
+    """A memory node, immutable so it can be shared through the concept cache"""
+
+    __slots__ = ("node_id", "node_type", "event", "poignancy", "_create", "_expire", "_access")
+
     def __init__(
         self,
         describe,
@@ -25,18 +48,48 @@ class Concept:
         expire=None,
         access=None,
     ):
-        self.node_id = node_id
-        self.node_type = node_type
-        self.event = Event(
-            subject, predicate, object, describe=describe, address=address.split(":")
+        create = utils.to_epoch(
+            utils.to_date(create) if create else utils.get_timer().get_date()
         )
-        self.poignancy = poignancy
-        self.create = utils.to_date(create) if create else utils.get_timer().get_date()
         if expire:
-            self.expire = utils.to_date(expire)
+            expire = utils.to_epoch(utils.to_date(expire))
         else:
-            self.expire = self.create + datetime.timedelta(days=30)
-        self.access = utils.to_date(access) if access else self.create
+            expire = create + 30 * 24 * 3600
+        access = utils.to_epoch(utils.to_date(access)) if access else create
+        event = Event(subject, predicate, object, describe=describe, address=address.split(":"))
+        self.__setstate__(
+            {
+                "node_id": node_id,
+                "node_type": node_type,
+                "event": event,
+                "poignancy": poignancy,
+                "_create": create,
+                "_expire": expire,
+                "_access": access,
+            }
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Concept is immutable")
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            object.__setattr__(self, key, value)
+
+    @property
+    def create(self):
+        return utils.from_epoch(self._create)
+
+    @property
+    def expire(self):
+        return utils.from_epoch(self._expire)
+
+    @property
+    def access(self):
+        return utils.from_epoch(self._access)
 
     def abstract(self):
         return {
@@ -85,9 +138,7 @@ class AssociateRetriever(BaseRetriever):
         nodes = self._vector_retriever.retrieve(query_bundle)
         if not nodes:
             return []
-        nodes = sorted(
-            nodes, key=lambda n: utils.to_date(n.metadata["access"]), reverse=True
-        )
+        nodes = sorted(nodes, key=lambda n: n.metadata["access"], reverse=True)
         # get scores
         fac = self._config["recency_decay"]
         recency_scores = self._normalize(
@@ -107,10 +158,7 @@ class AssociateRetriever(BaseRetriever):
         }
         # re-rank nodes
         nodes = sorted(nodes, key=lambda n: final_scores[n.id_], reverse=True)
-        nodes = nodes[: self._config["retrieve_max"]]
-        for n in nodes:
-            n.metadata["access"] = utils.get_timer().get_date("%Y%m%d-%H:%M:%S")
-        return nodes
+        return nodes[: self._config["retrieve_max"]]
 
     def _normalize(self, data, factor=1, t_min=0, t_max=1):
         min_val, max_val = min(data), max(data)
@@ -135,6 +183,12 @@ class Associate:
         memory=None,
     ):
         self._index = LlamaIndex(embedding, path)
+        # node_id -> (access, concept), a node is converted again once accessed
+        self._concepts = {}
+        # (method, text) -> (version, concepts), valid for the memory version they are retrieved at
+        self._memo, self._version = {}, 0
+        # the completions served for other shards read the memory while the agent thinks
+        self._lock = threading.RLock()
         self.memory = memory or {"event": [], "thought": [], "chat": []}
         self.cleanup_index()
         self.retention = retention
@@ -147,6 +201,7 @@ class Associate:
             "importance_weight": importance_weight,
         }
 
+    @_locked
     def abstract(self):
         des = {"nodes": self._index.nodes_num}
         for t in ["event", "chat", "thought"]:
@@ -156,50 +211,138 @@ class Associate:
     def __str__(self):
         return utils.dump_dict(self.abstract())
 
+    def _bump_version(self):
+        """Mark the memory changed, the memoized retrievals are dropped"""
+
+        self._version += 1
+        self._memo.clear()
+
+    @property
+    def version(self):
+        return self._version
+
+    @_locked
     def cleanup_index(self):
-        node_ids = self._index.cleanup()
+        node_ids = set(self._index.cleanup())
+        if not node_ids:
+            return
+        self._bump_version()
+        for node_id in node_ids:
+            self._concepts.pop(node_id, None)
         self.memory = {
             n_type: [n for n in nodes if n not in node_ids]
             for n_type, nodes in self.memory.items()
         }
 
-    def add_node(
-        self,
-        node_type,
-        event,
-        poignancy,
-        create=None,
-        expire=None,
-        filling=None,
-    ):
+    def _node_metadata(self, node_type, event, poignancy, create=None, expire=None):
         create = create or utils.get_timer().get_date()
         expire = expire or (create + datetime.timedelta(days=30))
-        metadata = {
+        return {
             "node_type": node_type,
             "subject": event.subject,
             "predicate": event.predicate,
             "object": event.object,
             "address": ":".join(event.address),
             "poignancy": poignancy,
-            "create": create.strftime("%Y%m%d-%H:%M:%S"),
-            "expire": expire.strftime("%Y%m%d-%H:%M:%S"),
-            "access": create.strftime("%Y%m%d-%H:%M:%S"),
+            "create": utils.encode_date(create),
+            "expire": utils.encode_date(expire),
+            "access": utils.encode_date(create),
         }
-        node = self._index.add_node(event.get_describe(), metadata)
+
+    def _remember(self, node_type, node_id):
+        self._bump_version()
         memory = self.memory[node_type]
-        memory.insert(0, node.id_)
+        memory.insert(0, node_id)
         if len(memory) >= self.max_memory > 0:
+            for node_id in memory[self.max_memory:]:
+                self._concepts.pop(node_id, None)
             self._index.remove_nodes(memory[self.max_memory:])
             self.memory[node_type] = memory[: self.max_memory - 1]
+
+    @utils.profiled("associate.insert")
+    @_locked
+    def add_node(
+        self,
+        node_type,
+        event,
+        poignancy,
+        create=None,
+        expire=None,
+        filling=None,
+    ):
+        metadata = self._node_metadata(node_type, event, poignancy, create, expire)
+        node = self._index.add_node(event.get_describe(), metadata)
+        self._remember(node_type, node.id_)
         return self.to_concept(node)
 
+    @utils.profiled("associate.insert")
+    @_locked
+    def add_nodes(self, nodes):
+        """Add a batch of nodes with one index insertion.
+
+        Parameters
+        ----------
+        nodes: list
+            The dicts of add_node arguments.
+
+        Returns
+        -------
+        concepts: list
+            The concepts in the order of nodes, None for the failed ones.
+        """
+
+        batch = [
+            (
+                n["event"].get_describe(),
+                self._node_metadata(
+                    n["node_type"], n["event"], n["poignancy"], n.get("create"), n.get("expire")
+                ),
+            )
+            for n in nodes
+        ]
+        concepts = []
+        for node in self._index.add_nodes(batch):
+            if node is None:
+                concepts.append(None)
+                continue
+            self._remember(node.metadata["node_type"], node.id_)
+            concepts.append(self.to_concept(node))
+        return concepts
+
     def to_concept(self, node):
-        return Concept.from_node(node)
+        access = node.metadata.get("access")
+        cached = self._concepts.get(node.id_)
+        if cached and cached[0] == access:
+            return cached[1]
+        concept = Concept.from_node(node)
+        self._concepts[node.id_] = (access, concept)
+        return concept
 
+    @_locked
     def find_concept(self, node_id):
         return self.to_concept(self._index.find_node(node_id))
 
+    @_locked
+    def _memoized(self, method, text, retrieve):
+        key, version = (method, text), self._version
+        cached = self._memo.get(key)
+        if cached is not None and cached[0] == version:
+            ASSOCIATE_MEMO_TOTAL.labels(method=method, result="hit").inc()
+            return list(cached[1])
+        ASSOCIATE_MEMO_TOTAL.labels(method=method, result="miss").inc()
+        concepts = retrieve()
+        # failed retrievals come back empty, they are tried again; a retrieval
+        # overlapping a change of the memory is not kept for the new version
+        if (concepts or not text) and self._version == version:
+            self._memo[key] = (version, concepts)
+        return list(concepts)
+
     def _retrieve_nodes(self, node_type, text=None):
+        if not self.memory[node_type]:
+            return []
+        return self._memoized(node_type, text, lambda: self._query_nodes(node_type, text))
+
+    def _query_nodes(self, node_type, text=None):
         if text:
             filters = MetadataFilters(
                 filters=[ExactMatchFilter(key="node_type", value=node_type)]
@@ -211,20 +354,26 @@ class Associate:
             nodes = [self._index.find_node(n) for n in self.memory[node_type]]
         return [self.to_concept(n) for n in nodes[: self.retention]]
 
+    @utils.profiled("associate.retrieve")
     def retrieve_events(self, text=None):
         return self._retrieve_nodes("event", text)
 
+    @utils.profiled("associate.retrieve")
     def retrieve_thoughts(self, text=None):
         return self._retrieve_nodes("thought", text)
 
+    @utils.profiled("associate.retrieve")
     def retrieve_chats(self, name=None):
         text = ("Conversation " + name) if name else None
         return self._retrieve_nodes("chat", text)
 
-    def retrieve_focus(self, focus, retrieve_max=30, reduce_all=True):
+    @utils.profiled("associate.retrieve")
+    @_locked
+    def retrieve_focus(self, focus, retrieve_max=30, reduce_all=True, touch=True):
+        config = dict(self._retrieve_config, retrieve_max=retrieve_max)
+
         def _create_retriever(*args, **kwargs):
-            self._retrieve_config["retrieve_max"] = retrieve_max
-            return AssociateRetriever(self._retrieve_config, *args, **kwargs)
+            return AssociateRetriever(config, *args, **kwargs)
 
         retrieved = {}
         node_ids = self.memory["event"] + self.memory["thought"]
@@ -239,13 +388,28 @@ class Associate:
                 retrieved.update({n.id_: n for n in nodes})
             else:
                 retrieved[text] = nodes
+        # without touch, the caller touches the nodes once the retrieval is used
+        touched = {}
         if reduce_all:
-            return [self.to_concept(v) for v in retrieved.values()]
+            if touch:
+                touched = self.touch(list(retrieved))
+            return [self.to_concept(touched.get(n_id, n)) for n_id, n in retrieved.items()]
+        if touch:
+            touched = self.touch([n.id_ for nodes in retrieved.values() for n in nodes])
         return {
-            text: [self.to_concept(n) for n in nodes]
+            text: [self.to_concept(touched.get(n.id_, n)) for n in nodes]
             for text, nodes, in retrieved.items()
         }
 
+    @_locked
+    def touch(self, node_ids):
+        """Set the access of the nodes to now, return the updated nodes by id"""
+
+        nodes = self._index.touch(node_ids)
+        if nodes:
+            self._bump_version()
+        return {n.id_: n for n in nodes}
+
     def get_relation(self, node):
         return {
             "node": node,
@@ -253,6 +417,7 @@ class Associate:
             "thoughts": self.retrieve_thoughts(node.describe),
         }
 
+    @_locked
     def to_dict(self):
         self._index.save()
         return {"memory": self.memory}
@@ -1,7 +1,15 @@
 """generative_agents.memory.event"""
 
+import sys
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
 
 class Event:
+    __slots__ = ("subject", "predicate", "object", "_describe", "address", "emoji")
+
     def __init__(
         self,
         subject,
@@ -11,13 +19,14 @@ class Event:
         describe=None,
         emoji=None,
     ):
-        self.subject = subject
+        # subjects, predicates, objects and addresses repeat across thousands of events
+        self.subject = _intern(subject)
         # self.predicate = predicate or "is"
         # self.object = object or "idle"
-        self.predicate = predicate or "Now"
-        self.object = object or "Idle"
+        self.predicate = _intern(predicate or "Now")
+        self.object = _intern(object or "Idle")
         self._describe = describe or ""
-        self.address = address or []
+        self.address = [_intern(a) for a in address] if address else []
         self.emoji = emoji or ""
 
     def __str__(self):
@@ -50,8 +59,8 @@ class Event:
     def update(self, predicate=None, object=None, describe=None):
         # self.predicate = predicate or "is"
         # self.object = object or "idle"
-        self.predicate = predicate or "Now"
-        self.object = object or "Idle"
+        self.predicate = _intern(predicate or "Now")
+        self.object = _intern(object or "Idle")
         self._describe = describe or self._describe
 
     def to_id(self):
@@ -1,5 +1,7 @@
 """generative_agents.memory.schedule"""
 
+import bisect
+
 from modules import utils
 
 
@@ -12,6 +14,8 @@ class Schedule:
         self.daily_schedule = daily_schedule or []
         self.diversity = diversity
         self.max_try = max_try
+        # sorted end minutes per level, see _ends
+        self._ends_cache = {}
 
     def abstract(self):
         def _to_stamp(plan):
@@ -50,16 +54,46 @@ class Schedule:
 
     def current_plan(self):
         total_minute = utils.get_timer().daily_duration()
-        for plan in self.daily_schedule:
-            if self.plan_stamps(plan)[1] <= total_minute:
-                continue
-            for de_plan in plan.get("decompose", []):
-                if self.plan_stamps(de_plan)[1] <= total_minute:
-                    continue
-                return plan, de_plan
-            return plan, plan
-        last_plan = self.daily_schedule[-1]
-        return last_plan, last_plan
+        idx = bisect.bisect_right(self._ends(self.daily_schedule), total_minute)
+        if idx >= len(self.daily_schedule):
+            last_plan = self.daily_schedule[-1]
+            return last_plan, last_plan
+        plan = self.daily_schedule[idx]
+        decompose = plan.get("decompose") or []
+        de_idx = bisect.bisect_right(self._ends(decompose), total_minute)
+        if de_idx < len(decompose):
+            return plan, decompose[de_idx]
+        return plan, plan
+
+    def next_boundary(self):
+        """The minute of the day when the current (decomposed) plan ends"""
+
+        _, de_plan = self.current_plan()
+        return de_plan["start"] + de_plan["duration"]
+
+    def set_decompose(self, plan, decompose):
+        self._ends_cache.pop(id(plan.get("decompose")), None)
+        plan["decompose"] = decompose
+        return plan
+
+    def _ends(self, plans):
+        """Running maximum of the end minutes, so the first plan that ends after
+        a minute is found by bisect. Cached per list and extended as plans are
+        appended, set_decompose drops the cache of a replaced list."""
+
+        cached = self._ends_cache.get(id(plans))
+        if cached and cached[0] is plans and len(cached[1]) == len(plans):
+            return cached[1]
+        extend = cached and cached[0] is plans and len(cached[1]) < len(plans)
+        ends = cached[1][:] if extend else []
+        last = ends[-1] if ends else float("-inf")
+        for plan in plans[len(ends):]:
+            last = max(last, plan["start"] + plan["duration"])
+            ends.append(last)
+        if len(self._ends_cache) > 64:
+            self._ends_cache.clear()
+        self._ends_cache[id(plans)] = (plans, ends)
+        return ends
 
     def plan_stamps(self, plan, time_format=None):
         def _to_date(minutes):
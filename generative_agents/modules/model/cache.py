@@ -0,0 +1,158 @@
+"""generative_agents.model.cache"""
+
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from modules.utils.metrics import get_or_create_counter, get_or_create_gauge
+from modules.utils.namespace import GenerativeAgentsMap, GenerativeAgentsKey
+
+LLM_CACHE_REQUESTS_TOTAL = get_or_create_counter(
+    "llm_semantic_cache_requests_total",
+    "Total number of semantic cache lookups",
+    ["caller", "result"],
+)
+LLM_CACHE_EVICTIONS_TOTAL = get_or_create_counter(
+    "llm_semantic_cache_evictions_total", "Total number of evicted cache entries", ["reason"]
+)
+LLM_CACHE_ENTRIES = get_or_create_gauge(
+    "llm_semantic_cache_entries", "Number of entries in the semantic cache"
+)
+
+_VOLATILE_PATTERNS = [
+    (re.compile(r"\d{4}[-/年]\d{1,2}[-/月]\d{1,2}日?"), "<date>"),
+    (re.compile(r"\d{1,2}:\d{2}(:\d{2})?"), "<time>"),
+    (re.compile(r"（星期.）|\((Mon|Tues|Wednes|Thurs|Fri|Satur|Sun)day\)"), ""),
+]
+
+
+def normalize_prompt(prompt):
+    """Mask the dates and times, and collapse the whitespaces"""
+
+    for pattern, replace in _VOLATILE_PATTERNS:
+        prompt = pattern.sub(replace, prompt)
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+
+def _default_embed(text):
+    from llama_index.core import Settings
+
+    # the embed model configured by LlamaIndex of the agents
+    return Settings.embed_model.get_text_embedding(text)
+
+
+class _Entry:
+    def __init__(self, caller, model, text, vector, response):
+        self.caller, self.model, self.text = caller, model, text
+        self.vector, self.response = vector, response
+        self.create = time.time()
+
+
+class SemanticCache:
+    """Reuse responses of near-duplicate prompts of the allowed callers.
+
+    Prompts are normalized and embedded, a cached response is reused when
+    the cosine similarity to a prompt of the same caller and model reaches
+    the threshold. Entries expire after ttl seconds, and the least recently
+    used ones are evicted beyond max_entries.
+    """
+
+    def __init__(self, callers, threshold=0.95, ttl=3600, max_entries=1024, embed=None):
+        self.callers = set(callers)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._embed = embed or _default_embed
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def enabled(self, caller):
+        return caller in self.callers
+
+    def _vector(self, text):
+        vector = np.asarray(self._embed(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _expire(self):
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if now - e.create > self.ttl]:
+            self._entries.pop(key)
+            LLM_CACHE_EVICTIONS_TOTAL.labels(reason="ttl").inc()
+
+    def lookup(self, caller, model, prompt):
+        """Find the cached response of the prompt.
+
+        Returns
+        -------
+        response: str or None
+            The cached response, None if missed.
+        vector: np.ndarray or None
+            The embedding of the normalized prompt, to be passed to store.
+        """
+
+        text = normalize_prompt(prompt)
+        with self._lock:
+            self._expire()
+            candidates = [
+                (k, e) for k, e in self._entries.items() if e.caller == caller and e.model == model
+            ]
+            exact = [k for k, e in candidates if e.text == text]
+        vector = None
+        if exact:
+            key = exact[0]
+        elif candidates:
+            vector = self._vector(text)
+            scores = np.stack([e.vector for _, e in candidates]) @ vector
+            best = int(np.argmax(scores))
+            key = candidates[best][0] if scores[best] >= self.threshold else None
+        else:
+            key = None
+        with self._lock:
+            entry = self._entries.get(key) if key is not None else None
+            if entry:
+                self._entries.move_to_end(key)
+        LLM_CACHE_REQUESTS_TOTAL.labels(caller=caller, result="hit" if entry else "miss").inc()
+        return (entry.response if entry else None), vector
+
+    def store(self, caller, model, prompt, response, vector=None):
+        text = normalize_prompt(prompt)
+        if vector is None:
+            vector = self._vector(text)
+        with self._lock:
+            self._entries[self._next_id] = _Entry(caller, model, text, vector, response)
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                LLM_CACHE_EVICTIONS_TOTAL.labels(reason="lru").inc()
+            LLM_CACHE_ENTRIES.set(len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def set_response_cache(config=None, embed=None):
+    """Create the process-wide response cache, None config removes it"""
+
+    if config is None:
+        GenerativeAgentsMap.delete(GenerativeAgentsKey.RESPONSE_CACHE)
+        return None
+    GenerativeAgentsMap.set(
+        GenerativeAgentsKey.RESPONSE_CACHE,
+        SemanticCache(
+            config.get("callers", []),
+            threshold=config.get("threshold", 0.95),
+            ttl=config.get("ttl", 3600),
+            max_entries=config.get("max_entries", 1024),
+            embed=embed,
+        ),
+    )
+    return GenerativeAgentsMap.get(GenerativeAgentsKey.RESPONSE_CACHE)
+
+
+def get_response_cache():
+    return GenerativeAgentsMap.get(GenerativeAgentsKey.RESPONSE_CACHE)
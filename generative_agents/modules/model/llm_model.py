@@ -1,51 +1,135 @@
 """generative_agents.model.llm_model"""
 
+import os
 import time
 import re
+import threading
+import json
 import requests
-from prometheus_client import Counter, Histogram, REGISTRY
-
-# Prometheus metrics for Ollama usage and performance (idempotent creation)
-
-def _get_or_create_counter(name, documentation, labelnames=()):
-    try:
-        return Counter(name, documentation, labelnames)
-    except ValueError:
-        # Already registered in the default registry; reuse existing collector
-        return REGISTRY._names_to_collectors[name]  # type: ignore[attr-defined]
 
+from modules.utils.metrics import current_agent, get_or_create_counter, get_or_create_histogram
+from . import structured as structured_output
+from .scheduler import get_scheduler, schedule, set_scheduler
+from .cache import get_response_cache, set_response_cache
+from .singleflight import SingleFlight
+from .resilience import LLM_SHORT_CIRCUITS_TOTAL, PoolGuard, get_endpoint_guard
 
-def _get_or_create_histogram(name, documentation):
-    try:
-        return Histogram(name, documentation)
-    except ValueError:
-        return REGISTRY._names_to_collectors[name]  # type: ignore[attr-defined]
-
+# Prometheus metrics for Ollama usage and performance (idempotent creation)
 
-OLLAMA_REQUESTS_TOTAL = _get_or_create_counter(
+OLLAMA_REQUESTS_TOTAL = get_or_create_counter(
     "ollama_requests_total", "Total number of Ollama requests", ["status"]
 )
-OLLAMA_REQUEST_LATENCY_SECONDS = _get_or_create_histogram(
+OLLAMA_REQUEST_LATENCY_SECONDS = get_or_create_histogram(
     "ollama_request_latency_seconds", "Latency of Ollama requests in seconds"
 )
-OLLAMA_PROMPT_TOKENS = _get_or_create_counter(
+OLLAMA_PROMPT_TOKENS = get_or_create_counter(
     "ollama_prompt_tokens_total", "Total prompt tokens returned by Ollama"
 )
-OLLAMA_COMPLETION_TOKENS = _get_or_create_counter(
+OLLAMA_COMPLETION_TOKENS = get_or_create_counter(
     "ollama_completion_tokens_total", "Total completion tokens returned by Ollama"
 )
-OLLAMA_TOTAL_TOKENS = _get_or_create_counter(
+OLLAMA_TOTAL_TOKENS = get_or_create_counter(
     "ollama_total_tokens_total", "Total tokens (prompt+completion) returned by Ollama"
 )
 
+# Provider independent metrics, labelled by the prompt type (caller) and model
+
+LLM_REQUESTS_TOTAL = get_or_create_counter(
+    "llm_requests_total", "Total number of LLM requests", ["caller", "model", "status"]
+)
+LLM_REQUEST_LATENCY_SECONDS = get_or_create_histogram(
+    "llm_request_latency_seconds",
+    "Latency of LLM requests in seconds",
+    ["caller", "model"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+LLM_PROMPT_TOKENS = get_or_create_counter(
+    "llm_prompt_tokens_total", "Total prompt tokens reported by the LLM", ["caller", "model"]
+)
+LLM_COMPLETION_TOKENS = get_or_create_counter(
+    "llm_completion_tokens_total",
+    "Total completion tokens reported by the LLM",
+    ["caller", "model"],
+)
+LLM_RETRIES_TOTAL = get_or_create_counter(
+    "llm_retries_total", "Total number of retried LLM completions", ["caller", "model"]
+)
+LLM_CALLBACK_FAILURES_TOTAL = get_or_create_counter(
+    "llm_callback_failures_total",
+    "Total number of LLM responses rejected by the callback",
+    ["caller", "model"],
+)
+LLM_FAILSAFE_TOTAL = get_or_create_counter(
+    "llm_failsafe_total", "Total number of completions answered by failsafe", ["caller", "model"]
+)
+LLM_RETRIES_AVOIDED_TOTAL = get_or_create_counter(
+    "llm_retries_avoided_total",
+    "Total number of structured responses salvaged by the repair pass instead of a retry",
+    ["caller", "model"],
+)
+LLM_STREAM_EARLY_STOPS_TOTAL = get_or_create_counter(
+    "llm_stream_early_stops_total",
+    "Total number of streamed completions stopped once the answer was decided",
+    ["model"],
+)
+LLM_COALESCED_TOTAL = get_or_create_counter(
+    "llm_coalesced_total",
+    "Total number of completions answered by an identical in-flight request",
+    ["caller", "model"],
+)
+LLM_PROMPT_CHARS_TOTAL = get_or_create_counter(
+    "llm_prompt_chars_total", "Total characters of the prompts sent by the agent", ["agent"]
+)
+LLM_PROMPT_SHARED_PREFIX_CHARS_TOTAL = get_or_create_counter(
+    "llm_prompt_shared_prefix_chars_total",
+    "Total characters of the prompts shared as prefix with the previous prompt of the agent",
+    ["agent"],
+)
+LLM_PROMPT_SHARED_PREFIX_RATIO = get_or_create_histogram(
+    "llm_prompt_shared_prefix_ratio",
+    "Ratio of the prompt shared as prefix with the previous prompt of the agent",
+    ["caller"],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+LLM_POOL_ROUTES_TOTAL = get_or_create_counter(
+    "llm_pool_routes_total",
+    "Total number of pooled requests routed to the endpoint",
+    ["endpoint", "sticky"],
+)
+LLM_POOL_HEALTH_CHECKS_TOTAL = get_or_create_counter(
+    "llm_pool_health_checks_total",
+    "Total number of health checks on pooled endpoints",
+    ["endpoint", "status"],
+)
+
+
+_FLIGHTS = SingleFlight()
+
+
+class _CallState(threading.local):
+    """State of the ongoing completion, one per thread"""
+
+    def __init__(self):
+        self.meta_responses, self.usage, self.caller = [], {}, None
+
 
 class LLMModel:
     def __init__(self, config):
         self._api_key = config["api_key"]
         self._base_url = config["base_url"]
         self._model = config["model"]
-        self._meta_responses = []
         self._summary = {"total": [0, 0, 0]}
+        self._local = _CallState()
+        self._lock = threading.Lock()
+        self._last_prompt = ""
+        self._structured_output = config.get("structured_output", False)
+        self._stream = config.get("stream", False)
+        self._coalesce_callers = set(config.get("coalesce_callers", []))
+        self._guard = self._create_guard(config)
+        if config.get("scheduler") and get_scheduler() is None:
+            set_scheduler(config["scheduler"])
+        if config.get("semantic_cache") and get_response_cache() is None:
+            set_response_cache(config["semantic_cache"])
 
         self._handle = self.setup(config)
         self._enabled = True
@@ -55,6 +139,9 @@ class LLMModel:
             "setup is not support for " + str(self.__class__)
         )
 
+    def _create_guard(self, config):
+        return get_endpoint_guard(self._base_url, config.get("resilience"))
+
     def completion(
         self,
         prompt,
@@ -62,39 +149,152 @@ class LLMModel:
         callback=None,
         failsafe=None,
         caller="llm_normal",
+        structured=None,
+        early_stop=None,
         **kwargs
     ):
-        response, self._meta_responses = None, []
-        self._summary.setdefault(caller, [0, 0, 0])
-        for _ in range(retry):
+        response, self._local.meta_responses = None, []
+        with self._lock:
+            self._summary.setdefault(caller, [0, 0, 0])
+        labels = {"caller": caller, "model": self._model}
+        self._record_prompt_prefix(prompt, caller)
+        if structured and self._structured_output:
+            kwargs["schema"] = structured["schema"]
+            callback = self._structured_callback(structured, caller)
+        elif early_stop and self._stream:
+            kwargs["early_stop"] = early_stop
+        cache, vector = get_response_cache(), None
+        if cache is not None and cache.enabled(caller):
             try:
-                meta_response = self._completion(prompt, **kwargs).strip()
-                self._meta_responses.append(meta_response)
+                meta_response, vector = cache.lookup(caller, self._model, prompt)
+            except Exception as e:
+                print(f"LLMModel.completion() caused an error: {e}")
+                cache, meta_response = None, None
+            if meta_response is not None:
+                try:
+                    response = callback(meta_response) if callback else meta_response
+                except Exception:
+                    response = None
+                if response is not None:
+                    # the cached response still goes through the callback of this prompt
+                    self._local.meta_responses.append(meta_response)
+                    return response or failsafe
+        else:
+            cache = None
+        for idx in range(retry):
+            if not self._guard.breaker.allow():
+                # fail fast instead of piling retries onto an unhealthy endpoint
+                LLM_SHORT_CIRCUITS_TOTAL.labels(endpoint=self._base_url, caller=caller).inc()
+                break
+            if idx > 0:
+                LLM_RETRIES_TOTAL.labels(**labels).inc()
+            try:
+                meta_response = self._coalesced_completion(prompt, caller, **kwargs)
+            except Exception as e:
+                print(f"LLMModel.completion() caused an error: {e}")
+                if not self._guard.breaker.is_open():
+                    time.sleep(5)
+                response = None
+                continue
+            self._local.meta_responses.append(meta_response)
+            with self._lock:
                 self._summary["total"][0] += 1
                 self._summary[caller][0] += 1
-                if callback:
-                    response = callback(meta_response)
-                else:
-                    response = meta_response
+            try:
+                response = callback(meta_response) if callback else meta_response
             except Exception as e:
+                LLM_CALLBACK_FAILURES_TOTAL.labels(**labels).inc()
                 print(f"LLMModel.completion() caused an error: {e}")
                 time.sleep(5)
                 response = None
                 continue
             if response is not None:
+                if cache is not None:
+                    try:
+                        cache.store(caller, self._model, prompt, meta_response, vector)
+                    except Exception as e:
+                        print(f"LLMModel.completion() caused an error: {e}")
                 break
         pos = 2 if response is None else 1
-        self._summary["total"][pos] += 1
-        self._summary[caller][pos] += 1
+        with self._lock:
+            self._summary["total"][pos] += 1
+            self._summary[caller][pos] += 1
+        if response is None:
+            LLM_FAILSAFE_TOTAL.labels(**labels).inc()
         return response or failsafe
 
+    def _coalesced_completion(self, prompt, caller, **kwargs):
+        """Share the request with identical in-flight ones when the answer is deterministic"""
+
+        def _request():
+            with schedule(caller, current_agent()):
+                return self._timed_completion(prompt, caller, **kwargs)
+
+        if kwargs.get("temperature") != 0 and caller not in self._coalesce_callers:
+            return _request()
+        key = (
+            self._model,
+            self._base_url,
+            prompt,
+            kwargs.get("temperature"),
+            json.dumps(kwargs.get("schema"), sort_keys=True),
+        )
+        meta_response, shared = _FLIGHTS.do(key, _request)
+        if shared:
+            LLM_COALESCED_TOTAL.labels(caller=caller, model=self._model).inc()
+        return meta_response
+
+    def _timed_completion(self, prompt, caller, **kwargs):
+        labels = {"caller": caller, "model": self._model}
+        start, status = time.time(), "error"
+        self._local.usage, self._local.caller = {}, caller
+        try:
+            with self._guard.request(caller):
+                meta_response = self._completion(prompt, **kwargs).strip()
+            status = "success"
+            return meta_response
+        finally:
+            LLM_REQUEST_LATENCY_SECONDS.labels(**labels).observe(time.time() - start)
+            LLM_REQUESTS_TOTAL.labels(status=status, **labels).inc()
+            if isinstance(self._local.usage.get("prompt_tokens"), int):
+                LLM_PROMPT_TOKENS.labels(**labels).inc(self._local.usage["prompt_tokens"])
+            if isinstance(self._local.usage.get("completion_tokens"), int):
+                LLM_COMPLETION_TOKENS.labels(**labels).inc(self._local.usage["completion_tokens"])
+
+    def _record_prompt_prefix(self, prompt, caller):
+        """Measure how much of the prompt could be served from the prefix cache"""
+
+        shared = len(os.path.commonprefix([self._last_prompt, prompt]))
+        self._last_prompt = prompt
+        agent = current_agent()
+        LLM_PROMPT_CHARS_TOTAL.labels(agent=agent).inc(len(prompt))
+        LLM_PROMPT_SHARED_PREFIX_CHARS_TOTAL.labels(agent=agent).inc(shared)
+        if prompt:
+            LLM_PROMPT_SHARED_PREFIX_RATIO.labels(caller=caller).observe(shared / len(prompt))
+
+    def _structured_callback(self, structured, caller):
+        def _callback(response):
+            data, repaired = structured_output.loads(response, structured["schema"])
+            output = structured["callback"](data)
+            # the repair avoided a retry only if the repaired data is accepted
+            if repaired and output is not None:
+                LLM_RETRIES_AVOIDED_TOTAL.labels(caller=caller, model=self._model).inc()
+            return output
+
+        return _callback
+
+    def _set_usage(self, usage):
+        """Record the token usage of the ongoing request"""
+
+        self._local.usage = usage if isinstance(usage, dict) else {}
+
     def _completion(self, prompt, **kwargs):
         raise NotImplementedError(
             "_completion is not support for " + str(self.__class__)
         )
 
     def is_available(self):
-        return self._enabled  # and self._summary["total"][2] <= 10
+        return self._enabled and not self._guard.breaker.is_open()
 
     def get_summary(self):
         des = {}
@@ -107,7 +307,43 @@ class LLMModel:
 
     @property
     def meta_responses(self):
-        return self._meta_responses
+        return self._local.meta_responses
+
+
+def _visible_text(text):
+    """Drop the think block, including one still being streamed"""
+
+    return re.sub(r"<think>.*?(</think>|$)", "", text, flags=re.DOTALL)
+
+
+def _read_stream(chunks, early_stop):
+    """Concatenate streamed chunks until early_stop decides the answer.
+
+    Parameters
+    ----------
+    chunks: iterable
+        The (content, usage) pairs of the streamed chunks.
+    early_stop: callable
+        Called with the visible text received so far, returns True once the
+        answer is decided.
+
+    Returns
+    -------
+    content: str
+        The received content.
+    usage: dict
+        The usage reported by the stream, usually absent if stopped early.
+    stopped: bool
+        Whether the stream was stopped early.
+    """
+
+    content, usage = "", {}
+    for delta, chunk_usage in chunks:
+        content += delta or ""
+        usage = chunk_usage or usage
+        if early_stop(_visible_text(content)):
+            return content, usage, True
+    return content, usage, False
 
 
 class OpenAILLMModel(LLMModel):
@@ -116,21 +352,65 @@ class OpenAILLMModel(LLMModel):
 
         return OpenAI(api_key=self._api_key, base_url=self._base_url)
 
-    def _completion(self, prompt, temperature=0.5):
+    def _completion(self, prompt, temperature=0.5, schema=None, early_stop=None):
+        kwargs = {}
+        if schema:
+            prompt += structured_output.STRUCTURED_HINT.format(
+                json.dumps(schema, ensure_ascii=False)
+            )
+            kwargs["response_format"] = structured_output.response_format(schema)
         messages = [{"role": "user", "content": prompt}]
+        if early_stop:
+            return self._stream_completion(messages, temperature, early_stop)
         response = self._handle.chat.completions.create(
-            model=self._model, messages=messages, temperature=temperature
+            model=self._model, messages=messages, temperature=temperature, **kwargs
         )
+        if response.usage:
+            self._set_usage(
+                {
+                    "prompt_tokens": response.usage.prompt_tokens,
+                    "completion_tokens": response.usage.completion_tokens,
+                }
+            )
         if len(response.choices) > 0:
             return response.choices[0].message.content
         return ""
 
+    def _stream_completion(self, messages, temperature, early_stop):
+        stream = self._handle.chat.completions.create(
+            model=self._model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+
+        def _chunks():
+            for chunk in stream:
+                usage = None
+                if chunk.usage:
+                    usage = {
+                        "prompt_tokens": chunk.usage.prompt_tokens,
+                        "completion_tokens": chunk.usage.completion_tokens,
+                    }
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                yield delta, usage
+
+        try:
+            content, usage, stopped = _read_stream(_chunks(), early_stop)
+        finally:
+            stream.close()
+        if stopped:
+            LLM_STREAM_EARLY_STOPS_TOTAL.labels(model=self._model).inc()
+        self._set_usage(usage)
+        return content
+
 
 class OllamaLLMModel(LLMModel):
     def setup(self, config):
         return None
 
-    def ollama_chat(self, messages, temperature):
+    def ollama_chat(self, messages, temperature, response_format=None, early_stop=None):
         headers = {
             "Content-Type": "application/json"
         }
@@ -138,8 +418,12 @@ class OllamaLLMModel(LLMModel):
             "model": self._model,
             "messages": messages,
             "temperature": temperature,
-            "stream": False,
+            "stream": bool(early_stop),
         }
+        if response_format:
+            params["response_format"] = response_format
+        if early_stop:
+            params["stream_options"] = {"include_usage": True}
 
         start = time.time()
         status = "error"
@@ -148,11 +432,14 @@ class OllamaLLMModel(LLMModel):
                 url=f"{self._base_url}/chat/completions",
                 headers=headers,
                 json=params,
-                stream=False,
+                stream=bool(early_stop),
                 timeout=60
             )
             response.raise_for_status()
-            data = response.json()
+            if early_stop:
+                data = self._read_ollama_stream(response, early_stop)
+            else:
+                data = response.json()
             status = "success"
             # Try to read usage from OpenAI-compatible response
             usage = data.get("usage", {})
@@ -172,12 +459,44 @@ class OllamaLLMModel(LLMModel):
             OLLAMA_REQUEST_LATENCY_SECONDS.observe(elapsed)
             OLLAMA_REQUESTS_TOTAL.labels(status=status).inc()
 
-    def _completion(self, prompt, temperature=0.5):
+    def _read_ollama_stream(self, response, early_stop):
+        """Read the server-sent events into the shape of a full response"""
+
+        def _chunks():
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                choices = chunk.get("choices") or [{}]
+                yield (choices[0].get("delta") or {}).get("content"), chunk.get("usage")
+
+        try:
+            content, usage, stopped = _read_stream(_chunks(), early_stop)
+        finally:
+            response.close()
+        if stopped:
+            LLM_STREAM_EARLY_STOPS_TOTAL.labels(model=self._model).inc()
+        return {"choices": [{"message": {"content": content}}], "usage": usage}
+
+    def _completion(self, prompt, temperature=0.5, schema=None, early_stop=None):
+        kwargs = {}
+        if schema:
+            prompt += structured_output.STRUCTURED_HINT.format(
+                json.dumps(schema, ensure_ascii=False)
+            )
+            kwargs["response_format"] = structured_output.response_format(schema)
+        if early_stop:
+            kwargs["early_stop"] = early_stop
         if "qwen3" in self._model and "\n/nothink" not in prompt:
             # 针对Qwen3模型禁用think，提高推理速度
             prompt += "\n/nothink"
         messages = [{"role": "user", "content": prompt}]
-        response = self.ollama_chat(messages=messages, temperature=temperature)
+        response = self.ollama_chat(messages=messages, temperature=temperature, **kwargs)
+        if response:
+            self._set_usage(response.get("usage"))
         if response and len(response["choices"]) > 0:
             ret = response["choices"][0]["message"]["content"]
             # 从输出结果中过滤掉<think>标签内的文字，以免影响后续逻辑
@@ -185,12 +504,161 @@ class OllamaLLMModel(LLMModel):
         return ""
 
 
+class PooledLLMModel(LLMModel):
+    """Route requests over several endpoints serving the same model.
+
+    Each request goes to the healthy endpoint with the fewest outstanding
+    requests (routing "least_outstanding") or the lowest moving average
+    latency (routing "ewma"). One model serves one agent, so with sticky
+    enabled the agent keeps using its last endpoint until that endpoint
+    is unhealthy or saturated, which lets the server reuse the KV cache of
+    the agent's prompt prefix. Outstanding requests, latency and health
+    are read from the endpoint guards shared by the whole process, and the
+    endpoints with an open circuit are probed in the background every
+    health_check_interval seconds.
+    """
+
+    def __init__(self, config):
+        config = dict(config)
+        config.setdefault("base_url", "pool")
+        super().__init__(config)
+
+    def _create_guard(self, config):
+        # the pool is guarded by its endpoints, it has no endpoint guard of its own
+        return None
+
+    def setup(self, config):
+        self._routing = config.get("routing", "least_outstanding")
+        self._sticky_enabled = config.get("sticky", True)
+        self._sticky = None
+        backend_config = {
+            k: v
+            for k, v in config.items()
+            if k not in ("endpoints", "routing", "sticky", "health_check_interval")
+        }
+        backend_config["provider"] = config.get("backend", "ollama")
+        self._backends = []
+        for endpoint in config["endpoints"]:
+            if isinstance(endpoint, str):
+                endpoint = {"base_url": endpoint}
+            self._backends.append(create_llm_model({**backend_config, **endpoint}))
+        self._guard = PoolGuard([b._guard for b in self._backends])
+        interval = config.get("health_check_interval", 30)
+        if interval > 0:
+            _HEALTH_CHECKER.watch(self._backends, interval)
+        return None
+
+    def _completion(self, prompt, **kwargs):
+        backend = self._select_backend()
+        LLM_POOL_ROUTES_TOTAL.labels(
+            endpoint=backend._base_url, sticky=str(backend is self._sticky)
+        ).inc()
+        self._sticky = backend
+        try:
+            with backend._guard.request(self._local.caller):
+                return backend._completion(prompt, **kwargs)
+        finally:
+            self._set_usage(backend._local.usage)
+
+    def _select_backend(self):
+        def _load(backend):
+            limiter = backend._guard.limiter
+            if self._routing == "ewma":
+                return (limiter.latency or 0, limiter.inflight)
+            return (limiter.inflight, limiter.latency or 0)
+
+        candidates = sorted(
+            [b for b in self._backends if b._guard.breaker.state != "open"], key=_load
+        )
+        sticky = self._sticky if self._sticky_enabled else None
+        if sticky in candidates and sticky._guard.breaker.state == "closed":
+            if sticky._guard.limiter.inflight < sticky._guard.limiter.limit:
+                candidates.remove(sticky)
+                candidates.insert(0, sticky)
+        for backend in candidates:
+            if backend._guard.breaker.allow():
+                return backend
+        raise RuntimeError("no healthy endpoint in the pool")
+
+    def check_health(self, timeout=5):
+        """Probe the endpoints with an open or half open circuit"""
+
+        for backend in self._backends:
+            if backend._guard.breaker.state != "closed":
+                _probe_endpoint(backend, timeout)
+
+    @property
+    def backends(self):
+        return self._backends
+
+
+def _probe_endpoint(backend, timeout=5):
+    """Probe the endpoint of the model, and update its circuit"""
+
+    headers = {}
+    if backend._api_key:
+        headers["Authorization"] = "Bearer " + backend._api_key
+    try:
+        response = requests.get(f"{backend._base_url}/models", headers=headers, timeout=timeout)
+        response.raise_for_status()
+        backend._guard.breaker.record_success()
+        status = "success"
+    except Exception:
+        backend._guard.breaker.record_failure()
+        status = "error"
+    LLM_POOL_HEALTH_CHECKS_TOTAL.labels(endpoint=backend._base_url, status=status).inc()
+
+
+class _HealthChecker:
+    """Probe the unhealthy endpoints of all pools from one background thread.
+
+    Healthy endpoints are not probed, their failures are seen by the
+    requests. The probes never run in the request path.
+    """
+
+    def __init__(self):
+        self._backends, self._interval = {}, None
+        self._lock, self._thread = threading.Lock(), None
+
+    def watch(self, backends, interval):
+        with self._lock:
+            for backend in backends:
+                self._backends.setdefault(backend._base_url, backend)
+            self._interval = min(self._interval or interval, interval)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="llm-health-check", daemon=True
+                )
+                self._thread.start()
+
+    def check(self, timeout=5):
+        with self._lock:
+            backends = list(self._backends.values())
+        for backend in backends:
+            if backend._guard.breaker.state != "closed":
+                _probe_endpoint(backend, timeout)
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"_HealthChecker.check() caused an error: {e}")
+
+
+_HEALTH_CHECKER = _HealthChecker()
+
+
 def create_llm_model(llm_config):
     """Create llm model"""
 
     if llm_config["provider"] == "ollama":
         return OllamaLLMModel(llm_config)
 
+    elif llm_config["provider"] == "pool":
+        return PooledLLMModel(llm_config)
+
     elif llm_config["provider"] == "openai":
         return OpenAILLMModel(llm_config)
     else:
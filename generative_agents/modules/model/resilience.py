@@ -0,0 +1,245 @@
+"""generative_agents.model.resilience"""
+
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+from modules.utils.metrics import get_or_create_counter, get_or_create_gauge
+
+LLM_CIRCUIT_STATE = get_or_create_gauge(
+    "llm_circuit_state", "Circuit state of the LLM endpoint, 0 closed/1 half_open/2 open", ["endpoint"]
+)
+LLM_CONCURRENCY_LIMIT = get_or_create_gauge(
+    "llm_concurrency_limit", "Adaptive concurrency limit of the LLM endpoint", ["endpoint"]
+)
+LLM_INFLIGHT_REQUESTS = get_or_create_gauge(
+    "llm_inflight_requests", "In-flight requests of the LLM endpoint", ["endpoint"]
+)
+LLM_SHORT_CIRCUITS_TOTAL = get_or_create_counter(
+    "llm_short_circuits_total",
+    "Total number of completions failed fast because the circuit is open",
+    ["endpoint", "caller"],
+)
+
+_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitBreaker:
+    """Open the circuit after consecutive failures, probe again after a cool down"""
+
+    def __init__(self, endpoint="", failure_threshold=5, recovery_timeout=30, half_open_probes=1):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_probes = half_open_probes
+        self._state, self._failures, self._opened_at, self._probes = "closed", 0, 0, 0
+        self._lock = threading.Lock()
+
+    def _update_state(self):
+        if self._state == "open" and time.time() - self._opened_at >= self.recovery_timeout:
+            self._state, self._probes = "half_open", 0
+        LLM_CIRCUIT_STATE.labels(endpoint=self.endpoint).set(_STATE_VALUES[self._state])
+        return self._state
+
+    def allow(self):
+        """Whether a request can be sent to the endpoint"""
+
+        with self._lock:
+            state = self._update_state()
+            if state == "closed":
+                return True
+            if state == "half_open" and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state, self._failures = "closed", 0
+            self._update_state()
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                self._state, self._opened_at = "open", time.time()
+            self._update_state()
+
+    def is_open(self):
+        with self._lock:
+            return self._update_state() == "open"
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._update_state()
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit driven by observed latency and errors.
+
+    The limit grows by 1/limit for every healthy response, and is cut by
+    backoff when a request fails or its latency exceeds latency_tolerance
+    times the moving average latency. The averages are kept per key (the
+    caller of the request), since short scoring prompts and long
+    generations served by the same endpoint take very different times.
+    """
+
+    def __init__(
+        self,
+        endpoint="",
+        initial=4,
+        minimum=1,
+        maximum=32,
+        backoff=0.5,
+        latency_tolerance=2.0,
+        smoothing=0.2,
+    ):
+        self.endpoint = endpoint
+        self.minimum, self.maximum = minimum, maximum
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self._limit, self._inflight, self._latency = float(initial), 0, None
+        self._latencies = {}
+        self._cond = threading.Condition()
+        LLM_CONCURRENCY_LIMIT.labels(endpoint=endpoint).set(self._limit)
+
+    def acquire(self, timeout=None):
+        """Wait for a free slot, return False if timeout"""
+
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._inflight < int(self._limit), timeout):
+                return False
+            self._inflight += 1
+            LLM_INFLIGHT_REQUESTS.labels(endpoint=self.endpoint).set(self._inflight)
+            return True
+
+    def release(self, latency=None, error=False, key=None):
+        with self._cond:
+            self._inflight -= 1
+            average = self._latencies.get(key)
+            slow = (
+                latency is not None
+                and average is not None
+                and latency > average * self.latency_tolerance
+            )
+            if error or slow:
+                self._limit = max(self.minimum, self._limit * self.backoff)
+            else:
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+            if latency is not None and not error:
+                self._latencies[key] = self._smooth(average, latency)
+                self._latency = self._smooth(self._latency, latency)
+            LLM_CONCURRENCY_LIMIT.labels(endpoint=self.endpoint).set(self._limit)
+            LLM_INFLIGHT_REQUESTS.labels(endpoint=self.endpoint).set(self._inflight)
+            self._cond.notify_all()
+
+    def _smooth(self, average, latency):
+        if average is None:
+            return latency
+        return average + self.smoothing * (latency - average)
+
+    @contextmanager
+    def slot(self, timeout=None, key=None):
+        """Hold a slot for the block, the block reports errors by raising"""
+
+        if not self.acquire(timeout):
+            raise TimeoutError(
+                "concurrency limit {} of {} reached".format(int(self._limit), self.endpoint)
+            )
+        start, error = time.time(), True
+        try:
+            yield
+            error = False
+        finally:
+            self.release(time.time() - start, error, key)
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def inflight(self):
+        return self._inflight
+
+    @property
+    def latency(self):
+        """Moving average latency of all successful requests, None before any"""
+
+        return self._latency
+
+
+class EndpointGuard:
+    """Circuit breaker and concurrency limiter shared by the models of an endpoint"""
+
+    def __init__(self, endpoint, config=None):
+        config = config or {}
+        self.endpoint = endpoint
+        self.acquire_timeout = config.get("acquire_timeout", 120)
+        self.breaker = CircuitBreaker(
+            endpoint,
+            failure_threshold=config.get("failure_threshold", 5),
+            recovery_timeout=config.get("recovery_timeout", 30),
+        )
+        self.limiter = AdaptiveLimiter(
+            endpoint,
+            initial=config.get("initial_concurrency", 4),
+            maximum=config.get("max_concurrency", 32),
+            latency_tolerance=config.get("latency_tolerance", 2.0),
+        )
+
+    @contextmanager
+    def request(self, key=None):
+        """Guard a single request, failures of the block are recorded on the circuit"""
+
+        with self.limiter.slot(self.acquire_timeout, key):
+            try:
+                yield
+            except Exception:
+                self.breaker.record_failure()
+                raise
+        self.breaker.record_success()
+
+
+class _PoolBreaker:
+    def __init__(self, guards):
+        self._guards = guards
+
+    def allow(self):
+        return any(g.breaker.state != "open" for g in self._guards)
+
+    def is_open(self):
+        return all(g.breaker.is_open() for g in self._guards)
+
+
+class PoolGuard:
+    """Guard of a pool, open only when every member endpoint is open.
+
+    Requests are guarded by the member endpoint they are routed to, so the
+    pool itself does not limit concurrency.
+    """
+
+    def __init__(self, guards):
+        self.guards = guards
+        self.breaker = _PoolBreaker(guards)
+
+    def request(self, key=None):
+        return nullcontext()
+
+
+_GUARDS, _GUARDS_LOCK = {}, threading.Lock()
+
+
+def get_endpoint_guard(endpoint, config=None):
+    """Get the guard of the endpoint, create one if not exists"""
+
+    with _GUARDS_LOCK:
+        if endpoint not in _GUARDS:
+            _GUARDS[endpoint] = EndpointGuard(endpoint, config)
+        return _GUARDS[endpoint]
+
+
+def reset_endpoint_guards():
+    with _GUARDS_LOCK:
+        _GUARDS.clear()
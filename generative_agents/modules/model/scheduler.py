@@ -0,0 +1,136 @@
+"""generative_agents.model.scheduler"""
+
+import time
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+
+from modules.utils.metrics import get_or_create_gauge, get_or_create_histogram
+from modules.utils.namespace import GenerativeAgentsMap, GenerativeAgentsKey
+
+PRIORITY_CLASSES = ("interactive", "planning", "background")
+
+# callers not listed here are scheduled as "planning"
+DEFAULT_PRIORITIES = {
+    "decide_chat": "interactive",
+    "decide_wait": "interactive",
+    "summarize_relation": "interactive",
+    "generate_chat": "interactive",
+    "generate_chat_check_repeat": "interactive",
+    "decide_chat_terminate": "interactive",
+    "poignancy_event": "background",
+    "poignancy_chat": "background",
+    "reflect_focus": "background",
+    "reflect_insights": "background",
+    "reflect_chat_planing": "background",
+    "reflect_chat_memory": "background",
+    "summarize_chats": "background",
+}
+
+LLM_SCHEDULER_QUEUE_DEPTH = get_or_create_gauge(
+    "llm_scheduler_queue_depth", "LLM requests waiting in the scheduler", ["priority"]
+)
+LLM_SCHEDULER_INFLIGHT = get_or_create_gauge(
+    "llm_scheduler_inflight", "LLM requests admitted by the scheduler and not finished"
+)
+LLM_SCHEDULER_WAIT_SECONDS = get_or_create_histogram(
+    "llm_scheduler_wait_seconds",
+    "Seconds a LLM request waits in the scheduler",
+    ["priority"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+
+
+class LLMScheduler:
+    """Admit LLM requests of all agents under a global concurrency budget.
+
+    Waiting requests are served by priority class first. Inside a class the
+    agents take turns, so one agent with many queued requests can not hold
+    back the others.
+    """
+
+    def __init__(self, max_concurrency=8, priorities=None):
+        self.max_concurrency = max_concurrency
+        self.priorities = dict(DEFAULT_PRIORITIES, **(priorities or {}))
+        self._queues = {p: OrderedDict() for p in PRIORITY_CLASSES}
+        self._inflight = 0
+        self._cond = threading.Condition()
+
+    def priority_of(self, caller):
+        priority = self.priorities.get(caller, "planning")
+        return priority if priority in self._queues else "planning"
+
+    def _head(self):
+        for queue in self._queues.values():
+            for waiters in queue.values():
+                return waiters[0]
+        return None
+
+    def acquire(self, caller, agent=""):
+        priority, ticket = self.priority_of(caller), object()
+        queue, start = self._queues[priority], time.time()
+        with self._cond:
+            queue.setdefault(agent, deque()).append(ticket)
+            LLM_SCHEDULER_QUEUE_DEPTH.labels(priority=priority).inc()
+            self._cond.wait_for(
+                lambda: self._inflight < self.max_concurrency and self._head() is ticket
+            )
+            waiters = queue.pop(agent)
+            waiters.popleft()
+            if waiters:
+                # the agent goes to the back of its class
+                queue[agent] = waiters
+            self._inflight += 1
+            LLM_SCHEDULER_QUEUE_DEPTH.labels(priority=priority).dec()
+            LLM_SCHEDULER_INFLIGHT.set(self._inflight)
+            self._cond.notify_all()
+        LLM_SCHEDULER_WAIT_SECONDS.labels(priority=priority).observe(time.time() - start)
+
+    def release(self):
+        with self._cond:
+            self._inflight -= 1
+            LLM_SCHEDULER_INFLIGHT.set(self._inflight)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, caller, agent=""):
+        self.acquire(caller, agent)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @property
+    def inflight(self):
+        return self._inflight
+
+    def queue_depth(self, priority=None):
+        with self._cond:
+            queues = [self._queues[priority]] if priority else self._queues.values()
+            return sum(len(w) for q in queues for w in q.values())
+
+
+def set_scheduler(config=None):
+    """Create the process-wide scheduler, None config removes it"""
+
+    if config is None:
+        GenerativeAgentsMap.delete(GenerativeAgentsKey.SCHEDULER)
+        return None
+    GenerativeAgentsMap.set(
+        GenerativeAgentsKey.SCHEDULER,
+        LLMScheduler(config.get("max_concurrency", 8), config.get("priorities")),
+    )
+    return GenerativeAgentsMap.get(GenerativeAgentsKey.SCHEDULER)
+
+
+def get_scheduler():
+    return GenerativeAgentsMap.get(GenerativeAgentsKey.SCHEDULER)
+
+
+def schedule(caller, agent=""):
+    """Hold a slot of the scheduler if there is one"""
+
+    scheduler = get_scheduler()
+    if scheduler is None:
+        return nullcontext()
+    return scheduler.slot(caller, agent)
@@ -0,0 +1,60 @@
+"""generative_agents.model.singleflight"""
+
+import threading
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result, self.error = None, None
+
+
+class SingleFlight:
+    """Share one call among the concurrent callers asking for the same key"""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Call func, or wait for the ongoing call of the same key.
+
+        Parameters
+        ----------
+        key: hashable
+            The key of the call.
+        func: callable
+            The call, made only by the first caller of the key.
+
+        Returns
+        -------
+        result:
+            The result of the call, exceptions are raised to every caller.
+        shared: bool
+            Whether the result came from the call of another caller.
+        """
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = func()
+            return flight.result, False
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def inflight(self):
+        with self._lock:
+            return len(self._flights)
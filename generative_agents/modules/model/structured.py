@@ -0,0 +1,228 @@
+"""generative_agents.model.structured"""
+
+import re
+import json
+
+STRUCTURED_HINT = "\n\nOutput a JSON object only, following this JSON schema:\n{}"
+
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+class SchemaError(ValueError):
+    """Raised when the data does not match the schema"""
+
+
+def object_schema(**properties):
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties.keys()),
+    }
+
+
+def array_schema(items, min_items=None, max_items=None):
+    schema = {"type": "array", "items": items}
+    if min_items is not None:
+        schema["minItems"] = min_items
+    if max_items is not None:
+        schema["maxItems"] = max_items
+    return schema
+
+
+def string_schema(enum=None, pattern=None):
+    schema = {"type": "string"}
+    if enum is not None:
+        schema["enum"] = list(enum)
+    if pattern is not None:
+        schema["pattern"] = pattern
+    return schema
+
+
+def integer_schema(minimum=None, maximum=None):
+    schema = {"type": "integer"}
+    if minimum is not None:
+        schema["minimum"] = minimum
+    if maximum is not None:
+        schema["maximum"] = maximum
+    return schema
+
+
+def boolean_schema():
+    return {"type": "boolean"}
+
+
+def response_format(schema, name="response"):
+    """Build the OpenAI compatible response_format for the schema"""
+
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}
+
+
+def validate(data, schema, path="$"):
+    """Validate data against the subset of JSON schema used by the prompts.
+
+    Parameters
+    ----------
+    data:
+        The decoded json data.
+    schema: dict
+        The schema, supports type, properties, required, items, enum,
+        minimum, maximum, minItems, maxItems and pattern.
+    path: str
+        The path of data, used in error message.
+
+    Returns
+    -------
+    data:
+        The validated data.
+    """
+
+    s_type = schema.get("type")
+    checkers = {
+        "object": lambda d: isinstance(d, dict),
+        "array": lambda d: isinstance(d, list),
+        "string": lambda d: isinstance(d, str),
+        "integer": lambda d: isinstance(d, int) and not isinstance(d, bool),
+        "number": lambda d: isinstance(d, (int, float)) and not isinstance(d, bool),
+        "boolean": lambda d: isinstance(d, bool),
+    }
+    if s_type in checkers and not checkers[s_type](data):
+        raise SchemaError("{} should be {}, get {}".format(path, s_type, type(data).__name__))
+    if "enum" in schema and data not in schema["enum"]:
+        raise SchemaError("{} should be one of {}, get {}".format(path, schema["enum"], data))
+    if "minimum" in schema and data < schema["minimum"]:
+        raise SchemaError("{} should >= {}, get {}".format(path, schema["minimum"], data))
+    if "maximum" in schema and data > schema["maximum"]:
+        raise SchemaError("{} should <= {}, get {}".format(path, schema["maximum"], data))
+    if "pattern" in schema and not re.search(schema["pattern"], data):
+        raise SchemaError("{} should match {}, get {}".format(path, schema["pattern"], data))
+    if s_type == "object":
+        for key in schema.get("required", []):
+            if key not in data:
+                raise SchemaError("{} missing required {}".format(path, key))
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in data:
+                validate(data[key], sub_schema, "{}.{}".format(path, key))
+    elif s_type == "array":
+        if len(data) < schema.get("minItems", 0):
+            raise SchemaError("{} should have >= {} items".format(path, schema["minItems"]))
+        if len(data) > schema.get("maxItems", len(data)):
+            raise SchemaError("{} should have <= {} items".format(path, schema["maxItems"]))
+        for idx, item in enumerate(data):
+            validate(item, schema.get("items", {}), "{}[{}]".format(path, idx))
+    return data
+
+
+def repair(text):
+    """Cheaply recover json data from a malformed response"""
+
+    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, flags=re.DOTALL)
+    if fenced:
+        text = fenced.group(1).strip()
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text
+    start = min(starts)
+    end = text.rfind("}" if text[start] == "{" else "]")
+    if end < start:
+        return text
+    candidate = text[start : end + 1]
+    candidate = candidate.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
+    candidate = re.sub(r",\s*([}\]])", r"\1", candidate)
+    for fixer in [
+        lambda c: c,
+        lambda c: re.sub(r"\b(True|False|None)\b", lambda m: _PY_LITERALS[m.group(1)], c),
+        lambda c: c.replace("'", '"'),
+    ]:
+        candidate = fixer(candidate)
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            continue
+    return text
+
+
+def coerce(data, schema):
+    """Convert data towards the schema, for the cheap repair pass"""
+
+    s_type = schema.get("type")
+    if s_type == "object":
+        properties = schema.get("properties", {})
+        if not isinstance(data, dict):
+            if len(properties) != 1:
+                return data
+            data = {list(properties.keys())[0]: data}
+        lower_keys = {k.lower(): k for k in properties}
+        fixed = {}
+        for key, value in data.items():
+            key = key if key in properties else lower_keys.get(str(key).lower(), key)
+            fixed[key] = coerce(value, properties[key]) if key in properties else value
+        missing = [k for k in schema.get("required", []) if k not in fixed]
+        extra = [k for k in fixed if k not in properties]
+        if len(missing) == 1 and len(extra) == 1:
+            fixed[missing[0]] = coerce(fixed.pop(extra[0]), properties[missing[0]])
+        return fixed
+    if s_type == "array":
+        if not isinstance(data, list):
+            data = [data]
+        return [coerce(d, schema.get("items", {})) for d in data]
+    if s_type in ("integer", "number"):
+        if isinstance(data, str):
+            found = re.search(r"-?\d+(\.\d+)?", data)
+            if not found:
+                return data
+            data = float(found.group(0))
+        if isinstance(data, (int, float)) and not isinstance(data, bool):
+            data = int(round(data)) if s_type == "integer" else data
+            if "minimum" in schema:
+                data = max(data, schema["minimum"])
+            if "maximum" in schema:
+                data = min(data, schema["maximum"])
+        return data
+    if s_type == "boolean":
+        if isinstance(data, str):
+            value = data.strip().lower()
+            if value.startswith(("no", "false", "否", "不")):
+                return False
+            if value.startswith(("yes", "true", "是")):
+                return True
+        return data
+    if s_type == "string":
+        if isinstance(data, (int, float)) and not isinstance(data, bool):
+            data = str(data)
+        if isinstance(data, str):
+            data = data.strip()
+            if "enum" in schema and data not in schema["enum"]:
+                lower_enum = {e.lower(): e for e in schema["enum"]}
+                if data.lower() in lower_enum:
+                    return lower_enum[data.lower()]
+                contained = [e for e in schema["enum"] if e in data]
+                if len(contained) == 1:
+                    return contained[0]
+        return data
+    return data
+
+
+def loads(text, schema):
+    """Decode and validate a structured response.
+
+    Parameters
+    ----------
+    text: str
+        The response from llm.
+    schema: dict
+        The expected schema.
+
+    Returns
+    -------
+    data:
+        The validated data.
+    repaired: bool
+        Whether the data was recovered by the repair pass.
+    """
+
+    try:
+        return validate(json.loads(text), schema), False
+    except ValueError:
+        pass
+    return validate(coerce(repair(text), schema), schema), True
@@ -8,25 +8,79 @@ from string import Template
 from modules import utils
 from modules.memory import Event
 from modules.model import parse_llm_output
+from modules.model import structured
 
 
 class Scratch:
-    def __init__(self, name, currently, config):
+    """Prompt builders of an agent.
+
+    With layout "stable_first", the persona of the agent is moved to the
+    head of every prompt that describes the agent, ${base_desc} only carries
+    the date and the currently status, and it is moved down to the paragraph
+    of the first volatile placeholder. Consecutive prompts of the agent then
+    share a long stable prefix, which the inference server can reuse from
+    its prefix (KV) cache instead of prefilling again.
+    """
+
+    def __init__(self, name, currently, config, layout="default"):
         self.name = name
         self.currently = currently
         self.config = config
+        self.layout = layout
         self.template_path = "data/prompts"
 
     def build_prompt(self, template, data):
         with open(f"{self.template_path}/{template}.txt", "r", encoding="utf-8") as file:
             file_content = file.read()
 
+        stable_first = self.layout == "stable_first" and "${base_desc}" in file_content
+        if stable_first:
+            file_content = self._stable_first(file_content, data)
         template = Template(file_content)
         filled_content = template.substitute(data)
+        if stable_first:
+            filled_content = self._persona_desc() + "\n\n" + filled_content
 
         return filled_content
 
+    def _stable_first(self, content, data):
+        """Move the ${base_desc} line to the paragraph of the first volatile placeholder"""
+
+        lines = content.split("\n")
+        body = [line for line in lines if line.strip() != "${base_desc}"]
+        if len(body) == len(lines):
+            return content
+        stable = [self.name] + list(self.config.values())
+        for idx, line in enumerate(body):
+            keys = re.findall(r"\$\{(\w+)\}", line)
+            if any(data.get(key) not in stable for key in keys):
+                while idx > 0 and body[idx - 1].strip():
+                    idx -= 1
+                body[idx:idx] = ["${base_desc}", ""]
+                while body and not body[0].strip():
+                    body.pop(0)
+                return "\n".join(body)
+        return content
+
+    def _persona_desc(self):
+        return self.build_prompt(
+            "base_persona",
+            {
+                "name": self.name,
+                "age": self.config["age"],
+                "innate": self.config["innate"],
+                "learned": self.config["learned"],
+                "lifestyle": self.config["lifestyle"],
+                "daily_plan": self.config["daily_plan"],
+            }
+        )
+
     def _base_desc(self):
+        if self.layout == "stable_first":
+            return self.build_prompt(
+                "base_context",
+                {"date": utils.get_timer().daily_format_cn(), "currently": self.currently},
+            )
         return self.build_prompt(
             "base_desc",
             {
@@ -62,6 +116,13 @@ class Scratch:
             "prompt": prompt,
             "callback": _callback,
             "failsafe": random.choice(list(range(10))) + 1,
+            "early_stop": _number_decided,
+            "structured": {
+                "schema": structured.object_schema(
+                    score=structured.integer_schema(1, 10)
+                ),
+                "callback": lambda data: data["score"],
+            },
         }
 
     def prompt_poignancy_chat(self, event):
@@ -85,6 +146,13 @@ class Scratch:
             "prompt": prompt,
             "callback": _callback,
             "failsafe": random.choice(list(range(10))) + 1,
+            "early_stop": _number_decided,
+            "structured": {
+                "schema": structured.object_schema(
+                    score=structured.integer_schema(1, 10)
+                ),
+                "callback": lambda data: data["score"],
+            },
         }
 
     def prompt_wake_up(self):
@@ -104,11 +172,25 @@ class Scratch:
                 "\d{1,2}",
             ]
             wake_up_time = int(parse_llm_output(response, patterns))
+            return _clamp(wake_up_time)
+
+        def _clamp(wake_up_time):
             if wake_up_time > 11:
                 wake_up_time = 11
             return wake_up_time
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": 6}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": 6,
+            "early_stop": lambda text: re.search(r"\d{1,2}:\d{2}", text) is not None,
+            "structured": {
+                "schema": structured.object_schema(
+                    hour=structured.integer_schema(0, 23)
+                ),
+                "callback": lambda data: _clamp(data["hour"]),
+            },
+        }
 
     def prompt_schedule_init(self, wake_up):
         prompt = self.build_prompt(
@@ -132,6 +214,10 @@ class Scratch:
             ]
             return parse_llm_output(response, patterns, mode="match_all")
 
+        schema = structured.object_schema(
+            plans=structured.array_schema(structured.string_schema(), min_items=1)
+        )
+
         failsafe = [
             "早上6点起床并完成早餐的例行工作",
             "早上7点吃早餐",
@@ -141,7 +227,12 @@ class Scratch:
             "晚上7点放松一下，看电视",
             "晚上11点Sleep",
         ]
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": failsafe,
+            "structured": {"schema": schema, "callback": lambda data: data["plans"]},
+        }
 
     def prompt_schedule_daily(self, wake_up, daily_schedule):
         hourly_schedule = ""
@@ -192,7 +283,28 @@ class Scratch:
             assert len(outputs) >= 5, "less than 5 schedules"
             return {s[0]: s[1] for s in outputs}
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        def _structured_callback(data):
+            outputs = [
+                (s["time"], s["activity"].strip("。").removeprefix(self.name))
+                for s in data["schedule"]
+            ]
+            return {s[0]: s[1] for s in outputs}
+
+        schema = structured.object_schema(
+            schedule=structured.array_schema(
+                structured.object_schema(
+                    time=structured.string_schema(pattern=r"^\d{1,2}:\d{2}$"),
+                    activity=structured.string_schema(),
+                ),
+                min_items=5,
+            )
+        )
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": failsafe,
+            "structured": {"schema": schema, "callback": _structured_callback},
+        }
 
     def prompt_schedule_decompose(self, plan, schedule):
         def _plan_des(plan):
@@ -223,14 +335,37 @@ class Scratch:
                 "\d{1,2}\) .*\*Plan\* (.*)[\(（]+耗时[:： ]+(\d{1,2})[,， ]+剩余[:： ]+\d*[\)）]",
             ]
             schedules = parse_llm_output(response, patterns, mode="match_all")
-            schedules = [(s[0].strip("."), int(s[1])) for s in schedules]
+            return _fill_left([(s[0].strip("."), int(s[1])) for s in schedules])
+
+        def _fill_left(schedules):
             left = plan["duration"] - sum([s[1] for s in schedules])
             if left > 0:
                 schedules.append((plan["describe"], left))
             return schedules
 
+        schema = structured.object_schema(
+            subtasks=structured.array_schema(
+                structured.object_schema(
+                    activity=structured.string_schema(),
+                    duration=structured.integer_schema(1, plan["duration"]),
+                ),
+                min_items=1,
+                max_items=10,
+            )
+        )
+
+        def _structured_callback(data):
+            return _fill_left(
+                [(s["activity"].strip("."), s["duration"]) for s in data["subtasks"]]
+            )
+
         failsafe = [(plan["describe"], 10) for _ in range(int(plan["duration"] / 10))]
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": failsafe,
+            "structured": {"schema": schema, "callback": _structured_callback},
+        }
 
     def prompt_schedule_revise(self, action, schedule):
         plan, _ = schedule.current_plan()
@@ -282,6 +417,9 @@ class Scratch:
                 "^\[(\d{1,2}:\d{1,2}) ?至 ?(\d{1,2}:\d{1,2})\] (.*)",
             ]
             schedules = parse_llm_output(response, patterns, mode="match_all")
+            return _to_decompose(schedules)
+
+        def _to_decompose(schedules):
             decompose = []
             for start, end, describe in schedules:
                 m_start = utils.daily_duration(utils.to_date(start, "%H:%M"))
@@ -296,7 +434,27 @@ class Scratch:
                 )
             return decompose
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": plan["decompose"]}
+        time_schema = structured.string_schema(pattern=r"^\d{1,2}:\d{1,2}$")
+        schema = structured.object_schema(
+            schedule=structured.array_schema(
+                structured.object_schema(
+                    start=time_schema, end=time_schema, activity=structured.string_schema()
+                ),
+                min_items=1,
+            )
+        )
+
+        def _structured_callback(data):
+            return _to_decompose(
+                [(s["start"], s["end"], s["activity"]) for s in data["schedule"]]
+            )
+
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": plan["decompose"],
+            "structured": {"schema": schema, "callback": _structured_callback},
+        }
 
     def prompt_determine_sector(self, describes, spatial, address, tile):
         live_address = spatial.find_address("living_area", as_list=True)[:-1]
@@ -334,6 +492,9 @@ class Scratch:
                 "(.+)",
             ]
             sector = parse_llm_output(response, patterns)
+            return _to_sector(sector)
+
+        def _to_sector(sector):
             if sector in sectors:
                 return sector
             if sector in arenas:
@@ -343,7 +504,19 @@ class Scratch:
                     return s
             return failsafe
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        choices = list(dict.fromkeys(sectors + list(arenas.keys())))
+        schema = structured.object_schema(
+            sector=structured.string_schema(enum=choices or None)
+        )
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": failsafe,
+            "structured": {
+                "schema": schema,
+                "callback": lambda data: _to_sector(data["sector"]),
+            },
+        }
 
     def prompt_determine_arena(self, describes, spatial, address):
         prompt = self.build_prompt(
@@ -372,7 +545,13 @@ class Scratch:
             arena = parse_llm_output(response, patterns)
             return arena if arena in arenas else failsafe
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        schema = structured.object_schema(arena=structured.string_schema(enum=arenas or None))
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": failsafe,
+            "structured": {"schema": schema, "callback": lambda data: data["arena"]},
+        }
 
     def prompt_determine_object(self, describes, spatial, address):
         objects = spatial.get_leaves(address)
@@ -399,7 +578,13 @@ class Scratch:
             obj = parse_llm_output(response, patterns)
             return obj if obj in objects else failsafe
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        schema = structured.object_schema(object=structured.string_schema(enum=objects or None))
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": failsafe,
+            "structured": {"schema": schema, "callback": lambda data: data["object"]},
+        }
 
     def prompt_describe_emoji(self, describe):
         prompt = self.build_prompt(
@@ -430,7 +615,16 @@ class Scratch:
 
             return parse_llm_output(response, ["Emoji: (.*)"])[:3]
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": "💭", "retry": 1}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": "💭",
+            "retry": 1,
+            "structured": {
+                "schema": structured.object_schema(emoji=structured.string_schema()),
+                "callback": lambda data: _callback(data["emoji"]),
+            },
+        }
 
     def prompt_describe_event(self, subject, describe, address, emoji=None):
         prompt = self.build_prompt(
@@ -465,7 +659,22 @@ class Scratch:
 
             return None
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": failsafe}
+        schema = structured.object_schema(
+            subject=structured.string_schema(),
+            predicate=structured.string_schema(),
+            object=structured.string_schema(),
+        )
+
+        def _structured_callback(data):
+            outputs = [data["subject"], data["predicate"], data["object"]]
+            return Event(*outputs, describe=describe, address=address, emoji=emoji)
+
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": failsafe,
+            "structured": {"schema": schema, "callback": _structured_callback},
+        }
 
     def prompt_describe_object(self, obj, describe):
         prompt = self.build_prompt(
@@ -484,7 +693,19 @@ class Scratch:
             ]
             return parse_llm_output(response, patterns)
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": "Idle"}
+        def _structured_callback(data):
+            state = data["state"].strip("。")
+            return state.removeprefix("<" + obj + ">").strip() or None
+
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": "Idle",
+            "structured": {
+                "schema": structured.object_schema(state=structured.string_schema()),
+                "callback": _structured_callback,
+            },
+        }
 
     def prompt_decide_chat(self, agent, other, focus, chats):
         def _status_des(a):
@@ -521,7 +742,13 @@ class Scratch:
                 return False
             return True
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": False}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": False,
+            "structured": _yes_no_structured(),
+            "early_stop": _yes_no_decided,
+        }
 
     def prompt_decide_chat_terminate(self, agent, other, chats):
         conversation = "\n".join(["{}: {}".format(n, u) for n, u in chats])
@@ -543,7 +770,13 @@ class Scratch:
                 return False
             return True
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": False}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": False,
+            "structured": _yes_no_structured(),
+            "early_stop": _yes_no_decided,
+        }
 
     def prompt_decide_wait(self, agent, other, focus):
         example1 = self.build_prompt(
@@ -618,10 +851,22 @@ class Scratch:
         def _callback(response):
             return "A" in response
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": False}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": False,
+            "early_stop": lambda text: re.search(r"A|选项\s*B|[Oo]ption\s*B|<B>", text)
+            is not None,
+            "structured": {
+                "schema": structured.object_schema(
+                    option=structured.string_schema(enum=["A", "B"])
+                ),
+                "callback": lambda data: data["option"] == "A",
+            },
+        }
 
     def prompt_summarize_relation(self, agent, other_name):
-        nodes = agent.associate.retrieve_focus([other_name], 50)
+        nodes = agent.associate.retrieve_focus([other_name], 50, touch=False)
 
         prompt = self.build_prompt(
             "summarize_relation",
@@ -639,13 +884,14 @@ class Scratch:
             "prompt": prompt,
             "callback": _callback,
             "failsafe": agent.name + " 正在看着 " + other_name,
+            "accessed": [n.node_id for n in nodes],
         }
 
     def prompt_generate_chat(self, agent, other, relation, chats):
         focus = [relation, other.get_event().get_describe()]
         if len(chats) > 4:
             focus.append("; ".join("{}: {}".format(n, t) for n, t in chats[-4:]))
-        nodes = agent.associate.retrieve_focus(focus, 15)
+        nodes = agent.associate.retrieve_focus(focus, 15, touch=False)
         memory = "\n- " + "\n- ".join([n.describe for n in nodes])
         chat_nodes = agent.associate.retrieve_chats(other.name)
         pass_context = ""
@@ -689,13 +935,22 @@ class Scratch:
             json_content = utils.load_dict(
                 "{" + response.split("{")[1].split("}")[0] + "}"
             )
-            text = json_content[agent.name].replace("\n\n", "\n").strip(" \n\"'“”‘’")
-            return text
+            return _clean(json_content[agent.name])
+
+        def _clean(text):
+            return text.replace("\n\n", "\n").strip(" \n\"'“”‘’")
 
         return {
             "prompt": prompt,
             "callback": _callback,
             "failsafe": "嗯",
+            "structured": {
+                "schema": structured.object_schema(
+                    **{agent.name: structured.string_schema()}
+                ),
+                "callback": lambda data: _clean(data[agent.name]),
+            },
+            "accessed": [n.node_id for n in nodes],
         }
 
     def prompt_generate_chat_check_repeat(self, agent, chats, content):
@@ -718,7 +973,13 @@ class Scratch:
                 return False
             return True
 
-        return {"prompt": prompt, "callback": _callback, "failsafe": False}
+        return {
+            "prompt": prompt,
+            "callback": _callback,
+            "failsafe": False,
+            "structured": _yes_no_structured(),
+            "early_stop": _yes_no_decided,
+        }
 
     def prompt_summarize_chats(self, chats):
         conversation = "\n".join(["{}: {}".format(n, u) for n, u in chats])
@@ -757,9 +1018,15 @@ class Scratch:
             pattern = ["^\d{1}\. (.*)", "^\d{1}\) (.*)", "^\d{1} (.*)"]
             return parse_llm_output(response, pattern, mode="match_all")
 
+        schema = structured.object_schema(
+            questions=structured.array_schema(
+                structured.string_schema(), min_items=1, max_items=topk
+            )
+        )
         return {
             "prompt": prompt,
             "callback": _callback,
+            "structured": {"schema": schema, "callback": lambda data: data["questions"]},
             "failsafe": [
                 "{} 是谁？".format(self.name),
                 "{} 住在哪里？".format(self.name),
@@ -796,9 +1063,29 @@ class Scratch:
                 return insights
             raise Exception("Can not find insights")
 
+        schema = structured.object_schema(
+            insights=structured.array_schema(
+                structured.object_schema(
+                    insight=structured.string_schema(),
+                    evidence=structured.array_schema(
+                        structured.integer_schema(0, len(nodes) - 1)
+                    ),
+                ),
+                min_items=1,
+                max_items=topk,
+            )
+        )
+
+        def _structured_callback(data):
+            return [
+                [i["insight"].strip(), [nodes[e].node_id for e in i["evidence"]]]
+                for i in data["insights"]
+            ]
+
         return {
             "prompt": prompt,
             "callback": _callback,
+            "structured": {"schema": schema, "callback": _structured_callback},
             "failsafe": [
                 [
                     "{} 在考虑下一步该做什么".format(self.name),
@@ -871,10 +1158,14 @@ class Scratch:
             ]
             return parse_llm_output(response, pattern, mode="match_all")
 
+        schema = structured.object_schema(
+            items=structured.array_schema(structured.string_schema(), min_items=1)
+        )
         return {
             "prompt": prompt,
             "callback": _callback,
             "failsafe": [r.describe for r in random.choices(nodes, k=5)],
+            "structured": {"schema": schema, "callback": lambda data: data["items"]},
         }
 
     def prompt_retrieve_thought(self, nodes):
@@ -927,4 +1218,27 @@ class Scratch:
             "prompt": prompt,
             "callback": _callback,
             "failsafe": self.currently,
+            "structured": {
+                "schema": structured.object_schema(state=structured.string_schema()),
+                "callback": lambda data: data["state"],
+            },
         }
+
+
+def _yes_no_decided(text):
+    """Early stop once the streamed answer contains yes or no"""
+
+    return re.search(r"\b(yes|no)\b|是|否|不", text, flags=re.IGNORECASE) is not None
+
+
+def _number_decided(text):
+    """Early stop once a complete number is streamed"""
+
+    return re.search(r"\d\D", text) is not None
+
+
+def _yes_no_structured():
+    return {
+        "schema": structured.object_schema(answer=structured.boolean_schema()),
+        "callback": lambda data: data["answer"],
+    }
@@ -0,0 +1,5 @@
+"""generative_agents.shard"""
+
+from .master import ShardedGame, create_sharded_game, listen_sharded_game
+from .worker import connect_worker
+from .protocol import parse_address
@@ -0,0 +1,233 @@
+"""generative_agents.shard.master"""
+
+import os
+import copy
+import multiprocessing
+from multiprocessing.connection import Listener, wait
+
+from modules import utils
+from modules.maze import Maze
+from . import protocol
+from .worker import run_worker
+
+
+class ShardedGame:
+    """The game with its agents partitioned across shards.
+
+    The master owns the authoritative maze. Each step it sends every shard
+    the statuses of its agents, the tile event changes made by the other
+    shards since the last step and the snapshots of the agents it does not
+    own, then routes the calls between the shards until all of them report,
+    and finally collects the checkpoints of the agents. Agents of a shard see
+    the agents of other shards as they were at the start of the step.
+    """
+
+    def __init__(self, maze, conversation, conns, logger=None, processes=None):
+        self.maze = maze
+        self.conversation = conversation
+        self.logger = logger or utils.IOLogger()
+        self._channels = [protocol.Channel(c) for c in conns]
+        self._processes = processes or []
+        self._owners, self._snapshots = {}, {}
+        self._pending = [[] for _ in self._channels]
+        for idx, channel in enumerate(self._channels):
+            msg = self._expect(channel, protocol.READY)
+            for name, snapshot in msg["agents"].items():
+                self._owners[name], self._snapshots[name] = idx, snapshot
+            self._publish(idx, msg["diff"])
+
+    @property
+    def agent_names(self):
+        return list(self._owners)
+
+    def shard_of(self, name):
+        return self._owners[name]
+
+    def _expect(self, channel, kind):
+        msg = channel.recv()
+        if msg["kind"] == protocol.ERROR:
+            raise RuntimeError("shard failed:\n" + msg["error"])
+        assert msg["kind"] == kind, "expect {} from shard, get {}".format(kind, msg["kind"])
+        return msg
+
+    def _publish(self, src, diff):
+        """Apply the tile event changes of a shard, and queue them for the other shards"""
+
+        if not diff:
+            return
+        self.maze.apply_events_diff(diff)
+        for idx, pending in enumerate(self._pending):
+            if idx != src:
+                pending.append(diff)
+
+    def step(self, statuses):
+        """Let the shards think their agents, return the result of each agent"""
+
+        time = utils.get_timer().get_date("%Y%m%d-%H:%M")
+        for idx, channel in enumerate(self._channels):
+            channel.send(
+                protocol.STEP,
+                time=time,
+                statuses={n: s for n, s in statuses.items() if self._owners[n] == idx},
+                diffs=self._pending[idx],
+                peers={n: s for n, s in self._snapshots.items() if self._owners[n] != idx},
+            )
+            self._pending[idx] = []
+        results = {}
+        self._collect(results)
+        # a shard may serve schedule_chat after its agents thought, so the
+        # checkpoints are taken once every shard finished the step
+        for channel in self._channels:
+            channel.send(protocol.CHECKPOINT)
+        self._collect(results)
+        return {name: results[name] for name in statuses}
+
+    def _collect(self, results):
+        """Route the messages of the shards until each of them reports"""
+
+        waiting = set(range(len(self._channels)))
+        conns = {c.conn: idx for idx, c in enumerate(self._channels)}
+        while waiting:
+            for conn in wait(list(conns)):
+                idx = conns[conn]
+                try:
+                    msg = self._channels[idx].recv()
+                except (EOFError, OSError):
+                    raise RuntimeError("shard {} disconnected".format(idx))
+                self._route(idx, msg, results, waiting)
+
+    def _route(self, idx, msg, results, waiting):
+        kind = msg["kind"]
+        if kind == protocol.CALL:
+            msg["origin"] = idx
+            self._channels[self._owners[msg["target"]]].forward(msg)
+        elif kind == protocol.REPLY:
+            self._channels[msg["origin"]].forward(msg)
+        elif kind == protocol.RESULT:
+            results.update(msg["results"])
+            self._publish(idx, msg["diff"])
+            for key, chats in msg["conversation"].items():
+                self.conversation.setdefault(key, []).extend(chats)
+            waiting.discard(idx)
+        elif kind == protocol.CHECKPOINT:
+            self._snapshots.update(msg["snapshots"])
+            for name, checkpoint in msg["checkpoints"].items():
+                if name in results:
+                    results[name]["checkpoint"] = checkpoint
+            waiting.discard(idx)
+        elif kind == protocol.ERROR:
+            raise RuntimeError("shard {} failed:\n{}".format(idx, msg["error"]))
+
+    def reset_game(self):
+        """The shards reset their agents when they start"""
+
+    def close(self):
+        for channel in self._channels:
+            try:
+                channel.send(protocol.STOP)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=30)
+        for channel in self._channels:
+            channel.close()
+
+
+def partition(names, shards):
+    """Assign the agents to the shards in turn"""
+
+    return [names[idx::shards] for idx in range(shards)]
+
+
+def shard_specs(name, static_root, config, shards, verbose="info", log_file=""):
+    """The specs to create the game of each shard, see worker.run_worker"""
+
+    names = list(config["agents"])
+    specs = []
+    for idx, shard_names in enumerate(partition(names, min(shards, len(names)))):
+        shard_config = copy.deepcopy(config)
+        shard_config["agents"] = {n: config["agents"][n] for n in shard_names}
+        specs.append(
+            {
+                "index": idx,
+                "name": name,
+                "static_root": static_root,
+                "config": shard_config,
+                "verbose": verbose,
+                "log_file": log_file,
+            }
+        )
+    return specs
+
+
+def accept_shards(listener, specs, logger=None):
+    """Accept a worker for each spec and send it the spec, return the connections"""
+
+    logger = logger or utils.IOLogger()
+    conns = []
+    for spec in specs:
+        logger.info(
+            "Waiting for shard {}/{} at {}".format(spec["index"] + 1, len(specs), listener.address)
+        )
+        conn = listener.accept()
+        conn.send(spec)
+        conns.append(conn)
+    return conns
+
+
+def _build(static_root, config, conversation, conns, logger, processes=None):
+    maze = Maze(utils.load_dict(os.path.join(static_root, config["maze"]["path"])), logger)
+    game = ShardedGame(maze, conversation, conns, logger=logger, processes=processes)
+    utils.GenerativeAgentsMap.set(utils.GenerativeAgentsKey.GAME, game)
+    return game
+
+
+def create_sharded_game(
+    name, static_root, config, conversation, shards=2, logger=None, verbose="info", log_file=""
+):
+    """Create the game with the agents thought by shards processes"""
+
+    utils.set_timer(**config.get("time", {}))
+    context = multiprocessing.get_context()
+    conns, processes = [], []
+    for spec in shard_specs(name, static_root, config, shards, verbose, log_file):
+        spec["cwd"] = os.getcwd()
+        parent, child = context.Pipe()
+        process = context.Process(target=run_worker, args=(child, spec), daemon=True)
+        process.start()
+        child.close()
+        conns.append(parent)
+        processes.append(process)
+    return _build(static_root, config, conversation, conns, logger, processes)
+
+
+def listen_sharded_game(
+    name,
+    static_root,
+    config,
+    conversation,
+    address,
+    authkey,
+    shards=2,
+    logger=None,
+    verbose="info",
+    log_file="",
+):
+    """Create the game with the agents thought by shards workers connecting over TCP.
+
+    Parameters
+    ----------
+    address: tuple
+        The (host, port) to listen on, see protocol.parse_address.
+    authkey: bytes
+        The key the workers authenticate with.
+
+    The other parameters are the same as create_sharded_game. The workers
+    run worker.py from a checkout of the same version, see connect_worker.
+    """
+
+    utils.set_timer(**config.get("time", {}))
+    specs = shard_specs(name, static_root, config, shards, verbose, log_file)
+    with Listener(address, authkey=authkey) as listener:
+        conns = accept_shards(listener, specs, logger)
+    return _build(static_root, config, conversation, conns, logger)
@@ -0,0 +1,92 @@
+"""generative_agents.shard.protocol"""
+
+import threading
+
+# shard -> master, once the agents of the shard are created
+READY = "ready"
+# master -> shard, think the agents of the shard for one step
+STEP = "step"
+# shard -> master, the think results of the step
+RESULT = "result"
+# shard -> master -> owner shard, call a method of an agent
+CALL = "call"
+# owner shard -> master -> calling shard, the output of a call
+REPLY = "reply"
+# master -> shard, once all shards reported the step (no calls left in flight)
+# shard -> master, the checkpoints and snapshots of the agents of the shard
+CHECKPOINT = "checkpoint"
+# shard -> master, the step failed
+ERROR = "error"
+# master -> shard, exit the serving loop
+STOP = "stop"
+
+# methods of an agent that can be called from other shards
+CALLABLE_METHODS = ("completion", "schedule_chat", "touch_memory")
+
+
+def parse_address(address):
+    """Parse host:port into the address of a Listener or Client"""
+
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def message(kind, **fields):
+    fields["kind"] = kind
+    return fields
+
+
+class AgentRef:
+    """An agent passed as an argument of a call, resolved by name on the receiving shard"""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getstate__(self):
+        return {"name": self.name}
+
+    def __setstate__(self, state):
+        self.name = state["name"]
+
+
+def agent_snapshot(agent):
+    """The state of an agent other shards read during a step"""
+
+    return {
+        "name": agent.name,
+        "coord": list(agent.coord),
+        "path": list(agent.path or []),
+        "action": agent.action.to_dict(),
+        "schedule": agent.schedule.to_dict(),
+    }
+
+
+class Channel:
+    """A connection shared by threads, each message is sent whole.
+
+    The connection is a multiprocessing Connection, of a Pipe between
+    processes or of a Client/Listener between hosts.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._lock = threading.Lock()
+
+    def send(self, kind, **fields):
+        with self._lock:
+            self.conn.send(message(kind, **fields))
+
+    def forward(self, msg):
+        with self._lock:
+            self.conn.send(msg)
+
+    def recv(self):
+        return self.conn.recv()
+
+    def fileno(self):
+        return self.conn.fileno()
+
+    def close(self):
+        self.conn.close()
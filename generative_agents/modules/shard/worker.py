@@ -0,0 +1,326 @@
+"""generative_agents.shard.worker"""
+
+import os
+import copy
+import queue
+import functools
+import itertools
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import Client
+
+from modules import memory, utils
+from modules.agent import Agent, collect_accesses, current_accesses, touch_accesses
+from modules.game import create_game
+from modules.maze import Maze
+from . import protocol
+
+
+class RemoteAgent:
+    """An agent owned by another shard.
+
+    The state is the snapshot of the step start, the completions and
+    schedule_chat are called on the owner shard through the master.
+    """
+
+    def __init__(self, snapshot, maze, worker):
+        self.name = snapshot["name"]
+        self.maze = maze
+        self._worker = worker
+        self.update(snapshot)
+
+    def update(self, snapshot):
+        self.coord, self.path = snapshot["coord"], snapshot["path"]
+        self.action = memory.Action.from_dict(copy.deepcopy(snapshot["action"]))
+        self.schedule = memory.Schedule(**snapshot["schedule"])
+
+    def get_tile(self):
+        return self.maze.tile_at(self.coord)
+
+    def get_event(self, as_act=True):
+        return self.action.event if as_act else self.action.obj_event
+
+    def completion_async(self, func_hint, *args):
+        return self._worker.call(
+            self.name, "completion", func_hint, *args, accesses=current_accesses()
+        )
+
+    def completion(self, func_hint, *args):
+        return self.completion_async(func_hint, *args).result()
+
+    def schedule_chat(self, chats, chats_summary, start, duration, other, address=None):
+        self._worker.call(
+            self.name, "schedule_chat", chats, chats_summary, start, duration, other, address
+        ).result()
+
+    def touch_memory(self, node_ids):
+        self._worker.call(self.name, "touch_memory", node_ids).result()
+
+
+class ShardWorker:
+    """Think the agents of one shard, and serve the calls to them from other shards.
+
+    The main thread runs the steps, a reader thread dispatches the replies
+    to the waiting calls and hands the incoming calls to a serving pool, so
+    an agent waiting on another shard never blocks the calls to this shard.
+    """
+
+    def __init__(self, conn, game, baseline=None, max_serving=8):
+        self.game = game
+        self._channel = protocol.Channel(conn)
+        self._inbox = queue.Queue()
+        self._calls, self._call_ids = {}, itertools.count()
+        self._server = ThreadPoolExecutor(max_workers=max_serving, thread_name_prefix="shard")
+        # agents in think or in a served call, and the calls deferred until they are free
+        self._busy, self._deferred = set(), {}
+        self._cond = threading.Condition()
+        self._baseline = baseline
+
+    def call(self, target, method, *args, accesses=None):
+        """Call a method of an agent on another shard, return a future of the output.
+
+        With accesses, the completion is speculative: the owner sends back the
+        nodes it retrieved instead of touching them, and they are added to
+        accesses, to be touched once the output is used.
+        """
+
+        call_id, future = next(self._call_ids), Future()
+        self._calls[call_id] = (future, target, accesses)
+        self._channel.send(
+            protocol.CALL,
+            id=call_id,
+            target=target,
+            method=method,
+            args=self._encode(args),
+            speculative=accesses is not None,
+        )
+        return future
+
+    def _encode(self, value):
+        if isinstance(value, (Agent, RemoteAgent)):
+            return protocol.AgentRef(value.name)
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._encode(v) for v in value)
+        return value
+
+    def _decode(self, value):
+        if isinstance(value, protocol.AgentRef):
+            if value.name in self.game.agents:
+                return self.game.agents[value.name]
+            return self.game.remote_agents[value.name]
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._decode(v) for v in value)
+        return value
+
+    def _read(self):
+        while True:
+            try:
+                msg = self._channel.recv()
+            except (EOFError, OSError):
+                self._inbox.put(protocol.message(protocol.STOP))
+                return
+            if msg["kind"] == protocol.REPLY:
+                future, target, accesses = self._calls.pop(msg["id"], (None, None, None))
+                # a speculative call may be cancelled before its reply
+                if future is None or future.done():
+                    continue
+                if msg.get("error"):
+                    future.set_exception(RuntimeError(msg["error"]))
+                    continue
+                if msg.get("accessed"):
+                    accesses.append((self.game.remote_agents[target], msg["accessed"]))
+                future.set_result(msg.get("value"))
+            elif msg["kind"] == protocol.CALL:
+                self._server.submit(self._serve, msg)
+            else:
+                if msg["kind"] == protocol.STEP:
+                    # calls of the step may arrive before the step is run
+                    self._prepare(msg)
+                self._inbox.put(msg)
+                if msg["kind"] == protocol.STOP:
+                    return
+
+    def _acquire(self, name, defer=None):
+        """Mark the agent busy, or defer the call (a callable) if it is busy and defer is given"""
+
+        with self._cond:
+            if defer is not None and name in self._busy:
+                self._deferred.setdefault(name, []).append(defer)
+                return False
+            self._cond.wait_for(lambda: name not in self._busy)
+            self._busy.add(name)
+            return True
+
+    def _release(self, name):
+        while True:
+            with self._cond:
+                deferred = self._deferred.pop(name, [])
+                if not deferred:
+                    self._busy.discard(name)
+                    self._cond.notify_all()
+                    return
+            for call in deferred:
+                call()
+
+    def _run_free(self, name, call):
+        """Run the call once the agent is not in think or in another call"""
+
+        if self._acquire(name, defer=call):
+            try:
+                call()
+            finally:
+                self._release(name)
+
+    def _serve(self, msg):
+        reply = {"id": msg["id"], "origin": msg.get("origin")}
+        try:
+            if msg["method"] not in protocol.CALLABLE_METHODS:
+                raise ValueError("{} can not be called from other shards".format(msg["method"]))
+            agent, args = self.game.agents[msg["target"]], self._decode(msg["args"])
+            if msg["method"] == "completion":
+                # the completion runs along with the think of the agent, so it only
+                # reads the memory, the nodes it retrieved are touched once the agent is free
+                with collect_accesses() as accesses:
+                    reply["value"] = agent.completion(*args)
+                if msg.get("speculative"):
+                    # the caller touches them through touch_memory once it uses the output
+                    reply["accessed"] = [n for _, node_ids in accesses for n in node_ids]
+                elif accesses:
+                    self._run_free(agent.name, functools.partial(touch_accesses, accesses))
+            else:
+                self._run_free(agent.name, functools.partial(getattr(agent, msg["method"]), *args))
+        except Exception:
+            reply["error"] = traceback.format_exc()
+        self._channel.send(protocol.REPLY, **reply)
+
+    def _prepare(self, msg):
+        """Set the time, the tile events and the agents of other shards for the step"""
+
+        game = self.game
+        utils.set_timer(msg["time"])
+        for diff in msg["diffs"]:
+            game.maze.apply_events_diff(diff)
+        for name, snapshot in msg["peers"].items():
+            if name in game.remote_agents:
+                game.remote_agents[name].update(snapshot)
+            else:
+                game.remote_agents[name] = RemoteAgent(snapshot, game.maze, self)
+
+    def _step(self, msg):
+        game = self.game
+        before, results = game.maze.events_state(), {}
+        for name, status in msg["statuses"].items():
+            self._acquire(name)
+            try:
+                results[name] = game.agent_think(name, status)
+            finally:
+                self._release(name)
+        conversation = {k: list(v) for k, v in game.conversation.items()}
+        game.conversation.clear()
+        self._channel.send(
+            protocol.RESULT,
+            results=results,
+            diff=Maze.events_diff(before, game.maze.events_state()),
+            conversation=conversation,
+        )
+
+    def _checkpoint(self):
+        """Checkpoint the agents after the calls of other shards in the step"""
+
+        checkpoints, snapshots = {}, {}
+        for name, agent in self.game.agents.items():
+            with utils.agent_scope(name), utils.profile("checkpoint", "agent"):
+                checkpoints[name] = agent.to_dict()
+            snapshots[name] = protocol.agent_snapshot(agent)
+        self._channel.send(protocol.CHECKPOINT, checkpoints=checkpoints, snapshots=snapshots)
+
+    def serve(self):
+        """Report the agents, then run the steps until the master stops the shard"""
+
+        game = self.game
+        diff = {}
+        if self._baseline is not None:
+            diff = Maze.events_diff(self._baseline, game.maze.events_state())
+        self._channel.send(
+            protocol.READY,
+            agents={n: protocol.agent_snapshot(a) for n, a in game.agents.items()},
+            diff=diff,
+        )
+        reader = threading.Thread(target=self._read, name="shard-reader", daemon=True)
+        reader.start()
+        while True:
+            msg = self._inbox.get()
+            if msg["kind"] == protocol.STOP:
+                break
+            try:
+                if msg["kind"] == protocol.CHECKPOINT:
+                    self._checkpoint()
+                else:
+                    self._step(msg)
+            except Exception:
+                self._channel.send(protocol.ERROR, error=traceback.format_exc())
+        self._server.shutdown(wait=False)
+
+
+def run_worker(conn, spec):
+    """Entry of a shard process.
+
+    Parameters
+    ----------
+    conn: multiprocessing.connection.Connection
+        The connection to the master.
+    spec: dict
+        The shard index, the simulation name, static_root, the config with
+        the agents of the shard, and the verbose and log_file of the logger.
+    """
+
+    try:
+        game, baseline = _create_shard_game(spec)
+    except Exception:
+        conn.send(protocol.message(protocol.ERROR, error=traceback.format_exc()))
+        raise
+    ShardWorker(conn, game, baseline=baseline).serve()
+
+
+def connect_worker(address, authkey):
+    """Connect to the master at address, and think the agents it assigns.
+
+    The shard files (logs, storage of the agents) are written under the
+    working directory of the worker, so workers on other hosts need the
+    results folder shared with the master to resume the simulation.
+    """
+
+    conn = Client(address, authkey=authkey)
+    try:
+        run_worker(conn, conn.recv())
+    finally:
+        conn.close()
+
+
+def _create_shard_game(spec):
+    if spec.get("cwd"):
+        os.chdir(spec["cwd"])
+    if spec.get("log_file"):
+        log_dir = os.path.dirname(spec["log_file"])
+        if log_dir and not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        logger = utils.create_file_logger(
+            "{}.shard{}".format(spec["log_file"], spec["index"]), spec.get("verbose", "info")
+        )
+    else:
+        logger = utils.create_io_logger(spec.get("verbose", "info"))
+    config = spec["config"]
+    maze_path = os.path.join(spec["static_root"], config["maze"]["path"])
+    baseline = Maze(utils.load_dict(maze_path), logger).events_state()
+    storage_root = os.path.join("results/checkpoints/{}".format(spec["name"]), "storage")
+    game = create_game(
+        spec["name"],
+        spec["static_root"],
+        config,
+        {},
+        logger=logger,
+        shared_events=os.path.join(storage_root, "_shared", "shard{}".format(spec["index"])),
+    )
+    game.reset_game()
+    return game, baseline
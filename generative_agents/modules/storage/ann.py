@@ -0,0 +1,93 @@
+"""generative_agents.storage.ann"""
+
+import numpy as np
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def spherical_kmeans(vectors, k, iterations=8, seed=0):
+    """Cluster the unit vectors by cosine similarity.
+
+    Parameters
+    ----------
+    vectors: np.ndarray
+        The normalized vectors, shape (n, dim).
+    k: int
+        The number of clusters, at most n.
+    iterations: int
+        The number of refinement rounds.
+    seed: int
+        The seed to pick the initial centroids.
+
+    Returns
+    -------
+    centroids: np.ndarray
+        The normalized centroids, shape (k, dim).
+    """
+
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        filled = np.bincount(assign, minlength=k) > 0
+        centroids[filled] = normalize(sums[filled])
+    return centroids
+
+
+class IVFIndex:
+    """Inverted file index, the rows are bucketed by their nearest centroid.
+
+    A query only scores the rows in the nprobe buckets nearest to it, so
+    nprobe trades recall for latency (nprobe == nlist is the exact search).
+    The centroids are trained once min_train rows exist, and trained again
+    each time the rows double.
+    """
+
+    def __init__(self, nlist=64, nprobe=8, min_train=2048, iterations=8, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train
+        self.iterations = iterations
+        self.seed = seed
+        self._centroids, self._trained_on = None, 0
+
+    @property
+    def trained(self):
+        return self._centroids is not None
+
+    def need_train(self, size):
+        if size < max(self.min_train, self.nlist):
+            return False
+        return not self.trained or size >= 2 * self._trained_on
+
+    def train(self, matrix):
+        """Train the centroids on the matrix and return the buckets of its rows"""
+
+        vectors = normalize(np.asarray(matrix, dtype=np.float32))
+        sample = vectors
+        if len(vectors) > self.nlist * 64:
+            rng = np.random.default_rng(self.seed)
+            sample = vectors[rng.choice(len(vectors), self.nlist * 64, replace=False)]
+        self._centroids = spherical_kmeans(sample, self.nlist, self.iterations, self.seed)
+        self._trained_on = len(vectors)
+        return self.assign(vectors)
+
+    def assign(self, vectors):
+        if not len(vectors):
+            return np.zeros(0, dtype=np.int32)
+        return np.argmax(normalize(vectors) @ self._centroids.T, axis=1).astype(np.int32)
+
+    def probe(self, query, nprobe=None):
+        """The buckets to score for the query"""
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        scores = self._centroids @ normalize(np.asarray(query, dtype=np.float32))
+        if nprobe >= self.nlist:
+            return np.arange(self.nlist)
+        return np.argpartition(-scores, nprobe - 1)[:nprobe]
@@ -2,9 +2,11 @@
 
 import os
 import time
+import heapq
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.indices.vector_store.retrievers import VectorIndexRetriever
 from llama_index.core.schema import TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
 from llama_index import core as index_core
 from llama_index.embeddings.ollama import OllamaEmbedding
 from llama_index.embeddings.openai import OpenAIEmbedding
@@ -12,9 +14,24 @@ from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core import Settings
 
 from modules import utils
+from .vector_store import (
+    NumpyVectorStore,
+    QuantizedVectorStore,
+    SharedVectorStore,
+    embedding_key,
+    get_shared_events,
+    set_shared_events,
+)
 
 
 class LlamaIndex:
+    # (expire, node_id) min-heap and (-create, node_id) max-heap, built by the first cleanup
+    _expiry, _creation = None, None
+    # the number of nodes in the docstore, counted once and kept on insert and remove
+    _count = None
+    # the process-wide SharedEmbeddings, set when embedding.shared_events is enabled
+    _shared = None
+
     def __init__(self, embedding_config, path=None):
         self._config = {"max_nodes": 0}
         if embedding_config["provider"] == "hugging_face":
@@ -40,12 +57,39 @@ class LlamaIndex:
         Settings.node_parser = SentenceSplitter(chunk_size=512, chunk_overlap=64)
         Settings.num_output = 1024
         Settings.context_window = 4096
+        numpy_store = embedding_config.get("vector_store", "numpy") == "numpy"
+        store_cls, store_kwargs = NumpyVectorStore, {"ann": embedding_config.get("ann")}
+        quantize = embedding_config.get("quantize") or {}
+        if numpy_store and embedding_config.get("shared_events", False):
+            self._shared = get_shared_events() or set_shared_events()
+            store_cls, store_kwargs["shared"] = SharedVectorStore, self._shared
+        elif quantize.get("enable", False):
+            store_cls, store_kwargs["rerank"] = QuantizedVectorStore, quantize.get("rerank", 4)
         if path and os.path.exists(path):
+            docstore, vector_store = None, None
+            if self._shared:
+                # the docstore keys the embeddings of checkpoints saved without sharing
+                docstore = SimpleDocumentStore.from_persist_dir(path)
+                store_kwargs["docstore"] = docstore
+                store_kwargs["embed"] = embed_model.get_text_embedding_batch
+            if numpy_store:
+                vector_store = store_cls.from_persist_dir(path, **store_kwargs)
             self._index = index_core.load_index_from_storage(
-                index_core.StorageContext.from_defaults(persist_dir=path),
+                index_core.StorageContext.from_defaults(
+                    persist_dir=path, docstore=docstore, vector_store=vector_store
+                ),
                 show_progress=True,
             )
             self._config = utils.load_dict(os.path.join(path, "index_config.json"))
+            self._migrate_dates()
+        elif numpy_store:
+            self._index = index_core.VectorStoreIndex(
+                [],
+                storage_context=index_core.StorageContext.from_defaults(
+                    vector_store=store_cls(**store_kwargs)
+                ),
+                show_progress=True,
+            )
         else:
             self._index = index_core.VectorStoreIndex([], show_progress=True)
         self._path = path
@@ -72,12 +116,123 @@ class LlamaIndex:
                     excluded_llm_metadata_keys=exclude_llm_keys,
                     excluded_embed_metadata_keys=exclude_embedding_keys,
                 )
+                self._fill_shared([node])
                 self._index.insert_nodes([node])
+                self._track(node)
                 return node
             except Exception as e:
                 print(f"LlamaIndex.add_node() caused an error: {e}")
                 time.sleep(5)
 
+    def _migrate_dates(self):
+        """Rewrite the stamps of old checkpoints as canonical DATE_FORMAT"""
+
+        migrated = []
+        for node in self._index.docstore.docs.values():
+            stale = [
+                key
+                for key in ("create", "expire", "access")
+                if key in node.metadata and not utils.is_canonical_date(node.metadata[key])
+            ]
+            for key in stale:
+                node.metadata[key] = utils.migrate_date(node.metadata[key])
+            if stale:
+                migrated.append(node)
+        # the docstore hands out copies, changed nodes are written back
+        if migrated:
+            self._index.docstore.add_documents(migrated, allow_update=True)
+
+    def touch(self, node_ids, date=None):
+        """Set the access of the nodes with one docstore update.
+
+        Parameters
+        ----------
+        node_ids: list
+            The ids of the accessed nodes, missing ids are skipped.
+        date: datetime.datetime
+            The access time, the current time of the timer if not given.
+
+        Returns
+        -------
+        nodes: list
+            The updated nodes.
+        """
+
+        node_ids = list(dict.fromkeys(node_ids))
+        if not node_ids:
+            return []
+        access = utils.encode_date(date or utils.get_timer().get_date())
+        docstore = self._index.docstore
+        nodes = [n for n in docstore.get_nodes(node_ids, raise_error=False) if n]
+        for node in nodes:
+            node.metadata["access"] = access
+        docstore.add_documents(nodes, allow_update=True)
+        return nodes
+
+    def add_nodes(self, batch, exclude_llm_keys=None, exclude_embedding_keys=None):
+        """Insert a batch of nodes, embedded by a single batched model call.
+
+        Parameters
+        ----------
+        batch: list
+            The (text, metadata) of the nodes.
+
+        Returns
+        -------
+        nodes: list
+            The inserted nodes in the order of batch, None for the failed items.
+        """
+
+        nodes = []
+        for text, metadata in batch:
+            metadata = metadata or {}
+            nodes.append(
+                TextNode(
+                    text=text,
+                    id_="node_" + str(self._config["max_nodes"]),
+                    metadata=metadata,
+                    excluded_llm_metadata_keys=exclude_llm_keys or list(metadata.keys()),
+                    excluded_embed_metadata_keys=exclude_embedding_keys
+                    or list(metadata.keys()),
+                )
+            )
+            self._config["max_nodes"] += 1
+        if not nodes:
+            return []
+        try:
+            self._fill_shared(nodes)
+            self._index.insert_nodes(nodes)
+        except Exception as e:
+            print(f"LlamaIndex.add_nodes() caused an error: {e}")
+            # insert one by one, so a bad item does not fail the batch
+            inserted = []
+            for node in nodes:
+                try:
+                    self._index.insert_nodes([node])
+                    inserted.append(node)
+                except Exception as e:
+                    print(f"LlamaIndex.add_nodes() failed to insert {node.id_}: {e}")
+                    inserted.append(None)
+            nodes = inserted
+        for node in nodes:
+            if node:
+                self._track(node)
+        return nodes
+
+    def _fill_shared(self, nodes):
+        """Reuse the shared embeddings, the missing texts are embedded once each"""
+
+        if not self._shared:
+            return
+        keys = [embedding_key(n) for n in nodes]
+        missing = [k for k, row in zip(keys, self._shared.find(keys)) if row is None]
+        missing = list(dict.fromkeys(missing))
+        if missing:
+            self._shared.add(missing, Settings.embed_model.get_text_embedding_batch(missing))
+        matrix = self._shared.matrix
+        for node, row in zip(nodes, self._shared.find(keys)):
+            node.embedding = matrix[row].tolist()
+
     def has_node(self, node_id):
         return node_id in self._index.docstore.docs
 
@@ -93,16 +248,65 @@ class LlamaIndex:
         return [n for n in self._index.docstore.docs.values() if _check(n)]
 
     def remove_nodes(self, node_ids, delete_from_docstore=True):
+        if self._count is not None and delete_from_docstore:
+            docstore = self._index.docstore
+            self._count -= sum(docstore.document_exists(n) for n in set(node_ids))
         self._index.delete_nodes(node_ids, delete_from_docstore=delete_from_docstore)
 
+    def _track(self, node):
+        if self._count is not None:
+            self._count += 1
+        if self._expiry is None or "expire" not in node.metadata:
+            return
+        heapq.heappush(self._expiry, (node.metadata["expire"], node.id_))
+        heapq.heappush(self._creation, self._creation_key(node))
+
+    @staticmethod
+    def _creation_key(node):
+        create = node.metadata["create"]
+        return (-utils.to_epoch(utils.to_date(create)), create, node.id_)
+
+    def _build_queues(self):
+        docs = self._index.docstore.docs
+        self._expiry, self._creation, self._count = [], [], len(docs)
+        for node in docs.values():
+            if "expire" not in node.metadata:
+                continue
+            self._expiry.append((node.metadata["expire"], node.id_))
+            self._creation.append(self._creation_key(node))
+        heapq.heapify(self._expiry)
+        heapq.heapify(self._creation)
+
     def cleanup(self):
-        now, remove_ids = utils.get_timer().get_date(), []
-        for node_id, node in self._index.docstore.docs.items():
-            create = utils.to_date(node.metadata["create"])
-            expire = utils.to_date(node.metadata["expire"])
-            if create > now or expire < now:
-                remove_ids.append(node_id)
-        self.remove_nodes(remove_ids)
+        """Remove the expired nodes and the nodes created in future.
+
+        Only the due entries are popped from the queues, entries of the
+        removed nodes are dropped lazily when they reach the top.
+        """
+
+        if self._expiry is None or len(self._expiry) > 2 * self.nodes_num + 64:
+            self._build_queues()
+        docstore, now = self._index.docstore, utils.get_timer().get_date()
+        now_str, now_epoch = utils.encode_date(now), utils.to_epoch(now)
+        remove_ids = set()
+
+        def _due(node_id, key, stamp):
+            # only the popped nodes are read, the entry is stale if the node is gone
+            node = docstore.get_node(node_id, raise_error=False)
+            return node is not None and node.metadata.get(key) == stamp
+
+        # canonical stamps compare as the dates do
+        while self._expiry and self._expiry[0][0] < now_str:
+            expire, node_id = heapq.heappop(self._expiry)
+            if _due(node_id, "expire", expire):
+                remove_ids.add(node_id)
+        while self._creation and -self._creation[0][0] > now_epoch:
+            _, create, node_id = heapq.heappop(self._creation)
+            if _due(node_id, "create", create):
+                remove_ids.add(node_id)
+        remove_ids = list(remove_ids)
+        if remove_ids:
+            self.remove_nodes(remove_ids)
         return remove_ids
 
     def retrieve(
@@ -151,6 +355,7 @@ class LlamaIndex:
                 print(f"LlamaIndex.query() caused an error: {e}")
                 time.sleep(5)
 
+    @utils.profiled("index.save")
     def save(self, path=None):
         path = path or self._path
         self._index.storage_context.persist(path)
@@ -158,4 +363,6 @@ class LlamaIndex:
 
     @property
     def nodes_num(self):
-        return len(self._index.docstore.docs)
+        if self._count is None:
+            self._count = len(self._index.docstore.docs)
+        return self._count
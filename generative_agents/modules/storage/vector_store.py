@@ -0,0 +1,773 @@
+"""generative_agents.storage.vector_store"""
+
+import os
+import json
+import threading
+from typing import Any, List
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+from llama_index.core.vector_stores.simple import _build_metadata_filter_fn
+from llama_index.core.schema import MetadataMode
+
+from modules import utils
+from .ann import IVFIndex
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """Vector store keeping the embeddings in one float32 matrix.
+
+    The matrix persists as a raw .npy file next to a json table of the node
+    ids and metadata, and is memory mapped (copy on write) when loaded, so the
+    load time and memory scale with the bytes instead of python floats.
+    Deleted rows are filled by the last row, so the live rows stay packed.
+    """
+
+    stores_text: bool = False
+
+    _matrix: Any = PrivateAttr()
+    _ids: List[str] = PrivateAttr()
+    _rows: dict = PrivateAttr()
+    _ref_doc_ids: List[str] = PrivateAttr()
+    _metadata: List[dict] = PrivateAttr()
+    _ann: Any = PrivateAttr()
+    _buckets: Any = PrivateAttr()
+    _norms: Any = PrivateAttr()
+
+    def __init__(
+        self, matrix=None, ids=None, ref_doc_ids=None, metadata=None, ann=None, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self._matrix = matrix
+        self._ids = list(ids or [])
+        self._rows = {node_id: row for row, node_id in enumerate(self._ids)}
+        self._ref_doc_ids = list(ref_doc_ids or ["None"] * len(self._ids))
+        self._metadata = list(metadata or [{} for _ in self._ids])
+        ann = dict(ann or {})
+        self._ann = IVFIndex(**ann) if ann.pop("enable", False) else None
+        self._buckets, self._norms = None, None
+
+    @classmethod
+    def class_name(cls):
+        return "NumpyVectorStore"
+
+    @property
+    def client(self):
+        return None
+
+    @property
+    def nodes_num(self):
+        return len(self._ids)
+
+    @property
+    def ann(self):
+        """The IVFIndex of the store, None if the exact search is used"""
+
+        return self._ann
+
+    @property
+    def matrix(self):
+        """The live rows of the embedding matrix, in the order of node ids"""
+
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._matrix[: len(self._ids)]
+
+    def get(self, text_id):
+        return self.matrix[self._rows[text_id]].tolist()
+
+    def _reserve(self, count, dim, dtype=np.float32):
+        size = len(self._ids)
+        if self._matrix is None:
+            self._matrix = np.zeros((max(count, 16), dim), dtype=dtype)
+        elif size + count > self._matrix.shape[0] or not self._matrix.flags.writeable:
+            capacity = max(size + count, int(self._matrix.shape[0] * 1.5) + 16)
+            matrix = np.zeros((capacity, self._matrix.shape[1]), dtype=self._matrix.dtype)
+            matrix[:size] = self._matrix[:size]
+            self._matrix = matrix
+        if self._buckets is not None and len(self._buckets) < self._matrix.shape[0]:
+            buckets = np.zeros(self._matrix.shape[0], dtype=np.int32)
+            buckets[:size] = self._buckets[:size]
+            self._buckets = buckets
+
+    def add(self, nodes, **add_kwargs):
+        nodes = [n for n in nodes]
+        if not nodes:
+            return []
+        self._norms = None
+        embeddings = np.asarray([n.get_embedding() for n in nodes], dtype=np.float32)
+        self._reserve(len(nodes), embeddings.shape[1], self._row_dtype)
+        for node, embedding in zip(nodes, embeddings):
+            metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=False)
+            metadata.pop("_node_content", None)
+            row = self._rows.get(node.node_id)
+            if row is None:
+                row = len(self._ids)
+                self._rows[node.node_id] = row
+                self._ids.append(node.node_id)
+                self._ref_doc_ids.append(node.ref_doc_id or "None")
+                self._metadata.append(metadata)
+            else:
+                self._ref_doc_ids[row] = node.ref_doc_id or "None"
+                self._metadata[row] = metadata
+            self._write_row(row, node, embedding)
+            if self._buckets is not None:
+                self._buckets[row] = self._ann.assign(embedding[None])[0]
+        return [n.node_id for n in nodes]
+
+    @property
+    def _row_dtype(self):
+        return np.float32
+
+    def _write_row(self, row, node, embedding):
+        self._matrix[row] = embedding
+
+    def _move_row(self, row, src):
+        self._matrix[row] = self._matrix[src]
+
+    def _remove_rows(self, node_ids):
+        rows = sorted((self._rows[n] for n in set(node_ids) if n in self._rows), reverse=True)
+        if rows:
+            self._norms = None
+        if rows and not self._matrix.flags.writeable:
+            self._reserve(0, self._matrix.shape[1])
+        for row in rows:
+            last = len(self._ids) - 1
+            self._rows.pop(self._ids[row])
+            self._drop_row(self._ids[row])
+            if row != last:
+                self._move_row(row, last)
+                if self._buckets is not None:
+                    self._buckets[row] = self._buckets[last]
+                self._ids[row] = self._ids[last]
+                self._ref_doc_ids[row] = self._ref_doc_ids[last]
+                self._metadata[row] = self._metadata[last]
+                self._rows[self._ids[row]] = row
+            self._ids.pop()
+            self._ref_doc_ids.pop()
+            self._metadata.pop()
+
+    def _drop_row(self, node_id):
+        pass
+
+    def delete(self, ref_doc_id, **delete_kwargs):
+        self._remove_rows(
+            [n for n, ref in zip(self._ids, self._ref_doc_ids) if ref == ref_doc_id]
+        )
+
+    def delete_nodes(self, node_ids=None, filters=None, **delete_kwargs):
+        filter_fn = _build_metadata_filter_fn(lambda n: self._metadata[self._rows[n]], filters)
+        candidates = self._ids if node_ids is None else [n for n in node_ids if n in self._rows]
+        self._remove_rows([n for n in candidates if filter_fn(n)])
+
+    def clear(self):
+        self._matrix, self._ids, self._rows = None, [], {}
+        self._ref_doc_ids, self._metadata = [], []
+        self._buckets, self._norms = None, None
+
+    def query(self, query: VectorStoreQuery, **kwargs):
+        # private attributes of pydantic models are slow to get in loops
+        id_rows, metadata = self._rows, self._metadata
+        if query.node_ids is not None:
+            node_ids = [n for n in query.node_ids if n in id_rows]
+        else:
+            node_ids = self._ids
+        if query.filters is not None:
+            filter_fn = _build_metadata_filter_fn(lambda n: metadata[id_rows[n]], query.filters)
+            node_ids = [n for n in node_ids if filter_fn(n)]
+        if not node_ids or query.query_embedding is None:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        full = node_ids is self._ids
+        if full:
+            rows = np.arange(len(node_ids))
+        else:
+            rows = np.fromiter(map(id_rows.__getitem__, node_ids), dtype=np.int64)
+        query_embedding = np.asarray(query.query_embedding, dtype=np.float32)
+        top_k = min(query.similarity_top_k or len(rows), len(rows))
+        if self._ann is not None:
+            if self._ann.need_train(len(self._ids)):
+                self._buckets = self._ann.train(self.matrix)
+            if self._buckets is not None:
+                probed = np.isin(self._buckets[rows], self._ann.probe(query_embedding))
+                # too few rows in the probed buckets, fall back to the exact search
+                if np.count_nonzero(probed) >= top_k:
+                    rows, full = rows[probed], False
+        similarities = self._score(query_embedding, rows, full)
+        rows, similarities = self._rerank(query_embedding, rows, similarities, top_k)
+        ids = self._ids
+        return VectorStoreQueryResult(
+            similarities=similarities.tolist(), ids=[ids[r] for r in rows]
+        )
+
+    def _score(self, query_embedding, rows, full):
+        if self._norms is None:
+            self._norms = row_norms(self.matrix)
+        # score the whole matrix in place, or gather the candidate rows
+        if full:
+            return cosine_similarities(query_embedding, self.matrix, self._norms)
+        return cosine_similarities(query_embedding, self.matrix[rows], self._norms[rows])
+
+    def _rerank(self, query_embedding, rows, similarities, top_k):
+        """The top_k rows and their similarities, in descending order"""
+
+        top = top_indices(similarities, top_k)
+        return rows[top], similarities[top]
+
+    def persist(self, persist_path, fs=None):
+        """Write the json table at persist_path and the matrix beside it.
+
+        Both files are written aside and then renamed, so a mapped matrix
+        of the same path stays valid.
+        """
+
+        dirpath = os.path.dirname(persist_path)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        matrix_path = _matrix_path(persist_path)
+        with open(matrix_path + ".tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(self.matrix, dtype=np.float32))
+        os.replace(matrix_path + ".tmp", matrix_path)
+        table = {
+            "format": "numpy",
+            "ids": self._ids,
+            "ref_doc_ids": self._ref_doc_ids,
+            "metadata": self._metadata,
+        }
+        with open(persist_path + ".tmp", "w") as f:
+            json.dump(table, f)
+        os.replace(persist_path + ".tmp", persist_path)
+
+    @classmethod
+    def from_persist_path(cls, persist_path, fs=None, ann=None):
+        """Load the store, stores persisted by SimpleVectorStore are converted"""
+
+        table = _read_table(persist_path)
+        floats = _read_floats(persist_path, table)
+        return cls(floats, table["ids"], table["ref_doc_ids"], table["metadata"], ann=ann)
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, namespace="default", **kwargs):
+        return cls.from_persist_path(
+            os.path.join(persist_dir, f"{namespace}__vector_store.json"), **kwargs
+        )
+
+
+class QuantizedVectorStore(NumpyVectorStore):
+    """Vector store scanning int8 codes of the embeddings.
+
+    Each row is scaled by its largest magnitude into int8, so the scanned
+    matrix is 4x smaller than float32. With rerank > 0 the float embeddings
+    stay on disk (memory mapped) and only the rerank * top_k best candidates
+    are scored again with them; with rerank 0 the float embeddings are not
+    kept at all.
+    """
+
+    _scales: Any = PrivateAttr()
+    _floats: Any = PrivateAttr()
+    _float_rows: dict = PrivateAttr()
+    _pending: dict = PrivateAttr()
+    _rerank_factor: int = PrivateAttr()
+
+    def __init__(
+        self,
+        matrix=None,
+        ids=None,
+        ref_doc_ids=None,
+        metadata=None,
+        ann=None,
+        scales=None,
+        floats=None,
+        rerank=4,
+        **kwargs,
+    ):
+        super().__init__(matrix, ids, ref_doc_ids, metadata, ann=ann, **kwargs)
+        self._scales = scales
+        self._rerank_factor = rerank
+        # float rows of the mapped file, and the rows added after it was written
+        self._floats = floats if rerank else None
+        self._float_rows = {}
+        if self._floats is not None:
+            self._float_rows = {node_id: row for row, node_id in enumerate(self._ids)}
+        self._pending = {}
+
+    @classmethod
+    def class_name(cls):
+        return "QuantizedVectorStore"
+
+    @property
+    def _row_dtype(self):
+        return np.int8
+
+    def _reserve(self, count, dim, dtype=np.float32):
+        size = len(self._ids)
+        super()._reserve(count, dim, dtype)
+        if self._scales is None or len(self._scales) < self._matrix.shape[0]:
+            scales = np.ones(self._matrix.shape[0], dtype=np.float32)
+            if self._scales is not None:
+                scales[:size] = self._scales[:size]
+            self._scales = scales
+
+    def _write_row(self, row, node, embedding):
+        codes, scales = quantize(embedding[None])
+        self._matrix[row], self._scales[row] = codes[0], scales[0]
+        if self._rerank_factor:
+            self._pending[node.node_id] = embedding.copy()
+
+    def _move_row(self, row, src):
+        super()._move_row(row, src)
+        self._scales[row] = self._scales[src]
+
+    def _drop_row(self, node_id):
+        self._pending.pop(node_id, None)
+        self._float_rows.pop(node_id, None)
+
+    def clear(self):
+        super().clear()
+        self._scales, self._floats, self._float_rows, self._pending = None, None, {}, {}
+
+    def _float_embeddings(self, rows):
+        ids, pending, float_rows = self._ids, self._pending, self._float_rows
+        embeddings = np.empty((len(rows), self._matrix.shape[1]), dtype=np.float32)
+        for idx, row in enumerate(rows):
+            node_id = ids[row]
+            if node_id in pending:
+                embeddings[idx] = pending[node_id]
+            elif node_id in float_rows:
+                embeddings[idx] = self._floats[float_rows[node_id]]
+            else:
+                embeddings[idx] = self._matrix[row] * self._scales[row]
+        return embeddings
+
+    def get(self, text_id):
+        return self._float_embeddings([self._rows[text_id]])[0].tolist()
+
+    def _rerank(self, query_embedding, rows, similarities, top_k):
+        if not self._rerank_factor:
+            return super()._rerank(query_embedding, rows, similarities, top_k)
+        candidates = top_indices(similarities, min(len(rows), top_k * self._rerank_factor))
+        rows = rows[candidates]
+        embeddings = self._float_embeddings(rows)
+        similarities = cosine_similarities(query_embedding, embeddings)
+        top = top_indices(similarities, top_k)
+        return rows[top], similarities[top]
+
+    def persist(self, persist_path, fs=None):
+        """Write the json table, the codes and scales, and the float embeddings for rerank"""
+
+        dirpath = os.path.dirname(persist_path)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        size = len(self._ids)
+        dim = self._matrix.shape[1] if self._matrix is not None else 0
+        codes = self._matrix[:size] if size else np.zeros((0, dim), dtype=np.int8)
+        scales = self._scales[:size] if size else np.zeros(0, dtype=np.float32)
+        for suffix, data in [(".int8", codes), (".scale", scales)]:
+            path = _matrix_path(persist_path, suffix)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(data))
+            os.replace(path + ".tmp", path)
+        if self._rerank_factor:
+            path = _matrix_path(persist_path)
+            floats = np.lib.format.open_memmap(
+                path + ".tmp", mode="w+", dtype=np.float32, shape=(size, dim)
+            )
+            for start in range(0, size, _CHUNK_ROWS):
+                rows = range(start, min(start + _CHUNK_ROWS, size))
+                floats[rows.start : rows.stop] = self._float_embeddings(rows)
+            floats.flush()
+            del floats
+            os.replace(path + ".tmp", path)
+            self._floats = np.load(path, mmap_mode="r") if size else None
+            self._float_rows = {node_id: row for row, node_id in enumerate(self._ids)}
+            self._pending = {}
+        table = {
+            "format": "numpy",
+            "quantized": True,
+            "floats": bool(self._rerank_factor),
+            "ids": self._ids,
+            "ref_doc_ids": self._ref_doc_ids,
+            "metadata": self._metadata,
+        }
+        with open(persist_path + ".tmp", "w") as f:
+            json.dump(table, f)
+        os.replace(persist_path + ".tmp", persist_path)
+
+    @classmethod
+    def from_persist_path(cls, persist_path, fs=None, ann=None, rerank=4):
+        """Load the store, float stores are quantized and kept for rerank"""
+
+        table = _read_table(persist_path)
+        args = (table["ids"], table["ref_doc_ids"], table["metadata"])
+        if not table.get("quantized"):
+            floats = _read_floats(persist_path, table)
+            codes, scales = quantize(floats) if floats is not None else (None, None)
+            return cls(codes, *args, ann=ann, scales=scales, floats=floats, rerank=rerank)
+        codes, scales, floats = None, None, None
+        if table["ids"]:
+            codes = np.load(_matrix_path(persist_path, ".int8"), mmap_mode="c")
+            scales = np.load(_matrix_path(persist_path, ".scale"))
+            if table.get("floats"):
+                floats = np.load(_matrix_path(persist_path), mmap_mode="r")
+        return cls(codes, *args, ann=ann, scales=scales, floats=floats, rerank=rerank)
+
+
+class SharedEmbeddings:
+    """Embeddings of the event texts, stored once for all the agents.
+
+    Rows are only appended, so a row number stays a valid reference for
+    every store holding it. The matrix persists as embeddings.npy beside
+    embeddings.json of the texts under path, and is memory mapped when loaded.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._matrix, self._norms, self._keys, self._rows = None, None, [], {}
+        self._saved = 0
+        if path and os.path.exists(os.path.join(path, "embeddings.json")):
+            with open(os.path.join(path, "embeddings.json"), "r") as f:
+                self._keys = json.load(f)["keys"]
+            self._rows = {key: row for row, key in enumerate(self._keys)}
+            if self._keys:
+                self._matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="c")
+                self._norms = row_norms(self._matrix)
+            self._saved = len(self._keys)
+
+    @property
+    def size(self):
+        return len(self._keys)
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._matrix[: len(self._keys)]
+
+    @property
+    def norms(self):
+        if self._norms is None:
+            return np.zeros(0, dtype=np.float32)
+        return self._norms[: len(self._keys)]
+
+    def key(self, row):
+        return self._keys[row]
+
+    def find(self, keys):
+        """The rows of the keys, None for the keys not stored"""
+
+        return [self._rows.get(k) for k in keys]
+
+    def add(self, keys, embeddings):
+        """Store the embeddings of the new keys and return the rows of all keys"""
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            rows = []
+            for key, embedding in zip(keys, embeddings):
+                if key not in self._rows:
+                    self._reserve(embedding.shape[0])
+                    row = len(self._keys)
+                    self._matrix[row] = embedding
+                    self._norms[row] = np.linalg.norm(embedding)
+                    self._rows[key] = row
+                    self._keys.append(key)
+                rows.append(self._rows[key])
+            return rows
+
+    def _reserve(self, dim):
+        size = len(self._keys)
+        if self._matrix is None:
+            self._matrix = np.zeros((256, dim), dtype=np.float32)
+            self._norms = np.zeros(256, dtype=np.float32)
+        elif size >= self._matrix.shape[0]:
+            capacity = int(self._matrix.shape[0] * 1.5) + 16
+            matrix = np.zeros((capacity, self._matrix.shape[1]), dtype=np.float32)
+            matrix[:size] = self._matrix[:size]
+            norms = np.zeros(capacity, dtype=np.float32)
+            norms[:size] = self._norms[:size]
+            self._matrix, self._norms = matrix, norms
+
+    def persist(self, path=None):
+        """Write the matrix and the texts, skipped if no row is added since the last write"""
+
+        path = path or self._path
+        with self._lock:
+            if not path or (self._saved == len(self._keys) and path == self._path):
+                return
+            if not os.path.exists(path):
+                os.makedirs(path)
+            matrix_path = os.path.join(path, "embeddings.npy")
+            with open(matrix_path + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(self.matrix))
+            os.replace(matrix_path + ".tmp", matrix_path)
+            table_path = os.path.join(path, "embeddings.json")
+            with open(table_path + ".tmp", "w") as f:
+                json.dump({"keys": self._keys}, f)
+            os.replace(table_path + ".tmp", table_path)
+            self._saved = len(self._keys)
+
+
+def set_shared_events(path=None):
+    """Create the process-wide shared embeddings, loaded from path if persisted"""
+
+    utils.GenerativeAgentsMap.set(utils.GenerativeAgentsKey.SHARED_EVENTS, SharedEmbeddings(path))
+    return utils.GenerativeAgentsMap.get(utils.GenerativeAgentsKey.SHARED_EVENTS)
+
+
+def get_shared_events():
+    return utils.GenerativeAgentsMap.get(utils.GenerativeAgentsKey.SHARED_EVENTS)
+
+
+def embedding_key(node):
+    return node.get_content(metadata_mode=MetadataMode.EMBED)
+
+
+class SharedVectorStore(NumpyVectorStore):
+    """Vector store referencing the rows of the SharedEmbeddings.
+
+    Each row of the store keeps only the row number of its embedding in the
+    shared matrix, so the agents perceiving the same event hold one copy of
+    its embedding. The text and the agent specific metadata stay in the
+    docstore of each agent.
+    """
+
+    _shared: Any = PrivateAttr()
+
+    def __init__(
+        self, refs=None, ids=None, ref_doc_ids=None, metadata=None, ann=None, shared=None, **kwargs
+    ):
+        if refs is not None:
+            refs = np.asarray(refs, dtype=np.int64).reshape(-1, 1)
+        super().__init__(refs, ids, ref_doc_ids, metadata, ann=ann, **kwargs)
+        self._shared = shared or get_shared_events() or set_shared_events()
+
+    @classmethod
+    def class_name(cls):
+        return "SharedVectorStore"
+
+    @property
+    def shared(self):
+        return self._shared
+
+    @property
+    def refs(self):
+        """The rows of the shared matrix, in the order of node ids"""
+
+        if self._matrix is None:
+            return np.zeros(0, dtype=np.int64)
+        return self._matrix[: len(self._ids), 0]
+
+    @property
+    def matrix(self):
+        if not self._ids:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._shared.matrix[self.refs]
+
+    def get(self, text_id):
+        return self._shared.matrix[self._matrix[self._rows[text_id], 0]].tolist()
+
+    @property
+    def _row_dtype(self):
+        return np.int64
+
+    def _reserve(self, count, dim, dtype=np.float32):
+        super()._reserve(count, 1, dtype)
+
+    def _write_row(self, row, node, embedding):
+        self._matrix[row, 0] = self._shared.add([embedding_key(node)], embedding[None])[0]
+
+    def _score(self, query_embedding, rows, full):
+        refs = self.refs if full else self.refs[rows]
+        return cosine_similarities(
+            query_embedding, self._shared.matrix[refs], self._shared.norms[refs]
+        )
+
+    def persist(self, persist_path, fs=None):
+        """Write the shared embeddings, then the json table with the refs"""
+
+        dirpath = os.path.dirname(persist_path)
+        if dirpath and not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+        self._shared.persist()
+        table = {
+            "format": "numpy",
+            "ids": self._ids,
+            "ref_doc_ids": self._ref_doc_ids,
+            "metadata": self._metadata,
+            "refs": self.refs.tolist(),
+        }
+        with open(persist_path + ".tmp", "w") as f:
+            json.dump(table, f)
+        os.replace(persist_path + ".tmp", persist_path)
+
+    @classmethod
+    def from_persist_path(
+        cls, persist_path, fs=None, ann=None, shared=None, docstore=None, embed=None
+    ):
+        """Load the store, embeddings of other stores are moved into the shared matrix.
+
+        The embedding keys are the node texts, so converting a store that
+        does not reference the shared matrix needs the docstore of the index.
+        With the docstore, references into another shared store (an agent
+        moved to another shard) are looked up again by key, and the keys
+        missing from this shared store are embedded with embed.
+        """
+
+        shared = shared or get_shared_events() or set_shared_events()
+        table = _read_table(persist_path)
+        args = (table["ids"], table["ref_doc_ids"], table["metadata"])
+        if "refs" in table and docstore is not None:
+            return cls(_resolve_refs(table, shared, docstore, embed), *args, ann=ann, shared=shared)
+        if "refs" in table:
+            if table["refs"] and max(table["refs"]) >= shared.size:
+                raise ValueError(
+                    "{} references embeddings missing from the shared store".format(persist_path)
+                )
+            return cls(table["refs"], *args, ann=ann, shared=shared)
+        floats = _read_floats(persist_path, table)
+        if floats is None:
+            return cls(None, *args, ann=ann, shared=shared)
+        if docstore is None:
+            raise ValueError("docstore is required to share the embeddings of " + persist_path)
+        keys = [embedding_key(docstore.get_node(n)) for n in table["ids"]]
+        return cls(shared.add(keys, floats), *args, ann=ann, shared=shared)
+
+
+def _resolve_refs(table, shared, docstore, embed):
+    """The rows of the table nodes in shared, checked against the node keys"""
+
+    refs = list(table["refs"])
+    keys = [embedding_key(docstore.get_node(n)) for n in table["ids"]]
+    stale = [
+        idx for idx, (ref, key) in enumerate(zip(refs, keys))
+        if ref >= shared.size or shared.key(ref) != key
+    ]
+    if not stale:
+        return refs
+    stale_keys = [keys[idx] for idx in stale]
+    missing = list(dict.fromkeys(k for k, row in zip(stale_keys, shared.find(stale_keys)) if row is None))
+    if missing:
+        if embed is None:
+            raise ValueError("{} embeddings are missing from the shared store".format(len(missing)))
+        shared.add(missing, embed(missing))
+    for idx, row in zip(stale, shared.find(stale_keys)):
+        refs[idx] = row
+    return refs
+
+
+_CHUNK_ROWS = 4096
+
+
+def _read_table(persist_path):
+    """Read the json table, the table of SimpleVectorStore carries the embeddings"""
+
+    with open(persist_path, "r") as f:
+        table = json.load(f)
+    if table.get("format") == "numpy":
+        return table
+    ids = list(table.get("embedding_dict", {}).keys())
+    return {
+        "ids": ids,
+        "ref_doc_ids": [table.get("text_id_to_ref_doc_id", {}).get(n, "None") for n in ids],
+        "metadata": [(table.get("metadata_dict") or {}).get(n, {}) for n in ids],
+        "embeddings": [table["embedding_dict"][n] for n in ids],
+    }
+
+
+def _read_floats(persist_path, table):
+    if not table["ids"]:
+        return None
+    if "embeddings" in table:
+        return np.asarray(table["embeddings"], dtype=np.float32)
+    if "refs" in table:
+        shared = get_shared_events()
+        if shared is None or max(table["refs"]) >= shared.size:
+            raise ValueError(persist_path + " references embeddings of a missing shared store")
+        return np.asarray(shared.matrix[table["refs"]])
+    if table.get("floats", True):
+        return np.load(_matrix_path(persist_path), mmap_mode="c")
+    codes = np.load(_matrix_path(persist_path, ".int8"), mmap_mode="r")
+    scales = np.load(_matrix_path(persist_path, ".scale"))
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def quantize(embeddings):
+    """Scale each row by its largest magnitude into int8.
+
+    Parameters
+    ----------
+    embeddings: np.ndarray
+        The float embeddings, shape (n, dim).
+
+    Returns
+    -------
+    codes: np.ndarray
+        The int8 codes, shape (n, dim).
+    scales: np.ndarray
+        The float32 scales, embeddings ~= codes * scales[:, None].
+    """
+
+    codes = np.empty(embeddings.shape, dtype=np.int8)
+    scales = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), _CHUNK_ROWS):
+        chunk = np.asarray(embeddings[start : start + _CHUNK_ROWS], dtype=np.float32)
+        chunk_scales = np.abs(chunk).max(axis=1) / 127
+        chunk_scales[chunk_scales == 0] = 1
+        codes[start : start + len(chunk)] = np.round(chunk / chunk_scales[:, None])
+        scales[start : start + len(chunk)] = chunk_scales
+    return codes, scales
+
+
+def _matrix_path(persist_path, suffix=""):
+    return os.path.splitext(persist_path)[0] + suffix + ".npy"
+
+
+def top_indices(scores, top_k):
+    top = np.argpartition(-scores, top_k - 1)[:top_k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def cosine_similarities(query, matrix, norms=None):
+    """Cosine similarities of the query vector against rows of the matrix.
+
+    Parameters
+    ----------
+    query: np.ndarray
+        The query vector, shape (dim,).
+    matrix: np.ndarray
+        The candidate vectors, shape (n, dim).
+    norms: np.ndarray
+        The cached norms of the candidate vectors, computed if not given.
+
+    Returns
+    -------
+    similarities: np.ndarray
+        The similarities, shape (n,).
+    """
+
+    if norms is None:
+        norms = row_norms(matrix)
+    norms = norms * np.linalg.norm(query)
+    norms[norms == 0] = 1
+    if matrix.dtype == np.float32:
+        return (matrix @ query) / norms
+    # int8 codes are converted block by block to bound the temporary memory
+    dots = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), _CHUNK_ROWS):
+        block = matrix[start : start + _CHUNK_ROWS].astype(np.float32)
+        dots[start : start + len(block)] = block @ query
+    return dots / norms
+
+
+def row_norms(matrix):
+    norms = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), _CHUNK_ROWS):
+        block = matrix[start : start + _CHUNK_ROWS].astype(np.float32)
+        norms[start : start + len(block)] = np.linalg.norm(block, axis=1)
+    return norms
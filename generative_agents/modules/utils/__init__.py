@@ -2,5 +2,6 @@
 
 from .arguments import *
 from .log import *
+from .metrics import *
 from .namespace import *
 from .timer import *
@@ -0,0 +1,128 @@
+"""generative_agents.utils.metrics"""
+
+import time
+import functools
+import contextvars
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, start_http_server
+
+
+def get_or_create_counter(name, documentation, labelnames=()):
+    """Create a counter, or reuse the one already registered under the name"""
+
+    try:
+        return Counter(name, documentation, labelnames)
+    except ValueError:
+        return REGISTRY._names_to_collectors[name]  # type: ignore[attr-defined]
+
+
+def get_or_create_histogram(name, documentation, labelnames=(), buckets=None):
+    """Create a histogram, or reuse the one already registered under the name"""
+
+    kwargs = {"buckets": buckets} if buckets else {}
+    try:
+        return Histogram(name, documentation, labelnames, **kwargs)
+    except ValueError:
+        return REGISTRY._names_to_collectors[name]  # type: ignore[attr-defined]
+
+
+def get_or_create_gauge(name, documentation, labelnames=()):
+    """Create a gauge, or reuse the one already registered under the name"""
+
+    try:
+        return Gauge(name, documentation, labelnames)
+    except ValueError:
+        return REGISTRY._names_to_collectors[name]  # type: ignore[attr-defined]
+
+
+PHASE_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300
+)
+
+PHASE_SECONDS = get_or_create_histogram(
+    "generative_agents_phase_seconds",
+    "Wall-clock seconds spent in a simulation phase",
+    ["agent", "phase", "caller"],
+    buckets=PHASE_BUCKETS,
+)
+
+_CURRENT_AGENT = contextvars.ContextVar("generative_agents_agent", default="")
+
+
+def current_agent():
+    """Get the name of the agent the current context is working for"""
+
+    return _CURRENT_AGENT.get()
+
+
+@contextmanager
+def agent_scope(name):
+    """Attribute the metrics recorded inside the block to the agent"""
+
+    token = _CURRENT_AGENT.set(name)
+    try:
+        yield
+    finally:
+        _CURRENT_AGENT.reset(token)
+
+
+@contextmanager
+def profile(phase, caller="", agent=None):
+    """Record the wall-clock time of the block as a phase sample"""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PHASE_SECONDS.labels(
+            agent=agent if agent is not None else current_agent(),
+            phase=phase,
+            caller=caller,
+        ).observe(time.perf_counter() - start)
+
+
+def profiled(phase, caller=None):
+    """Decorate a function so each call is recorded as a phase sample.
+
+    Parameters
+    ----------
+    phase: str
+        The phase label.
+    caller: str
+        The caller label, default to the name of the function.
+
+    Returns
+    -------
+    decorator: callable
+        The decorator.
+    """
+
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            with profile(phase, caller or func.__name__):
+                return func(*args, **kwargs)
+
+        return _wrapper
+
+    return _decorator
+
+
+def start_metrics_server(port, addr="0.0.0.0"):
+    """Expose the default registry over http for prometheus to scrape.
+
+    Parameters
+    ----------
+    port: int
+        The port to listen on.
+    addr: str
+        The address to bind.
+
+    Returns
+    -------
+    port: int
+        The port the exporter listens on.
+    """
+
+    start_http_server(port, addr=addr)
+    return port
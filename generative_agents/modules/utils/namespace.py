@@ -42,3 +42,6 @@ class GenerativeAgentsKey:
     GAME = "game"
     TIMER = "timer"
     MODELS = "models"
+    SCHEDULER = "scheduler"
+    RESPONSE_CACHE = "response_cache"
+    SHARED_EVENTS = "shared_events"
@@ -1,16 +1,110 @@
 """generative_agents.utils.timer"""
 
 import datetime
+import functools
 
 from .namespace import GenerativeAgentsMap, GenerativeAgentsKey
 
 
-def to_date(date_str, date_format="%Y%m%d-%H:%M:%S"):
+DATE_FORMAT = "%Y%m%d-%H:%M:%S"
+
+
+@functools.lru_cache(maxsize=65536)
+def _parse_stamp(date_str):
+    """Parse the fixed width %Y%m%d-%H:%M:%S stamp by slicing"""
+
+    if len(date_str) != 17 or date_str[8] != "-" or date_str[11] != ":" or date_str[14] != ":":
+        return datetime.datetime.strptime(date_str, DATE_FORMAT)
+    return datetime.datetime(
+        int(date_str[0:4]),
+        int(date_str[4:6]),
+        int(date_str[6:8]),
+        int(date_str[9:11]),
+        int(date_str[12:14]),
+        int(date_str[15:17]),
+    )
+
+
+@functools.lru_cache(maxsize=2048)
+def _parse_clock(date_str):
+    hour, _, minute = date_str.partition(":")
+    if not (hour.isdigit() and minute.isdigit() and len(minute) == 2):
+        return datetime.datetime.strptime(date_str, "%H:%M")
+    return datetime.datetime(1900, 1, 1, int(hour), int(minute))
+
+
+def to_date(date_str, date_format=DATE_FORMAT):
     if date_format == "%H:%M" and date_str.startswith("24:"):
         date_str = date_str.replace("24:", "0:")
+    if date_format == DATE_FORMAT:
+        return _parse_stamp(date_str)
+    if date_format == "%H:%M":
+        return _parse_clock(date_str)
     return datetime.datetime.strptime(date_str, date_format)
 
 
+def encode_date(date):
+    """Encode the date as the canonical DATE_FORMAT stamp.
+
+    The stamps are fixed width, so they sort and compare as the dates do.
+    """
+
+    return "{:04d}{:02d}{:02d}-{:02d}:{:02d}:{:02d}".format(
+        date.year, date.month, date.day, date.hour, date.minute, date.second
+    )
+
+
+def is_canonical_date(date_str):
+    return (
+        isinstance(date_str, str)
+        and len(date_str) == 17
+        and date_str[8] == "-"
+        and date_str[11] == ":"
+        and date_str[14] == ":"
+        and (date_str[:8] + date_str[9:11] + date_str[12:14] + date_str[15:]).isdigit()
+    )
+
+
+def migrate_date(value):
+    """Convert the stamp of old checkpoints to the canonical DATE_FORMAT.
+
+    Parameters
+    ----------
+    value: str, int or float
+        The stamp, either a DATE_FORMAT string (padded or not), a minute
+        precision %Y%m%d-%H:%M string or epoch seconds.
+
+    Returns
+    -------
+    date_str: str
+        The canonical stamp.
+    """
+
+    if is_canonical_date(value):
+        return value
+    if isinstance(value, (int, float)):
+        return encode_date(from_epoch(int(value)))
+    for date_format in (DATE_FORMAT, "%Y%m%d-%H:%M"):
+        try:
+            return encode_date(datetime.datetime.strptime(value, date_format))
+        except ValueError:
+            continue
+    raise ValueError("unknown date stamp {}".format(value))
+
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_epoch(date):
+    """Naive datetime to integer seconds, free of the local timezone"""
+
+    return int((date - _EPOCH).total_seconds())
+
+
+def from_epoch(seconds):
+    return _EPOCH + datetime.timedelta(seconds=seconds)
+
+
 def daily_duration(date, mode="minute"):
     duration = date.hour % 24
     if mode == "hour":
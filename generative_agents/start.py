@@ -7,6 +7,7 @@ import datetime
 from dotenv import load_dotenv, find_dotenv
 
 from modules.game import create_game, get_game
+from modules.shard import connect_worker, create_sharded_game, listen_sharded_game, parse_address
 from modules import utils
 
 personas = [
@@ -15,7 +16,7 @@ personas = [
 
 
 class SimulateServer:
-    def __init__(self, name, static_root, checkpoints_folder, config, start_step=0, verbose="info", log_file=""):
+    def __init__(self, name, static_root, checkpoints_folder, config, start_step=0, verbose="info", log_file="", shards=0, listen=""):
         self.name = name
         self.static_root = static_root
         self.checkpoints_folder = checkpoints_folder
@@ -38,8 +39,19 @@ class SimulateServer:
         else:
             self.logger = utils.create_io_logger(verbose)
 
-        # 创建游戏
-        game = create_game(name, static_root, config, conversation, logger=self.logger)
+        # 创建游戏，shards大于1时智能体分布在多个进程中，指定listen时由其他机器上的worker连接
+        log_path = f"{checkpoints_folder}/{log_file}" if log_file else ""
+        if shards > 1 and listen:
+            game = listen_sharded_game(
+                name, static_root, config, conversation, parse_address(listen), shard_authkey(),
+                shards, self.logger, verbose, log_path
+            )
+        elif shards > 1:
+            game = create_sharded_game(
+                name, static_root, config, conversation, shards, self.logger, verbose, log_path
+            )
+        else:
+            game = create_game(name, static_root, config, conversation, logger=self.logger)
         game.reset_game()
 
         self.game = get_game()
@@ -49,6 +61,7 @@ class SimulateServer:
             agent_base = config["agent_base"]
         else:
             agent_base = {}
+        think_intervals = []
         for agent_name, agent in config["agents"].items():
             agent_config = copy.deepcopy(agent_base)
             agent_config.update(self.load_static(agent["config_path"]))
@@ -56,9 +69,13 @@ class SimulateServer:
                 "coord": agent_config["coord"],
                 "path": [],
             }
-        self.think_interval = max(
-            a.think_config["interval"] for a in self.game.agents.values()
-        )
+            # 与Game中创建智能体时相同的配置合并
+            think_config = utils.update_dict(
+                utils.update_dict(copy.deepcopy(agent_base), self.load_static(agent["config_path"])),
+                copy.deepcopy(agent),
+            )["think"]
+            think_intervals.append(think_config["interval"])
+        self.think_interval = max(think_intervals)
         self.start_step = start_step
 
     def simulate(self, step, stride=0):
@@ -66,12 +83,12 @@ class SimulateServer:
         for i in range(self.start_step, self.start_step + step):
             title = "Simulate Step[{}/{}, time: {}]".format(i+1, self.start_step + step, timer.get_date())
             self.logger.info("\n" + utils.split_line(title, "="))
+            results = self.game.step(self.agent_status)
             for name, status in self.agent_status.items():
-                plan = self.game.agent_think(name, status)["plan"]
-                agent = self.game.get_agent(name)
+                plan = results[name]["plan"]
                 if name not in self.config["agents"]:
                     self.config["agents"][name] = {}
-                self.config["agents"][name].update(agent.to_dict())
+                self.config["agents"][name].update(results[name]["checkpoint"])
                 if plan.get("path"):
                     status["coord"], status["path"] = plan["path"][-1], []
                 self.config["agents"][name].update(
@@ -87,11 +104,13 @@ class SimulateServer:
                 }
             )
             # 保存Agent活动数据
-            with open(f"{self.checkpoints_folder}/simulate-{sim_time.replace(':', '')}.json", "w", encoding="utf-8") as f:
-                f.write(json.dumps(self.config, indent=2, ensure_ascii=False))
+            with utils.profile("checkpoint", "simulate"):
+                with open(f"{self.checkpoints_folder}/simulate-{sim_time.replace(':', '')}.json", "w", encoding="utf-8") as f:
+                    f.write(json.dumps(self.config, indent=2, ensure_ascii=False))
             # 保存Conversation数据
-            with open(f"{self.checkpoints_folder}/conversation.json", "w", encoding="utf-8") as f:
-                f.write(json.dumps(self.game.conversation, indent=2, ensure_ascii=False))
+            with utils.profile("checkpoint", "conversation"):
+                with open(f"{self.checkpoints_folder}/conversation.json", "w", encoding="utf-8") as f:
+                    f.write(json.dumps(self.game.conversation, indent=2, ensure_ascii=False))
 
             if stride > 0:
                 timer.forward(stride)
@@ -150,6 +169,15 @@ def get_config(start_time="20240213-09:30", stride=15, agents=None):
     return config
 
 
+def shard_authkey():
+    # 主进程与worker通过环境变量SHARD_AUTHKEY共享的认证密钥
+    authkey = os.environ.get("SHARD_AUTHKEY", "")
+    if not authkey:
+        print("Please set SHARD_AUTHKEY to run shards over the network.")
+        exit(1)
+    return authkey.encode("utf-8")
+
+
 load_dotenv(find_dotenv())
 
 parser = argparse.ArgumentParser(description="console for village")
@@ -160,10 +188,19 @@ parser.add_argument("--step", type=int, default=10, help="The simulate step")
 parser.add_argument("--stride", type=int, default=10, help="The step stride in minute")
 parser.add_argument("--verbose", type=str, default="debug", help="The verbose level")
 parser.add_argument("--log", type=str, default="", help="Name of the log file")
+parser.add_argument("--metrics_port", type=int, default=0, help="Port of the prometheus exporter, 0 to disable")
+parser.add_argument("--shards", type=int, default=0, help="Number of processes to think the agents, 0 or 1 to think in this process")
+parser.add_argument("--listen", type=str, default="", help="host:port to wait for the shard workers, with --shards")
+parser.add_argument("--connect", type=str, default="", help="host:port of the master, run as a shard worker")
 args = parser.parse_args()
 
 
 if __name__ == "__main__":
+    # 作为worker运行，思考主进程分配的智能体
+    if args.connect:
+        connect_worker(parse_address(args.connect), shard_authkey())
+        exit(0)
+
     checkpoints_path = "results/checkpoints"
 
     name = args.name
@@ -193,5 +230,12 @@ if __name__ == "__main__":
 
     static_root = "frontend/static"
 
-    server = SimulateServer(name, static_root, checkpoints_folder, sim_config, start_step, args.verbose, args.log)
-    server.simulate(args.step, args.stride)
+    if args.metrics_port > 0:
+        utils.start_metrics_server(args.metrics_port)
+
+    server = SimulateServer(name, static_root, checkpoints_folder, sim_config, start_step, args.verbose, args.log, args.shards, args.listen)
+    try:
+        server.simulate(args.step, args.stride)
+    finally:
+        if args.shards > 1:
+            server.game.close()
@@ -0,0 +1,195 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from generative_agents.modules import agent as agent_module
+from generative_agents.modules.agent import Agent
+from generative_agents.modules.maze import Maze
+from generative_agents.modules.utils.timer import set_timer
+from generative_agents.modules.utils.log import create_io_logger
+
+from tests.test_agent_awake_and_move import minimal_agent_config, minimal_maze_config
+
+
+def _make_agents(tmp_path, speculative, chat_iter=3):
+    set_timer("20240101-09:00")
+    logger = create_io_logger("info")
+    maze = Maze(minimal_maze_config(), logger)
+    agents = []
+    for name in ["A", "B"]:
+        cfg = minimal_agent_config(name)
+        cfg["chat_iter"] = chat_iter
+        cfg["think"]["speculative_chat"] = speculative
+        cfg["storage_root"] = str(tmp_path / name)
+        agents.append(Agent(cfg, maze, conversation={}, logger=logger))
+    return agents
+
+
+def _script(monkeypatch, end_after):
+    calls, lock = [], threading.Lock()
+
+    def fake_completion(self, func_hint, *args):
+        with lock:
+            calls.append((self.name, func_hint))
+        if func_hint == "generate_chat":
+            agent, chats = args[0], args[3]
+            return "{}-{}".format(agent.name, len(chats))
+        if func_hint == "generate_chat_check_repeat":
+            return False
+        if func_hint == "decide_chat_terminate":
+            return len(args[2]) >= end_after
+        raise AssertionError(func_hint)
+
+    monkeypatch.setattr(Agent, "completion", fake_completion)
+    return calls
+
+
+@pytest.mark.parametrize("end_after", [2, 3, 6])
+def test_speculative_chat_matches_sequential(monkeypatch, tmp_path, end_after):
+    results = {}
+    for speculative in [False, True]:
+        calls = _script(monkeypatch, end_after)
+        a, b = _make_agents(tmp_path / str(speculative), speculative)
+        results[speculative] = (a._generate_chats(b, ["r0", "r1"]), calls)
+
+    (seq_chats, seq_calls), (spec_chats, spec_calls) = results[False], results[True]
+    assert spec_chats == seq_chats
+    assert seq_chats[0] == ("A", "A-0") and seq_chats[1] == ("B", "B-1")
+    assert len(seq_chats) == min(end_after, 6)
+    # speculation only adds calls, the sequential ones are all kept
+    assert set(seq_calls) <= set(spec_calls)
+    assert len(spec_calls) >= len(seq_calls)
+
+
+def test_sequential_chat_keeps_original_order(monkeypatch, tmp_path):
+    calls = _script(monkeypatch, 3)
+    a, b = _make_agents(tmp_path, False)
+    a._generate_chats(b, ["r0", "r1"])
+    assert calls == [
+        ("A", "generate_chat"),
+        ("B", "generate_chat"),
+        ("B", "decide_chat_terminate"),
+        ("A", "generate_chat"),
+        ("A", "generate_chat_check_repeat"),
+        ("A", "decide_chat_terminate"),
+    ]
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_completion_many_resolves_refs_in_order(monkeypatch, tmp_path, concurrent):
+    from generative_agents.modules.agent import Ref
+
+    a, b = _make_agents(tmp_path, False)
+    a.think_config["concurrent_completions"] = concurrent
+    # the two independent calls must overlap when concurrent
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fake_completion(self, func_hint, *args):
+        if func_hint in ("retrieve_plan", "summarize_relation") and concurrent:
+            barrier.wait()
+        return "{}:{}({})".format(self.name, func_hint, ",".join(map(str, args)))
+
+    monkeypatch.setattr(Agent, "completion", fake_completion)
+    outputs = a.completion_many(
+        [
+            ("retrieve_plan", "x"),
+            (b, "summarize_relation", "A"),
+            ("retrieve_currently", Ref(0), Ref(1)),
+        ]
+    )
+    assert outputs == [
+        "A:retrieve_plan(x)",
+        "B:summarize_relation(A)",
+        "A:retrieve_currently(A:retrieve_plan(x),B:summarize_relation(A))",
+    ]
+
+
+class _SyncExecutor:
+    """Run each submitted call at once, so the discarded turns run to the end"""
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        future.set_result(func(*args, **kwargs))
+        return future
+
+
+def test_speculative_chat_touches_memory_of_used_turns_only(monkeypatch, tmp_path):
+    monkeypatch.setattr(agent_module, "_EXECUTOR", _SyncExecutor())
+    monkeypatch.setattr(Agent, "llm_available", lambda self: False)
+    a, b = _make_agents(tmp_path, True)
+    touched = []
+
+    def _prompt(func_hint, failsafe):
+        def _build(agent, *args):
+            turn = args[-1] if func_hint != "generate_chat_check_repeat" else args[-2]
+            return {
+                "prompt": func_hint,
+                "failsafe": failsafe(agent, turn),
+                "accessed": ["{}:{}:{}".format(agent.name, func_hint, len(turn))],
+            }
+
+        return _build
+
+    for agent in (a, b):
+        monkeypatch.setattr(agent.associate, "touch", lambda node_ids: touched.extend(node_ids))
+        monkeypatch.setattr(
+            agent.scratch,
+            "prompt_generate_chat",
+            _prompt("generate_chat", lambda agent, turn: "{}-{}".format(agent.name, len(turn))),
+        )
+        monkeypatch.setattr(
+            agent.scratch,
+            "prompt_generate_chat_check_repeat",
+            _prompt("generate_chat_check_repeat", lambda agent, turn: False),
+        )
+        monkeypatch.setattr(
+            agent.scratch,
+            "prompt_decide_chat_terminate",
+            _prompt("decide_chat_terminate", lambda agent, turn: len(turn) >= 2),
+        )
+
+    assert a._generate_chats(b, ["r0", "r1"]) == [("A", "A-0"), ("B", "B-1")]
+    # the next turn of A is generated, then thrown away once B ends the chat
+    assert touched == [
+        "A:generate_chat:0",
+        "B:generate_chat:1",
+        "B:decide_chat_terminate:2",
+    ]
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_reflect_adds_every_insight_with_its_evidence(monkeypatch, tmp_path, concurrent):
+    import types
+
+    a, _ = _make_agents(tmp_path, False)
+    a.think_config.update({"poignancy_max": 10, "concurrent_completions": concurrent})
+    a.status["poignancy"] = 10
+    node = types.SimpleNamespace(node_id="node_0", access=0)
+    monkeypatch.setattr(a.associate, "retrieve_events", lambda text=None: [node])
+    monkeypatch.setattr(a.associate, "retrieve_thoughts", lambda text=None: [])
+    monkeypatch.setattr(
+        a.associate,
+        "retrieve_focus",
+        lambda focus, reduce_all=True: {f: [f + "-node"] for f in focus},
+    )
+
+    def fake_completion(self, func_hint, *args):
+        if func_hint == "reflect_focus":
+            return ["f1", "f2"]
+        if func_hint == "reflect_insights":
+            nodes = args[0]
+            return [("insight of " + nodes[0], nodes), ("more of " + nodes[0], nodes)]
+        raise AssertionError(func_hint)
+
+    added = []
+    monkeypatch.setattr(Agent, "completion", fake_completion)
+    monkeypatch.setattr(a, "_add_concepts", added.extend)
+    a.reflect()
+    assert [(e_type, event.object, evidence) for e_type, event, evidence in added] == [
+        ("thought", "insight of f1-node", ["f1-node"]),
+        ("thought", "more of f1-node", ["f1-node"]),
+        ("thought", "insight of f2-node", ["f2-node"]),
+        ("thought", "more of f2-node", ["f2-node"]),
+    ]
+    assert a.status["poignancy"] == 0
@@ -6,6 +6,7 @@ from generative_agents.modules.model.llm_model import (
     parse_llm_output,
     create_llm_model,
     OllamaLLMModel,
+    LLMModel,
 )
 
 
@@ -65,3 +66,423 @@ def test_ollama_completion_monkeypatched(monkeypatch):
     # If prompt already contains /nothink, it should not append it again (we check by behavior)
     out2 = model._completion("hello\n/nothink", temperature=0.1)
     assert out2 == "Final answer"
+
+
+class _ScriptedLLMModel(LLMModel):
+    """Replays canned responses instead of calling a provider"""
+
+    def __init__(self, responses, usage=None, base_url="http://x", resilience=None):
+        self._responses = list(responses)
+        self._fixed_usage = usage
+        super().__init__(
+            {
+                "api_key": "",
+                "base_url": base_url,
+                "model": "scripted",
+                "resilience": resilience,
+            }
+        )
+
+    def setup(self, config):
+        return None
+
+    def _completion(self, prompt, **kwargs):
+        response = self._responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        self._set_usage(self._fixed_usage)
+        return response
+
+
+def _sample(name, **labels):
+    from prometheus_client import REGISTRY
+
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_completion_records_per_caller_metrics(monkeypatch):
+    import generative_agents.modules.model.llm_model as llm_module
+
+    monkeypatch.setattr(llm_module.time, "sleep", lambda s: None)
+    labels = {"caller": "poignancy_event", "model": "scripted"}
+    before = {
+        name: _sample(name, **labels)
+        for name in [
+            "llm_retries_total",
+            "llm_callback_failures_total",
+            "llm_prompt_tokens_total",
+            "llm_completion_tokens_total",
+            "llm_request_latency_seconds_count",
+        ]
+    }
+
+    model = _ScriptedLLMModel(
+        ["no score", RuntimeError("down"), "Score: 7"],
+        usage={"prompt_tokens": 10, "completion_tokens": 2},
+    )
+    out = model.completion(
+        "rate it",
+        callback=lambda r: int(parse_llm_output(r, r"Score: (\d+)")),
+        failsafe=1,
+        caller="poignancy_event",
+    )
+    assert out == 7
+    assert _sample("llm_retries_total", **labels) == before["llm_retries_total"] + 2
+    assert (
+        _sample("llm_callback_failures_total", **labels)
+        == before["llm_callback_failures_total"] + 1
+    )
+    assert _sample("llm_prompt_tokens_total", **labels) == before["llm_prompt_tokens_total"] + 20
+    assert (
+        _sample("llm_completion_tokens_total", **labels)
+        == before["llm_completion_tokens_total"] + 4
+    )
+    assert (
+        _sample("llm_request_latency_seconds_count", **labels)
+        == before["llm_request_latency_seconds_count"] + 3
+    )
+    assert (
+        _sample("llm_requests_total", status="error", **labels) >= 1
+    )
+    assert model.get_summary()["summary"]["poignancy_event"] == "S:1,F:0/R:2"
+
+
+def test_completion_falls_back_to_failsafe(monkeypatch):
+    import generative_agents.modules.model.llm_model as llm_module
+
+    monkeypatch.setattr(llm_module.time, "sleep", lambda s: None)
+    labels = {"caller": "wake_up", "model": "scripted"}
+    before = _sample("llm_failsafe_total", **labels)
+    model = _ScriptedLLMModel(["x", "y"])
+    out = model.completion("p", retry=2, callback=lambda r: None, failsafe=6, caller="wake_up")
+    assert out == 6
+    assert _sample("llm_failsafe_total", **labels) == before + 1
+
+
+def test_structured_completion_repairs_instead_of_retrying(monkeypatch):
+    import generative_agents.modules.model.llm_model as llm_module
+
+    monkeypatch.setattr(llm_module.time, "sleep", lambda s: None)
+    labels = {"caller": "poignancy_chat", "model": "scripted"}
+    before = _sample("llm_retries_avoided_total", **labels)
+    seen = []
+
+    class _SchemaModel(_ScriptedLLMModel):
+        def _completion(self, prompt, schema=None, **kwargs):
+            seen.append(schema)
+            return super()._completion(prompt, **kwargs)
+
+    model = _SchemaModel(['```json\n{"score": "8",}\n```'])
+    model._structured_output = True
+    schema = {"type": "object", "properties": {"score": {"type": "integer"}}, "required": ["score"]}
+    out = model.completion(
+        "rate it",
+        callback=lambda r: int(parse_llm_output(r, r"Score: (\d+)")),
+        failsafe=1,
+        caller="poignancy_chat",
+        structured={"schema": schema, "callback": lambda data: data["score"]},
+    )
+    assert out == 8 and seen == [schema]
+    assert _sample("llm_retries_avoided_total", **labels) == before + 1
+
+    # repaired data rejected by the callback is retried, not counted as avoided
+    def _accept_nine(data):
+        if data["score"] != 9:
+            raise ValueError("score out of range")
+        return data["score"]
+
+    model = _SchemaModel(['{"score": "8",}', '{"score": 9}'])
+    model._structured_output = True
+    out = model.completion(
+        "rate it",
+        callback=lambda r: None,
+        failsafe=1,
+        caller="poignancy_chat",
+        structured={"schema": schema, "callback": _accept_nine},
+    )
+    assert out == 9
+    assert _sample("llm_retries_avoided_total", **labels) == before + 1
+
+
+def test_ollama_completion_sends_response_format(monkeypatch):
+    model = create_llm_model(
+        {"provider": "ollama", "api_key": "", "base_url": "http://x", "model": "m"}
+    )
+    captured = {}
+
+    def fake_ollama_chat(messages, temperature, response_format=None):
+        captured["prompt"] = messages[0]["content"]
+        captured["response_format"] = response_format
+        return {"choices": [{"message": {"content": '{"answer": true}'}}]}
+
+    monkeypatch.setattr(model, "ollama_chat", fake_ollama_chat)
+    schema = {"type": "object", "properties": {"answer": {"type": "boolean"}}}
+    assert model._completion("q", schema=schema) == '{"answer": true}'
+    assert captured["response_format"]["json_schema"]["schema"] == schema
+    assert "JSON" in captured["prompt"]
+
+
+def test_open_circuit_fails_fast_to_failsafe(monkeypatch):
+    import generative_agents.modules.model.llm_model as llm_module
+
+    monkeypatch.setattr(llm_module.time, "sleep", lambda s: None)
+    endpoint = "http://circuit-test"
+    before = _sample("llm_short_circuits_total", endpoint=endpoint, caller="wake_up")
+    resilience = {"failure_threshold": 2, "recovery_timeout": 60}
+    model = _ScriptedLLMModel([RuntimeError("down")] * 10, base_url=endpoint, resilience=resilience)
+    assert model.is_available()
+    assert model.completion("p", failsafe=6, caller="wake_up") == 6
+    # two failures open the circuit, the remaining retries are skipped
+    assert len(model._responses) == 8
+    assert not model.is_available()
+    assert _sample("llm_short_circuits_total", endpoint=endpoint, caller="wake_up") == before + 1
+
+    other = _ScriptedLLMModel(["ok"], base_url=endpoint)
+    assert other.completion("p", failsafe="safe", caller="wake_up") == "safe"
+    assert other._responses == ["ok"]
+
+
+def _pool(monkeypatch, urls, **config):
+    model = create_llm_model(
+        {
+            "provider": "pool",
+            "api_key": "",
+            "model": "m",
+            "endpoints": urls,
+            "health_check_interval": 0,
+            **config,
+        }
+    )
+    routed = []
+    for backend in model.backends:
+
+        def _completion(prompt, _url=backend._base_url, **kwargs):
+            routed.append(_url)
+            return "answer"
+
+        monkeypatch.setattr(backend, "_completion", _completion)
+    return model, routed
+
+
+def test_pool_routes_to_least_outstanding_and_sticks(monkeypatch):
+    urls = ["http://pool-a", "http://pool-b"]
+    model, routed = _pool(monkeypatch, urls)
+    busy = model.backends[0]._guard.limiter
+    assert busy.acquire(timeout=0)
+    try:
+        assert model.completion("p") == "answer"
+        assert model.completion("p") == "answer"
+    finally:
+        busy.release()
+    # the agent stays on its endpoint even after the other one frees up
+    assert model.completion("p") == "answer"
+    assert routed == ["http://pool-b"] * 3
+
+
+def test_pool_skips_open_endpoint_and_health_check_recovers(monkeypatch):
+    import generative_agents.modules.model.llm_model as llm_module
+
+    urls = ["http://pool-c", "http://pool-d"]
+    model, routed = _pool(monkeypatch, urls, sticky=False)
+    down = model.backends[0]._guard.breaker
+    for _ in range(down.failure_threshold):
+        down.record_failure()
+    assert model.is_available()
+    model.completion("p")
+    assert routed == ["http://pool-d"]
+
+    class _Ok:
+        def raise_for_status(self):
+            pass
+
+    monkeypatch.setattr(llm_module.requests, "get", lambda url, **kwargs: _Ok())
+    model.check_health()
+    assert down.state == "closed"
+
+
+def test_completion_records_shared_prompt_prefix():
+    from modules.utils.metrics import agent_scope
+
+    before = _sample("llm_prompt_shared_prefix_chars_total", agent="prefix-agent")
+    model = _ScriptedLLMModel(["a", "b"])
+    with agent_scope("prefix-agent"):
+        model.completion("persona\nquestion one")
+        model.completion("persona\nquestion two")
+    assert _sample("llm_prompt_shared_prefix_chars_total", agent="prefix-agent") == before + len(
+        "persona\nquestion "
+    )
+
+
+def test_ollama_stream_stops_once_answer_decided(monkeypatch):
+    import json
+    import generative_agents.modules.model.llm_model as llm_module
+
+    model = create_llm_model(
+        {"provider": "ollama", "api_key": "", "base_url": "http://x", "model": "m", "stream": True}
+    )
+    deltas = ["<think>yes or no", "</think>", "No", ", because", " it is late"]
+    consumed, captured = [], {}
+
+    class _Stream:
+        closed = False
+
+        def raise_for_status(self):
+            pass
+
+        def iter_lines(self, decode_unicode=False):
+            for delta in deltas:
+                consumed.append(delta)
+                yield "data: " + json.dumps({"choices": [{"delta": {"content": delta}}]})
+            yield "data: [DONE]"
+
+        def close(self):
+            self.closed = True
+
+    stream = _Stream()
+
+    def fake_post(url, json=None, **kwargs):
+        captured.update(json)
+        return stream
+
+    monkeypatch.setattr(llm_module.requests, "post", fake_post)
+    before = _sample("llm_stream_early_stops_total", model="m")
+    out = model.completion(
+        "Answer yes or no",
+        early_stop=lambda text: "no" in text.lower() or "yes" in text.lower(),
+    )
+    assert out == "No"
+    assert captured["stream"] is True
+    assert consumed == deltas[:3] and stream.closed
+    assert _sample("llm_stream_early_stops_total", model="m") == before + 1
+
+
+def test_early_stop_ignored_without_stream():
+    seen = []
+
+    class _Model(_ScriptedLLMModel):
+        def _completion(self, prompt, **kwargs):
+            seen.append(kwargs)
+            return super()._completion(prompt)
+
+    _Model(["Yes"]).completion("q", early_stop=lambda text: True)
+    assert seen == [{}]
+
+
+@pytest.mark.parametrize("caller, coalesced", [("describe_object", True), ("generate_chat", False)])
+def test_identical_inflight_prompts_are_coalesced(caller, coalesced):
+    import threading
+    import time
+
+    release, calls = threading.Event(), []
+
+    class _SlowModel(_ScriptedLLMModel):
+        def _completion(self, prompt, **kwargs):
+            calls.append(prompt)
+            release.wait(5)
+            return "a chair"
+
+    models = [_SlowModel([]) for _ in range(2)]
+    for model in models:
+        model._coalesce_callers = {"describe_object"}
+    outputs = []
+    threads = [
+        threading.Thread(target=lambda m=m: outputs.append(m.completion("same", caller=caller)))
+        for m in models
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert outputs == ["a chair", "a chair"]
+    assert len(calls) == (1 if coalesced else 2)
+
+
+def test_describe_object_prompts_of_two_agents_are_not_coalesced():
+    import os
+    import threading
+    import time
+
+    from generative_agents.modules.prompt.scratch import Scratch
+
+    release, calls = threading.Event(), []
+
+    class _SlowModel(_ScriptedLLMModel):
+        def _completion(self, prompt, **kwargs):
+            calls.append(prompt)
+            release.wait(5)
+            return "The <bed> is being slept in"
+
+    template_path = os.path.join(os.path.dirname(__file__), os.pardir, "generative_agents", "data", "prompts")
+    prompts = []
+    for name in ["Alice", "Bob", "Alice"]:
+        scratch = Scratch(name, "sleeping", {})
+        scratch.template_path = template_path
+        prompts.append(scratch.prompt_describe_object("bed", "sleeping")["prompt"])
+    # the prompt carries the agent name, so only the requests of one agent are identical
+    assert prompts[0] != prompts[1] and prompts[0] == prompts[2]
+
+    model = _SlowModel([])
+    model._coalesce_callers = {"describe_object"}
+    threads = [
+        threading.Thread(target=model.completion, args=(p,), kwargs={"caller": "describe_object"})
+        for p in prompts
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert sorted(calls) == sorted(prompts[:2])
+
+
+def test_completion_reuses_semantic_cache():
+    from generative_agents.modules.model.cache import set_response_cache
+
+    set_response_cache({"callers": ["determine_sector"]}, embed=lambda text: [len(text), 1.0])
+    try:
+        model = _ScriptedLLMModel(["kitchen", "garden"])
+        first = model.completion("go where at 08:00", callback=lambda r: r, caller="determine_sector")
+        second = model.completion("go where at 09:30", callback=lambda r: r, caller="determine_sector")
+        assert first == second == "kitchen"
+        assert model._responses == ["garden"]
+        # a cached response rejected by the callback falls back to the llm
+        third = model.completion(
+            "go where at 10:00",
+            callback=lambda r: r if r != "kitchen" else None,
+            caller="determine_sector",
+        )
+        assert third == "garden"
+    finally:
+        set_response_cache(None)
+
+
+def test_pool_health_check_runs_off_the_request_path(monkeypatch):
+    import generative_agents.modules.model.llm_model as llm_module
+    from generative_agents.modules.model import resilience
+
+    probed = []
+
+    class _Ok:
+        def raise_for_status(self):
+            pass
+
+    monkeypatch.setattr(
+        llm_module.requests, "get", lambda url, **kwargs: probed.append(url) or _Ok()
+    )
+    urls = ["http://pool-e", "http://pool-f"]
+    model, routed = _pool(monkeypatch, urls, sticky=False)
+    assert "pool" not in resilience._GUARDS
+    down = model.backends[0]._guard.breaker
+    for _ in range(down.failure_threshold):
+        down.record_failure()
+    model.completion("p")
+    assert routed == ["http://pool-f"] and probed == []
+
+    # only the endpoint with the open circuit is probed
+    checker = llm_module._HealthChecker()
+    checker._backends = {b._base_url: b for b in model.backends}
+    checker.check()
+    assert probed == ["http://pool-e/models"] and down.state == "closed"
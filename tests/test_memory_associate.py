@@ -37,6 +37,12 @@ class DummyIndex:
             self.nodes.pop(i, None)
     def find_node(self, nid):
         return self.nodes[nid]
+    def touch(self, node_ids):
+        access = datetime.now().strftime("%Y%m%d-%H:%M:%S")
+        touched = [self.nodes[nid] for nid in node_ids if nid in self.nodes]
+        for n in touched:
+            n.metadata["access"] = access
+        return touched
     def retrieve(self, text, similarity_top_k=5, filters=None, node_ids=None, retriever_creator=None):
         # Return nodes in node_ids order with increasing score
         res = []
@@ -0,0 +1,222 @@
+import pickle
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from generative_agents.modules.memory import associate as associate_module
+from generative_agents.modules.memory.associate import Associate, Concept
+from generative_agents.modules.memory.event import Event
+
+from tests.test_memory_associate import DummyIndex
+
+
+def _concept(**kwargs):
+    config = {
+        "describe": "Alice is reading",
+        "node_id": "node_1",
+        "node_type": "event",
+        "subject": "Alice",
+        "predicate": "is",
+        "object": "reading",
+        "address": "w:s:a:o",
+        "poignancy": 3,
+        "create": "20240101-08:00:00",
+    }
+    config.update(kwargs)
+    return Concept(**config)
+
+
+def test_concept_timestamps_and_immutability():
+    concept = _concept(access="20240102-09:30:00")
+    assert concept.create == datetime(2024, 1, 1, 8)
+    assert concept.expire == datetime(2024, 1, 31, 8)
+    assert concept.access == datetime(2024, 1, 2, 9, 30)
+    assert concept.event.address == ["w", "s", "a", "o"]
+    with pytest.raises(AttributeError):
+        concept.poignancy = 5
+    assert not hasattr(concept, "__dict__")
+    copied = pickle.loads(pickle.dumps(concept))
+    assert copied.access == concept.access and copied.describe == concept.describe
+
+
+def test_event_strings_are_interned():
+    e1 = Event("".join(["Ali", "ce"]), "is", "".join(["read", "ing"]), address=["w", "".join(["ho", "me"])])
+    e2 = Event("Alice", "is", "reading", address=["w", "home"])
+    assert e1.subject is e2.subject and e1.object is e2.object
+    assert e1.address[1] is e2.address[1]
+    assert not hasattr(e1, "__dict__")
+
+
+def test_associate_caches_concepts_until_access_changes(monkeypatch):
+    index = DummyIndex()
+    monkeypatch.setattr(associate_module, "LlamaIndex", lambda *args, **kwargs: index)
+    assoc = Associate(path=None, embedding={}, retention=5)
+    created = assoc.add_node(
+        "event", Event("Alice", "is", "reading"), 3, create=datetime.now() - timedelta(days=1)
+    )
+    node_id = created.node_id
+    assert assoc.find_concept(node_id) is created
+    index.nodes[node_id].metadata["access"] = datetime.now().strftime("%Y%m%d-%H:%M:%S")
+    refreshed = assoc.find_concept(node_id)
+    assert refreshed is not created and refreshed.access > created.access
+    assert assoc.find_concept(node_id) is refreshed
+
+
+class BatchIndex(DummyIndex):
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def add_nodes(self, batch):
+        self.batches.append(len(batch))
+        return [self.add_node(text, metadata) for text, metadata in batch]
+
+
+def test_associate_add_nodes_keeps_sequential_order(monkeypatch):
+    index = BatchIndex()
+    monkeypatch.setattr(associate_module, "LlamaIndex", lambda *args, **kwargs: index)
+    assoc = Associate(path=None, embedding={}, retention=5)
+    concepts = assoc.add_nodes(
+        [
+            {"node_type": "event", "event": Event("Alice", "is", "reading"), "poignancy": 2},
+            {"node_type": "chat", "event": Event("Alice", "chat", "Bob"), "poignancy": 4},
+            {"node_type": "event", "event": Event("Bob", "is", "cooking"), "poignancy": 3},
+        ]
+    )
+    assert index.batches == [3]
+    assert [c.poignancy for c in concepts] == [2, 4, 3]
+    assert assoc.memory["event"] == [concepts[2].node_id, concepts[0].node_id]
+    assert assoc.memory["chat"] == [concepts[1].node_id]
+
+
+class CountingIndex(DummyIndex):
+    def __init__(self):
+        super().__init__()
+        self.retrieved = []
+
+    def retrieve(self, text, **kwargs):
+        self.retrieved.append(text)
+        return super().retrieve(text, **kwargs)
+
+
+def test_associate_memoizes_retrievals_until_memory_changes(monkeypatch):
+    index = CountingIndex()
+    monkeypatch.setattr(associate_module, "LlamaIndex", lambda *args, **kwargs: index)
+    assoc = Associate(path=None, embedding={}, retention=5)
+    reading = assoc.add_node("event", Event("Alice", "is", "reading"), 3)
+    assoc.add_node("chat", Event("Alice", "chat", "Bob"), 2)
+
+    relation = assoc.get_relation(reading)
+    assert assoc.get_relation(reading) == relation
+    assert assoc.retrieve_chats("Bob") == assoc.retrieve_chats("Bob")
+    assert index.retrieved == ["Alice is reading", "Conversation Bob"]
+    version = assoc.version
+    events = assoc.retrieve_events()
+    events.append(None)
+    assert assoc.retrieve_events() == [reading]
+
+    cooking = assoc.add_node("event", Event("Bob", "is", "cooking"), 4)
+    assert assoc.version > version
+    assert assoc.retrieve_events() == [cooking, reading]
+    assert [c.node_id for c in assoc.get_relation(reading)["events"]] == [
+        cooking.node_id,
+        reading.node_id,
+    ]
+    assert index.retrieved.count("Alice is reading") == 2
+
+    # retrieve_focus updates the access of the nodes
+    assoc.retrieve_focus(["reading"])
+    assoc.retrieve_chats("Bob")
+    assert index.retrieved.count("Conversation Bob") == 2
+
+
+def test_associate_memo_skips_retrievals_overlapping_a_change(monkeypatch):
+    index = CountingIndex()
+    monkeypatch.setattr(associate_module, "LlamaIndex", lambda *args, **kwargs: index)
+    assoc = Associate(path=None, embedding={}, retention=5)
+    reading = assoc.add_node("event", Event("Alice", "is", "reading"), 3)
+    retrieve = index.retrieve
+    added = []
+
+    def _retrieve_while_remembering(text, **kwargs):
+        nodes = retrieve(text, **kwargs)
+        # another thread remembers an event after the nodes are read
+        if not added:
+            added.append(assoc.add_node("event", Event("Bob", "is", "cooking"), 4))
+        return nodes
+
+    index.retrieve = _retrieve_while_remembering
+    assert assoc.retrieve_events("reading") == [reading]
+    assert assoc.retrieve_events("reading") == [added[0], reading]
+    assert index.retrieved.count("reading") == 2
+
+
+def test_retrieve_focus_touches_retrieved_nodes_once(monkeypatch):
+    index = CountingIndex()
+    touched = []
+    touch = index.touch
+    index.touch = lambda node_ids: touched.append(list(node_ids)) or touch(node_ids)
+    monkeypatch.setattr(associate_module, "LlamaIndex", lambda *args, **kwargs: index)
+    assoc = Associate(path=None, embedding={}, retention=5)
+    old = datetime.now() - timedelta(days=1)
+    reading = assoc.add_node("event", Event("Alice", "is", "reading"), 3, create=old)
+    assoc.add_node("thought", Event("Alice", "likes", "books"), 5, create=old)
+
+    version = assoc.version
+    concepts = assoc.retrieve_focus(["reading", "books"])
+    assert len(touched) == 1 and sorted(touched[0]) == sorted(index.nodes)
+    assert all(c.access > reading.access for c in concepts)
+    assert assoc.find_concept(reading.node_id).access > reading.access
+    assert assoc.version > version
+
+
+def test_retrieve_focus_without_touch_leaves_memory_unchanged(monkeypatch):
+    index = CountingIndex()
+    touched = []
+    index.touch = lambda node_ids: touched.append(list(node_ids)) or []
+    monkeypatch.setattr(associate_module, "LlamaIndex", lambda *args, **kwargs: index)
+    assoc = Associate(path=None, embedding={}, retention=5)
+    reading = assoc.add_node("event", Event("Alice", "is", "reading"), 3)
+    assoc.retrieve_events()
+
+    version = assoc.version
+    concepts = assoc.retrieve_focus(["reading"], touch=False)
+    assert [c.node_id for c in concepts] == [reading.node_id]
+    assert assoc.retrieve_focus(["reading"], reduce_all=False, touch=False)["reading"] == concepts
+    assert not touched and assoc.version == version
+    assert assoc.retrieve_events() == [reading]
+
+
+def test_associate_reads_wait_for_writes(monkeypatch):
+    index = CountingIndex()
+    monkeypatch.setattr(associate_module, "LlamaIndex", lambda *args, **kwargs: index)
+    assoc = Associate(path=None, embedding={}, retention=5)
+    reading = assoc.add_node("event", Event("Alice", "is", "reading"), 3)
+    retrieve, entered, release = index.retrieve, threading.Event(), threading.Event()
+
+    def _slow_retrieve(text, **kwargs):
+        entered.set()
+        release.wait(timeout=5)
+        return retrieve(text, **kwargs)
+
+    index.retrieve = _slow_retrieve
+    found = []
+    # a completion served for another shard reads while the agent thinks
+    reader = threading.Thread(
+        target=lambda: found.extend(assoc.retrieve_focus(["reading"], 3, touch=False))
+    )
+    reader.start()
+    assert entered.wait(timeout=5)
+    writer = threading.Thread(
+        target=assoc.add_node, args=("event", Event("Bob", "is", "cooking"), 4)
+    )
+    writer.start()
+    writer.join(timeout=0.2)
+    assert writer.is_alive() and len(assoc.memory["event"]) == 1
+    release.set()
+    reader.join(timeout=5)
+    writer.join(timeout=5)
+    assert [c.node_id for c in found] == [reading.node_id]
+    assert len(assoc.memory["event"]) == 2
+    assert "retrieve_max" not in assoc._retrieve_config
@@ -45,3 +45,47 @@ def test_schedule_scheduled_flag():
     s.add_plan("x", 10)
     # The scheduled flag depends on locale formatting; ensure method runs
     assert isinstance(s.scheduled(), bool)
+
+
+def _linear_current_plan(s):
+    from generative_agents.modules.utils.timer import get_timer
+
+    total_minute = get_timer().daily_duration()
+    for plan in s.daily_schedule:
+        if s.plan_stamps(plan)[1] <= total_minute:
+            continue
+        for de_plan in plan.get("decompose", []):
+            if s.plan_stamps(de_plan)[1] <= total_minute:
+                continue
+            return plan, de_plan
+        return plan, plan
+    return s.daily_schedule[-1], s.daily_schedule[-1]
+
+
+def test_schedule_bisect_matches_linear_scan():
+    s = Schedule()
+    s.add_plan("sleeping", 360)
+    work = s.add_plan("work", 180)
+    s.set_decompose(
+        work,
+        [
+            {"idx": 0, "describe": "mail", "start": 360, "duration": 30},
+            {"idx": 1, "describe": "meeting", "start": 390, "duration": 90},
+        ],
+    )
+    s.add_plan("lunch", 60)
+    for minute in range(0, 24 * 60, 5):
+        set_timer("20240101-{:02d}:{:02d}".format(minute // 60, minute % 60))
+        assert s.current_plan() == _linear_current_plan(s)
+
+    set_timer("20240101-06:40")
+    assert s.current_plan()[1]["describe"] == "meeting"
+    assert s.next_boundary() == 480
+    # revising the decompose replaces the index of the plan
+    s.set_decompose(work, [{"idx": 0, "describe": "call", "start": 360, "duration": 180}])
+    assert s.current_plan()[1]["describe"] == "call"
+    assert s.next_boundary() == 540
+    # plans added later are indexed too
+    s.add_plan("nap", 60)
+    set_timer("20240101-10:30")
+    assert s.current_plan()[0]["describe"] == "nap"
@@ -0,0 +1,39 @@
+from generative_agents.modules.model import cache as cache_module
+from generative_agents.modules.model.cache import SemanticCache, normalize_prompt
+
+
+def _bag_of_words(text):
+    vocab = ["chair", "table", "bed", "empty", "used", "alice", "bob", "<time>"]
+    return [text.count(w) for w in vocab] + [0.01]
+
+
+def test_normalize_prompt_masks_date_and_time():
+    a = normalize_prompt("Today is 2024年01月01日（星期一）.  At 08:15 the chair is EMPTY")
+    b = normalize_prompt("Today is 2024年01月02日（星期二）. At 09:40 the chair is empty")
+    assert a == b == "today is <date>. at <time> the chair is empty"
+
+
+def test_semantic_cache_hits_similar_prompt_of_same_caller():
+    cache = SemanticCache(["describe_object"], threshold=0.8, embed=_bag_of_words)
+    assert cache.lookup("describe_object", "m", "the chair is empty") == (None, None)
+    cache.store("describe_object", "m", "the chair is empty", "idle")
+    # exact match after normalization, no embedding needed
+    response, vector = cache.lookup("describe_object", "m", "The chair  is empty")
+    assert response == "idle" and vector is None
+    assert cache.lookup("describe_object", "m", "alice: the chair is empty")[0] == "idle"
+    assert cache.lookup("describe_object", "m", "the bed is used")[0] is None
+    assert cache.lookup("describe_object", "other", "the chair is empty")[0] is None
+    assert not cache.enabled("generate_chat")
+
+
+def test_semantic_cache_ttl_and_lru(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    cache = SemanticCache(["c"], ttl=60, max_entries=2, embed=_bag_of_words)
+    for text in ["chair", "table", "bed"]:
+        cache.store("c", "m", text, text.upper())
+    assert len(cache) == 2
+    assert cache.lookup("c", "m", "chair")[0] is None
+    assert cache.lookup("c", "m", "bed")[0] == "BED"
+    now[0] += 61
+    assert cache.lookup("c", "m", "bed")[0] is None and len(cache) == 0
@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+from generative_agents.modules.model import resilience
+from generative_agents.modules.model.resilience import (
+    AdaptiveLimiter,
+    CircuitBreaker,
+    EndpointGuard,
+    get_endpoint_guard,
+)
+
+
+def test_circuit_breaker_opens_and_recovers(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "time", lambda: now[0])
+    breaker = CircuitBreaker("e", failure_threshold=2, recovery_timeout=30)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] += 31
+    assert breaker.state == "half_open"
+    # only a single probe goes through while half open
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] += 31
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_adaptive_limiter_aimd():
+    limiter = AdaptiveLimiter("e", initial=4, minimum=1, maximum=5, latency_tolerance=2.0)
+    for _ in range(20):
+        assert limiter.acquire(timeout=0)
+        limiter.release(latency=1.0)
+    assert limiter.limit == 5
+
+    assert limiter.acquire(timeout=0)
+    limiter.release(latency=10.0)
+    assert limiter.limit == 2
+    assert limiter.acquire(timeout=0)
+    limiter.release(error=True)
+    assert limiter.limit == 1
+
+
+def test_adaptive_limiter_compares_latency_per_caller():
+    limiter = AdaptiveLimiter("e", initial=4, minimum=1, maximum=8, latency_tolerance=2.0)
+    # short scoring prompts and long generations share the endpoint
+    for _ in range(20):
+        for key, latency in (("poignancy_event", 0.5), ("generate_chat", 6.0)):
+            assert limiter.acquire(timeout=0)
+            limiter.release(latency=latency, key=key)
+    assert limiter.limit == 8
+
+    assert limiter.acquire(timeout=0)
+    limiter.release(latency=6.0, key="poignancy_event")
+    assert limiter.limit == 4
+
+
+def test_adaptive_limiter_blocks_above_limit():
+    limiter = AdaptiveLimiter("e", initial=1)
+    assert limiter.acquire(timeout=0)
+    assert not limiter.acquire(timeout=0.01)
+    released = threading.Timer(0.05, limiter.release, kwargs={"latency": 0.1})
+    released.start()
+    assert limiter.acquire(timeout=2)
+    limiter.release()
+    assert limiter.inflight == 0
+
+
+def test_endpoint_guard_records_outcome():
+    guard = EndpointGuard("e", {"failure_threshold": 1})
+    with guard.request():
+        pass
+    assert guard.breaker.state == "closed"
+    with pytest.raises(RuntimeError):
+        with guard.request():
+            raise RuntimeError("down")
+    assert guard.breaker.state == "open"
+    assert guard.limiter.inflight == 0
+
+
+def test_endpoint_guard_shared_per_endpoint():
+    assert get_endpoint_guard("http://shared") is get_endpoint_guard("http://shared")
+    assert get_endpoint_guard("http://shared") is not get_endpoint_guard("http://other")
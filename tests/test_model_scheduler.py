@@ -0,0 +1,71 @@
+import threading
+import time
+
+from generative_agents.modules.model.scheduler import (
+    LLMScheduler,
+    get_scheduler,
+    schedule,
+    set_scheduler,
+)
+
+
+def _run_queued(scheduler, requests):
+    """Queue the requests behind a held slot, return the order they are served"""
+
+    served, threads = [], []
+    scheduler.acquire("generate_chat", "holder")
+    for caller, agent in requests:
+
+        def _request(caller=caller, agent=agent):
+            with scheduler.slot(caller, agent):
+                served.append((caller, agent))
+
+        thread = threading.Thread(target=_request)
+        depth = scheduler.queue_depth()
+        thread.start()
+        while scheduler.queue_depth() == depth:
+            time.sleep(0.001)
+        threads.append(thread)
+    scheduler.release()
+    for thread in threads:
+        thread.join(timeout=5)
+    return served
+
+
+def test_scheduler_serves_higher_priority_first():
+    scheduler = LLMScheduler(max_concurrency=1)
+    served = _run_queued(
+        scheduler,
+        [("reflect_insights", "A"), ("schedule_daily", "B"), ("generate_chat", "C")],
+    )
+    assert [c for c, _ in served] == ["generate_chat", "schedule_daily", "reflect_insights"]
+    assert scheduler.inflight == 0 and scheduler.queue_depth() == 0
+
+
+def test_scheduler_is_fair_across_agents():
+    scheduler = LLMScheduler(max_concurrency=1)
+    served = _run_queued(
+        scheduler,
+        [("poignancy_event", "A")] * 3 + [("poignancy_event", "B")],
+    )
+    assert [a for _, a in served] == ["A", "B", "A", "A"]
+
+
+def test_scheduler_priorities_configurable():
+    scheduler = LLMScheduler(priorities={"summarize_chats": "interactive", "x": "unknown"})
+    assert scheduler.priority_of("summarize_chats") == "interactive"
+    assert scheduler.priority_of("x") == "planning"
+    assert scheduler.priority_of("describe_object") == "planning"
+
+
+def test_schedule_is_noop_without_scheduler():
+    set_scheduler(None)
+    with schedule("generate_chat"):
+        assert get_scheduler() is None
+    scheduler = set_scheduler({"max_concurrency": 2})
+    try:
+        with schedule("generate_chat", "A"):
+            assert scheduler.inflight == 1
+        assert scheduler.inflight == 0
+    finally:
+        set_scheduler(None)
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from generative_agents.modules.model.singleflight import SingleFlight
+
+
+def _concurrently(flight, key, func, n):
+    results, errors = [], []
+
+    def _call():
+        try:
+            results.append(flight.do(key, func))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_call) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_single_flight_shares_one_call():
+    flight, release, calls = SingleFlight(), threading.Event(), []
+
+    def _func():
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    threads, results, _ = _concurrently(flight, "k", _func, 3)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert sorted(results) == [("answer", False), ("answer", True), ("answer", True)]
+    assert flight.inflight() == 0
+    # a later call of the same key is a new flight
+    assert flight.do("k", lambda: "again") == ("again", False)
+
+
+def test_single_flight_raises_to_every_caller():
+    flight, release = SingleFlight(), threading.Event()
+
+    def _func():
+        release.wait(5)
+        raise RuntimeError("down")
+
+    threads, results, errors = _concurrently(flight, "k", _func, 2)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert not results and len(errors) == 2
+    with pytest.raises(ValueError):
+        flight.do("k", lambda: int("x"))
@@ -0,0 +1,56 @@
+import pytest
+
+from generative_agents.modules.model import structured
+
+
+SCORE = structured.object_schema(score=structured.integer_schema(1, 10))
+
+
+def test_loads_valid_json_is_not_repaired():
+    data, repaired = structured.loads('{"score": 7}', SCORE)
+    assert data == {"score": 7} and not repaired
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '<think>hmm</think>```json\n{"score": 7,}\n```',
+        "Score: 7",
+        "{'Score': '7'}",
+        "7",
+    ],
+)
+def test_loads_repairs_malformed_output(text):
+    data, repaired = structured.loads(text, SCORE)
+    assert data == {"score": 7} and repaired
+
+
+def test_loads_clamps_and_matches_enum():
+    data, _ = structured.loads('{"score": 42}', SCORE)
+    assert data["score"] == 10
+    schema = structured.object_schema(option=structured.string_schema(enum=["A", "B"]))
+    data, _ = structured.loads("答案：<选项A>", schema)
+    assert data == {"option": "A"}
+    data, _ = structured.loads('{"answer": "No"}', structured.object_schema(answer=structured.boolean_schema()))
+    assert data == {"answer": False}
+
+
+def test_loads_rejects_unrecoverable_output():
+    schema = structured.object_schema(
+        plans=structured.array_schema(structured.string_schema(), min_items=2)
+    )
+    with pytest.raises(structured.SchemaError):
+        structured.loads('{"plans": ["only one"]}', schema)
+    with pytest.raises(structured.SchemaError):
+        structured.loads("no number here", SCORE)
+
+
+def test_validate_nested_paths():
+    schema = structured.object_schema(
+        schedule=structured.array_schema(
+            structured.object_schema(time=structured.string_schema(pattern=r"^\d{1,2}:\d{2}$"))
+        )
+    )
+    structured.validate({"schedule": [{"time": "7:00"}]}, schema)
+    with pytest.raises(structured.SchemaError, match=r"\$\.schedule\[0\]\.time"):
+        structured.validate({"schedule": [{"time": "seven"}]}, schema)
@@ -70,3 +70,74 @@ def test_prompt_schedule_revise_callback(monkeypatch):
     resp = """[08:00 - 08:15] read\n[08:15 ~ 08:25] coding\n[08:25 至 09:00] plan"""
     out = cfg["callback"](resp)
     assert len(out) == 3 and out[1]["describe"].endswith("coding")
+
+
+def test_prompt_structured_callbacks(monkeypatch):
+    from generative_agents.modules.model import structured
+
+    s = make_scratch(monkeypatch)
+    cfg = s.prompt_wake_up()
+    data, _ = structured.loads('{"hour": 13}', cfg["structured"]["schema"])
+    assert cfg["structured"]["callback"](data) == 11
+
+    schedule = Schedule()
+    plan = schedule.add_plan("do work", 30)
+    cfg = s.prompt_schedule_decompose(plan, schedule)
+    data, _ = structured.loads(
+        '{"subtasks": [{"activity": "Writing code", "duration": 10}]}',
+        cfg["structured"]["schema"],
+    )
+    assert cfg["structured"]["callback"](data) == [("Writing code", 10), ("do work", 20)]
+
+    cfg = s.prompt_schedule_daily(6, ["A", "B"])
+    rows = ", ".join(
+        '{"time": "%d:00", "activity": "Alice act%d"}' % (h, h) for h in range(6, 11)
+    )
+    data, _ = structured.loads('{"schedule": [%s]}' % rows, cfg["structured"]["schema"])
+    assert cfg["structured"]["callback"](data)["6:00"] == " act6"
+
+
+def test_prompt_layout_stable_first():
+    import os
+
+    set_timer("20240101-08:00")
+    config = {
+        "age": 25,
+        "innate": "curious",
+        "learned": "CS",
+        "lifestyle": "early bird",
+        "daily_plan": "study, exercise",
+    }
+    template_path = os.path.join(os.path.dirname(__file__), "..", "generative_agents", "data", "prompts")
+    shared = {}
+    for layout in ["default", "stable_first"]:
+        s = Scratch(name="Alice", currently="Reading a book", config=config, layout=layout)
+        s.template_path = template_path
+        first = s.prompt_poignancy_event(Event("Alice", "is", "reading", describe="Alice is reading"))
+        s.currently = "Writing code"
+        second = s.prompt_poignancy_event(Event("Alice", "is", "writing", describe="Alice is writing"))
+        shared[layout] = len(os.path.commonprefix([first["prompt"], second["prompt"]]))
+        prompt = second["prompt"]
+
+    # the scoring rules stay in the shared prefix although currently changed
+    assert shared["stable_first"] > shared["default"] + 100
+    assert prompt.startswith("name: Alice")
+    assert prompt.index("daily_plan") < prompt.index("Score: 10") < prompt.index("Writing code")
+    assert prompt.index("Writing code") < prompt.index("Alice is writing")
+
+
+def test_prompt_early_stop_predicates(monkeypatch):
+    s = make_scratch(monkeypatch)
+    poignancy = s.prompt_poignancy_event(Event("Alice", "is", "reading", describe="reading"))
+    assert not poignancy["early_stop"]("1")
+    assert poignancy["early_stop"]("10\n")
+    wake_up = s.prompt_wake_up()
+    assert not wake_up["early_stop"]("7:")
+    assert wake_up["early_stop"]("7:00")
+    agent = types.SimpleNamespace(name="Alice")
+    repeat = s.prompt_generate_chat_check_repeat(agent, [], "hi")
+    assert not repeat["early_stop"]("")
+    assert repeat["early_stop"]("No")
+    assert not repeat["early_stop"]("not sure, I know")
+    assert repeat["early_stop"]("not sure, yes.")
+    assert repeat["callback"]("No") is False
@@ -0,0 +1,255 @@
+import threading
+from multiprocessing import Pipe
+from multiprocessing.connection import Client, Listener
+
+from generative_agents.modules import memory
+from modules.agent import Agent, collect_accesses, touch_accesses
+from generative_agents.modules.maze import Maze
+from generative_agents.modules.memory.event import Event
+from generative_agents.modules.shard import ShardedGame, parse_address
+from generative_agents.modules.shard.master import accept_shards, shard_specs
+from generative_agents.modules.shard.worker import ShardWorker
+from generative_agents.modules.utils.log import create_io_logger
+from generative_agents.modules.utils.timer import set_timer
+
+
+def _maze():
+    cfg = {
+        "size": [1, 2],
+        "tile_size": 10,
+        "tile_address_keys": ["world", "sector", "arena", "game_object"],
+        "world": "w",
+        "tiles": [
+            {"coord": [0, 0], "address": ["s", "a", "bed"]},
+            {"coord": [1, 0], "address": ["s", "a", "desk"]},
+        ],
+    }
+    return Maze(cfg, create_io_logger("info"))
+
+
+def _has(maze, coord, event):
+    return event.to_dict() in maze.events_state().get(coord, [])
+
+
+class FakeAgent(Agent):
+    # the agents passed to other shards are sent by name
+    def __init__(self, name, coord, maze):
+        self.name, self.coord, self.path, self.maze = name, coord, [], maze
+        self.action = memory.Action(Event(name, "is", "idle"))
+        self.schedule = memory.Schedule()
+        self.chats = []
+
+    def completion(self, func_hint, *args):
+        return "{}:{}:{}".format(self.name, func_hint, args[0].name)
+
+    def schedule_chat(self, chats, chats_summary, start, duration, other, address=None):
+        self.chats.append((chats_summary, other.name))
+
+    def think(self, status, agents):
+        self.maze.tile_at(self.coord).add_event(Event(self.name, "is", "awake"))
+        other = agents["bob" if self.name == "alice" else "alice"]
+        plan = {"reply": other.completion("greet", self), "other_coord": list(other.coord)}
+        if self.name == "alice":
+            other.schedule_chat([], "chat with alice", "20240101-08:00", 10, self)
+        return plan
+
+    def to_dict(self):
+        return {"chats": list(self.chats)}
+
+
+class FakeScratch:
+    def __init__(self, agent):
+        self.agent = agent
+
+    def prompt_greet(self, other):
+        # the call of the other shard is served while the agent thinks
+        self.agent.thinking.wait(timeout=5)
+        self.agent.served.set()
+        return {
+            "prompt": "greet",
+            "failsafe": "{}:greet:{}".format(self.agent.name, other.name),
+            "accessed": ["memory of " + other.name],
+        }
+
+
+class FakeAssociate:
+    def __init__(self, agent):
+        self.agent, self.touched = agent, []
+
+    def touch(self, node_ids):
+        self.touched.append((list(node_ids), self.agent.thinking.is_set()))
+
+
+class MemoryAgent(FakeAgent):
+    """Complete with Agent.completion, which touches the memory retrieved for the prompt"""
+
+    completion = Agent.completion
+
+    def __init__(self, name, coord, maze):
+        super().__init__(name, coord, maze)
+        self.scratch, self.associate = FakeScratch(self), FakeAssociate(self)
+        self._llm, self.logger = None, create_io_logger("info")
+        self.thinking, self.served = threading.Event(), threading.Event()
+
+    def think(self, status, agents):
+        self.thinking.set()
+        other = agents["bob" if self.name == "alice" else "alice"]
+        plan = {"reply": other.completion("greet", self)}
+        self.served.wait(timeout=5)
+        self.thinking.clear()
+        return plan
+
+
+class SpeculativeAgent(MemoryAgent):
+    """Greet speculatively, alice uses the reply and bob throws it away"""
+
+    def think(self, status, agents):
+        self.thinking.set()
+        other = agents["bob" if self.name == "alice" else "alice"]
+        with collect_accesses() as accesses:
+            call = other.completion_async("greet", self)
+        plan = {"reply": call.result(), "accessed": [(a.name, n) for a, n in accesses]}
+        if self.name == "alice":
+            touch_accesses(accesses)
+        self.served.wait(timeout=5)
+        self.thinking.clear()
+        return plan
+
+
+class FakeGame:
+    def __init__(self, names, agent_class=FakeAgent):
+        self.maze, self.conversation = _maze(), {}
+        coords = {"alice": (0, 0), "bob": (1, 0)}
+        self.agents = {n: agent_class(n, coords[n], self.maze) for n in names}
+        self.remote_agents = {}
+
+    def get_agent(self, name):
+        return self.agents[name]
+
+    def agent_think(self, name, status):
+        return {"plan": self.agents[name].think(status, dict(self.agents, **self.remote_agents))}
+
+
+def test_sharded_game_routes_calls_and_tile_events():
+    set_timer("20240101-08:00")
+    games, conns, threads = [FakeGame(["alice"]), FakeGame(["bob"])], [], []
+    for game in games:
+        parent, child = Pipe()
+        worker = ShardWorker(child, game, baseline=_maze().events_state())
+        threads.append(threading.Thread(target=worker.serve, daemon=True))
+        threads[-1].start()
+        conns.append(parent)
+    sharded = ShardedGame(_maze(), {}, conns)
+    assert sharded.agent_names == ["alice", "bob"] and sharded.shard_of("bob") == 1
+
+    statuses = {"alice": {"coord": [0, 0]}, "bob": {"coord": [1, 0]}}
+    results = sharded.step(statuses)
+    assert results["alice"]["plan"]["reply"] == "bob:greet:alice"
+    assert results["bob"]["plan"]["reply"] == "alice:greet:bob"
+    assert results["alice"]["plan"]["other_coord"] == [1, 0]
+    # the chat is scheduled on the owner shard of bob, and checkpointed
+    assert games[1].agents["bob"].chats == [("chat with alice", "alice")]
+    assert results["bob"]["checkpoint"]["chats"] == [("chat with alice", "alice")]
+
+    # the master maze has the events of both shards, the shards get them on the next step
+    assert _has(sharded.maze, (1, 0), Event("bob", "is", "awake"))
+    assert not _has(games[0].maze, (1, 0), Event("bob", "is", "awake"))
+    sharded.step(statuses)
+    assert _has(games[0].maze, (1, 0), Event("bob", "is", "awake"))
+    assert _has(games[1].maze, (0, 0), Event("alice", "is", "awake"))
+
+    sharded.close()
+    for thread in threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+
+
+def test_served_completion_touches_memory_after_think():
+    set_timer("20240101-08:00")
+    games, conns, threads = [FakeGame(["alice"], MemoryAgent), FakeGame(["bob"], MemoryAgent)], [], []
+    for game in games:
+        parent, child = Pipe()
+        threads.append(threading.Thread(target=ShardWorker(child, game).serve, daemon=True))
+        threads[-1].start()
+        conns.append(parent)
+    sharded = ShardedGame(_maze(), {}, conns)
+
+    results = sharded.step({"alice": {"coord": [0, 0]}, "bob": {"coord": [1, 0]}})
+    assert results["alice"]["plan"]["reply"] == "bob:greet:alice"
+    assert results["bob"]["plan"]["reply"] == "alice:greet:bob"
+    # the calls are served during the think of both agents, the touch waits for the think
+    assert games[0].agents["alice"].associate.touched == [(["memory of bob"], False)]
+    assert games[1].agents["bob"].associate.touched == [(["memory of alice"], False)]
+
+    sharded.close()
+    for thread in threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+
+
+def test_speculative_remote_completion_touches_memory_once_used():
+    set_timer("20240101-08:00")
+    games = [FakeGame(["alice"], SpeculativeAgent), FakeGame(["bob"], SpeculativeAgent)]
+    conns, threads = [], []
+    for game in games:
+        parent, child = Pipe()
+        threads.append(threading.Thread(target=ShardWorker(child, game).serve, daemon=True))
+        threads[-1].start()
+        conns.append(parent)
+    sharded = ShardedGame(_maze(), {}, conns)
+
+    results = sharded.step({"alice": {"coord": [0, 0]}, "bob": {"coord": [1, 0]}})
+    assert results["alice"]["plan"]["reply"] == "bob:greet:alice"
+    # the accessed nodes come back with the reply, the owner leaves them untouched
+    assert results["alice"]["plan"]["accessed"] == [("bob", ["memory of alice"])]
+    assert results["bob"]["plan"]["accessed"] == [("alice", ["memory of bob"])]
+    # alice uses the reply of bob, bob throws away the reply of alice
+    assert games[1].agents["bob"].associate.touched == [(["memory of alice"], False)]
+    assert games[0].agents["alice"].associate.touched == []
+
+    sharded.close()
+    for thread in threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+
+
+def test_maze_events_diff_round_trip():
+    source, target = _maze(), _maze()
+    before = source.events_state()
+    source.tile_at((0, 0)).add_event(Event("alice", "is", "asleep"))
+    source.tile_at((1, 0)).remove_events(subject="desk")
+    diff = Maze.events_diff(before, source.events_state())
+    assert set(diff) == {(0, 0), (1, 0)}
+
+    target.apply_events_diff(diff)
+    assert target.events_state() == source.events_state()
+    assert Maze.events_diff(source.events_state(), target.events_state()) == {}
+
+
+def test_sharded_game_over_tcp_assigns_agents_to_workers():
+    set_timer("20240101-08:00")
+    config = {"agents": {"alice": {}, "bob": {}}}
+    specs = shard_specs("sim", "static", config, shards=3)
+    assert [list(s["config"]["agents"]) for s in specs] == [["alice"], ["bob"]]
+
+    authkey, games, threads = b"test", [], []
+
+    def _worker(address):
+        conn = Client(address, authkey=authkey)
+        game = FakeGame(list(conn.recv()["config"]["agents"]))
+        games.append(game)
+        ShardWorker(conn, game).serve()
+
+    with Listener(parse_address("127.0.0.1:0"), authkey=authkey) as listener:
+        for _ in specs:
+            threads.append(threading.Thread(target=_worker, args=(listener.address,), daemon=True))
+            threads[-1].start()
+        conns = accept_shards(listener, specs)
+    sharded = ShardedGame(_maze(), {}, conns)
+    results = sharded.step({"alice": {"coord": [0, 0]}, "bob": {"coord": [1, 0]}})
+    assert results["alice"]["plan"]["reply"] == "bob:greet:alice"
+    assert results["bob"]["checkpoint"]["chats"] == [("chat with alice", "alice")]
+    sharded.close()
+    for thread in threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
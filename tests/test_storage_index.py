@@ -16,6 +16,10 @@ class FakeTextNode:
 class FakeDocStore:
     def __init__(self):
         self.docs = {}
+    def document_exists(self, doc_id):
+        return doc_id in self.docs
+    def get_node(self, node_id, raise_error=True):
+        return self.docs[node_id] if raise_error else self.docs.get(node_id)
 
 
 class FakeStorageContext:
@@ -121,3 +125,163 @@ def test_retrieve_and_query_paths(monkeypatch):
             return types.SimpleNamespace(response="ok")
     out2 = li.query("x", query_creator=lambda **kw: DummyQE(**kw))
     assert out2.response == "ok"
+
+
+def test_cleanup_pops_only_due_nodes():
+    from modules.utils.timer import set_timer
+
+    set_timer("20240601-00:00")
+    li = make_li_instance()
+    keep = li.add_node("keep", metadata={"create": "20240101-00:00:00", "expire": "20250101-00:00:00"})
+    old = li.add_node("old", metadata={"create": "20230101-00:00:00", "expire": "20240101-00:00:00"})
+    future = li.add_node("future", metadata={"create": "20240701-00:00:00", "expire": "20250101-00:00:00"})
+    assert sorted(li.cleanup()) == sorted([old.id_, future.id_])
+    assert li.has_node(keep.id_) and li.nodes_num == 1
+
+    # nodes added after the queues are built are tracked on insert
+    late = li.add_node("late", metadata={"create": "20240101-00:00:00", "expire": "20240301-00:00:00"})
+    li.remove_nodes([keep.id_])
+    assert li.cleanup() == [late.id_]
+    assert li.cleanup() == [] and li.nodes_num == 0
+
+
+class CountingDocStore(FakeDocStore):
+    def __init__(self):
+        self._docs, self.scans = {}, 0
+    @property
+    def docs(self):
+        self.scans += 1
+        return self._docs
+    def document_exists(self, doc_id):
+        return doc_id in self._docs
+    def get_node(self, node_id, raise_error=True):
+        return self._docs[node_id] if raise_error else self._docs.get(node_id)
+
+
+def test_cleanup_and_nodes_num_skip_docstore_scan():
+    from modules.utils.timer import set_timer
+
+    set_timer("20240601-00:00")
+    li = make_li_instance()
+    li._index.docstore = CountingDocStore()
+    li._index.insert_nodes = lambda nodes: li._index.docstore._docs.update({n.id_: n for n in nodes})
+    li._index.delete_nodes = lambda node_ids, **kw: [li._index.docstore._docs.pop(n, None) for n in node_ids]
+    keep = li.add_node("keep", metadata={"create": "20240101-00:00:00", "expire": "20250101-00:00:00"})
+    assert li.cleanup() == [] and li.nodes_num == 1
+
+    scans = li._index.docstore.scans
+    old = li.add_node("old", metadata={"create": "20230101-00:00:00", "expire": "20240101-00:00:00"})
+    assert li.nodes_num == 2
+    assert li.cleanup() == [old.id_]
+    li.remove_nodes([keep.id_, "missing"])
+    assert li.cleanup() == [] and li.nodes_num == 0
+    assert li._index.docstore.scans == scans
+
+
+def test_add_nodes_inserts_batch_and_reports_failed_items():
+    li = make_li_instance()
+    calls = []
+    insert_nodes = li._index.insert_nodes
+
+    def _insert(nodes):
+        calls.append([n.text for n in nodes])
+        if any(n.text == "bad" for n in nodes):
+            raise RuntimeError("embedding failed")
+        insert_nodes(nodes)
+
+    li._index.insert_nodes = _insert
+    nodes = li.add_nodes([("a", {"k": 1}), ("b", None)])
+    assert [n.text for n in nodes] == ["a", "b"] and calls == [["a", "b"]]
+    assert nodes[0].excluded_embed_metadata_keys == ["k"]
+
+    nodes = li.add_nodes([("c", None), ("bad", None), ("d", None)])
+    assert nodes[1] is None and [nodes[0].text, nodes[2].text] == ["c", "d"]
+    assert li.nodes_num == 4 and li.add_nodes([]) == []
+
+
+def test_shared_events_embed_each_text_once():
+    from llama_index.core import Settings, StorageContext, VectorStoreIndex
+    from llama_index.core.embeddings import MockEmbedding
+    from generative_agents.modules.storage.vector_store import SharedEmbeddings, SharedVectorStore
+
+    embedded = []
+
+    class CountingEmbedding(MockEmbedding):
+        def _get_text_embeddings(self, texts):
+            embedded.extend(texts)
+            return super()._get_text_embeddings(texts)
+
+    Settings.embed_model = CountingEmbedding(embed_dim=4)
+    shared, agents = SharedEmbeddings(), []
+    for _ in range(3):
+        li = make_li_instance()
+        li._shared = shared
+        li._index = VectorStoreIndex(
+            [],
+            storage_context=StorageContext.from_defaults(
+                vector_store=SharedVectorStore(shared=shared)
+            ),
+        )
+        li.add_nodes([("bed is idle", {"poignancy": 1}), ("desk is idle", {"poignancy": 2})])
+        li.add_node("bed is idle", metadata={"poignancy": 3})
+        agents.append(li)
+    assert sorted(embedded) == ["bed is idle", "desk is idle"] and shared.size == 2
+    assert all(li.nodes_num == 3 for li in agents)
+    assert agents[2].find_node("node_2").metadata == {"poignancy": 3}
+
+
+def test_touch_writes_access_back_to_docstore():
+    from llama_index.core import Settings, StorageContext, VectorStoreIndex
+    from llama_index.core.embeddings import MockEmbedding
+    from generative_agents.modules.storage.vector_store import NumpyVectorStore
+    from modules.utils.timer import set_timer
+
+    Settings.embed_model = MockEmbedding(embed_dim=4)
+    set_timer("20240601-08:00")
+    li = make_li_instance()
+    li._index = VectorStoreIndex(
+        [], storage_context=StorageContext.from_defaults(vector_store=NumpyVectorStore())
+    )
+    stamps = {"create": "20240101-00:00", "expire": "20250101-00:00:00", "access": "20240101-00:00"}
+    nodes = li.add_nodes([("a", dict(stamps)), ("b", dict(stamps))])
+    li._migrate_dates()
+    assert li.find_node(nodes[1].id_).metadata["create"] == "20240101-00:00:00"
+
+    touched = li.touch([nodes[0].id_, nodes[0].id_, "missing"])
+    assert [n.id_ for n in touched] == [nodes[0].id_]
+    assert li.find_node(nodes[0].id_).metadata["access"] == "20240601-08:00:00"
+    assert li.find_node(nodes[1].id_).metadata["access"] == "20240101-00:00:00"
+    assert li.touch([]) == []
+
+
+def test_load_migrates_legacy_stamps_before_cleanup(tmp_path):
+    from llama_index.core import Settings, StorageContext, VectorStoreIndex
+    from llama_index.core.embeddings import MockEmbedding
+    from llama_index.core.storage.docstore import SimpleDocumentStore
+    from generative_agents.modules.storage.vector_store import NumpyVectorStore
+    from modules.utils.timer import set_timer
+
+    Settings.embed_model = MockEmbedding(embed_dim=4)
+    li = make_li_instance(tmp_path)
+    li._index = VectorStoreIndex(
+        [], storage_context=StorageContext.from_defaults(vector_store=NumpyVectorStore())
+    )
+    # stamps of old checkpoints: hours not zero-padded, minute precision
+    expired = li.add_node("expired", metadata={"create": "20240101-8:00", "expire": "20240601-7:30"})
+    kept = li.add_node("kept", metadata={"create": "20240101-8:00:00", "expire": "20240601-10:00"})
+    future = li.add_node("future", metadata={"create": "20240601-9:00", "expire": "20250101-9:00"})
+    li.save()
+
+    config = {"provider": "openai", "model": "mock", "base_url": "http://127.0.0.1:1", "api_key": "x"}
+    loaded = LlamaIndex(config, path=str(tmp_path))
+    assert loaded.find_node(kept.id_).metadata["expire"] == "20240601-10:00:00"
+    loaded.save()
+    docstore = SimpleDocumentStore.from_persist_dir(str(tmp_path))
+    assert docstore.get_node(expired.id_).metadata == {
+        "create": "20240101-08:00:00",
+        "expire": "20240601-07:30:00",
+    }
+
+    set_timer("20240601-08:00")
+    assert sorted(loaded.cleanup()) == sorted([expired.id_, future.id_])
+    assert loaded.has_node(kept.id_) and loaded.nodes_num == 1
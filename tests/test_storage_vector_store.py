@@ -0,0 +1,265 @@
+import json
+
+import numpy as np
+from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import TextNode
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from llama_index.core.vector_stores import ExactMatchFilter, MetadataFilters
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from generative_agents.modules.storage.vector_store import (
+    NumpyVectorStore,
+    QuantizedVectorStore,
+    SharedEmbeddings,
+    SharedVectorStore,
+    quantize,
+)
+
+
+def _node(node_id, embedding, node_type="event", text=None):
+    return TextNode(
+        text=text or node_id,
+        id_=node_id,
+        embedding=embedding,
+        metadata={"node_type": node_type},
+        excluded_embed_metadata_keys=["node_type"],
+    )
+
+
+def test_query_filters_node_ids_and_delete_packs_rows():
+    store = NumpyVectorStore()
+    store.add(
+        [
+            _node("a", [1.0, 0.0]),
+            _node("b", [0.0, 1.0], "chat"),
+            _node("c", [1.0, 1.0]),
+        ]
+    )
+    result = store.query(VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=2))
+    assert result.ids == ["a", "c"]
+    assert np.allclose(result.similarities, [1.0, np.sqrt(0.5)])
+
+    filters = MetadataFilters(filters=[ExactMatchFilter(key="node_type", value="chat")])
+    result = store.query(
+        VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=5, filters=filters)
+    )
+    assert result.ids == ["b"]
+    result = store.query(
+        VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=5, node_ids=["b", "c"])
+    )
+    assert result.ids == ["c", "b"]
+
+    store.delete_nodes(["a"])
+    assert store.nodes_num == 2 and store.get("c") == [1.0, 1.0]
+    assert store.matrix.shape == (2, 2)
+
+
+def test_persist_maps_matrix_and_index_round_trips(tmp_path):
+    store = NumpyVectorStore()
+    index = VectorStoreIndex(
+        [_node("a", [1.0, 0.0]), _node("b", [0.0, 1.0])],
+        storage_context=StorageContext.from_defaults(vector_store=store),
+        embed_model=MockEmbedding(embed_dim=2),
+    )
+    index.storage_context.persist(str(tmp_path))
+    assert (tmp_path / "default__vector_store.npy").exists()
+
+    loaded = NumpyVectorStore.from_persist_dir(str(tmp_path))
+    assert isinstance(loaded.matrix.base, np.memmap) or isinstance(loaded.matrix, np.memmap)
+    index = load_index_from_storage(
+        StorageContext.from_defaults(persist_dir=str(tmp_path), vector_store=loaded),
+        embed_model=MockEmbedding(embed_dim=2),
+    )
+    assert set(index.docstore.docs) == {"a", "b"}
+    result = loaded.query(VectorStoreQuery(query_embedding=[0.0, 2.0], similarity_top_k=1))
+    assert result.ids == ["b"]
+
+    # the mapped matrix is copied on write, the file keeps the persisted rows
+    loaded.add([_node("c", [3.0, 4.0])])
+    loaded.delete_nodes(["a"])
+    assert np.load(tmp_path / "default__vector_store.npy").tolist() == [[1.0, 0.0], [0.0, 1.0]]
+
+
+def test_loads_simple_vector_store_checkpoint(tmp_path):
+    path = tmp_path / "default__vector_store.json"
+    path.write_text(
+        json.dumps(
+            {
+                "embedding_dict": {"a": [1.0, 0.0], "b": [0.0, 1.0]},
+                "text_id_to_ref_doc_id": {"a": "None", "b": "None"},
+                "metadata_dict": {"a": {"node_type": "event"}, "b": {"node_type": "chat"}},
+            }
+        )
+    )
+    store = NumpyVectorStore.from_persist_dir(str(tmp_path))
+    assert store.matrix.dtype == np.float32 and store.get("b") == [0.0, 1.0]
+    filters = MetadataFilters(filters=[ExactMatchFilter(key="node_type", value="event")])
+    result = store.query(
+        VectorStoreQuery(query_embedding=[0.0, 1.0], similarity_top_k=5, filters=filters)
+    )
+    assert result.ids == ["a"]
+
+
+def _clustered(count, dim=16, topics=8, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, dim))
+    return centers[rng.integers(0, topics, count)] + 0.1 * rng.standard_normal((count, dim))
+
+
+def test_ann_probes_buckets_and_tracks_inserts_and_deletes():
+    vectors = _clustered(400)
+    store = NumpyVectorStore(ann={"enable": True, "nlist": 8, "nprobe": 2, "min_train": 100})
+    store.add(
+        [
+            _node(f"n{i}", v.tolist(), "chat" if i % 2 else "event")
+            for i, v in enumerate(vectors[:300])
+        ]
+    )
+    exact = NumpyVectorStore()
+    exact.add([_node(f"n{i}", v.tolist()) for i, v in enumerate(vectors[:300])])
+
+    query = VectorStoreQuery(query_embedding=vectors[5].tolist(), similarity_top_k=5)
+    assert store.query(query).ids == exact.query(query).ids
+    assert store.ann.trained
+
+    # inserted rows are bucketed, deleted rows are dropped
+    store.add([_node(f"n{i}", v.tolist()) for i, v in enumerate(vectors[300:], 300)])
+    store.delete_nodes(["n5"])
+    query = VectorStoreQuery(query_embedding=vectors[350].tolist(), similarity_top_k=3)
+    ids = store.query(query).ids
+    assert ids[0] == "n350" and "n5" not in ids
+
+    filters = MetadataFilters(filters=[ExactMatchFilter(key="node_type", value="chat")])
+    query = VectorStoreQuery(
+        query_embedding=vectors[7].tolist(), similarity_top_k=3, filters=filters
+    )
+    assert store.query(query).ids[0] == "n7"
+    assert all(int(n[1:]) % 2 for n in store.query(query).ids)
+
+
+def test_ann_recall_grows_with_nprobe():
+    vectors = _clustered(2000, dim=32, topics=64, seed=1)
+    nodes = [_node(f"n{i}", v.tolist()) for i, v in enumerate(vectors)]
+    store = NumpyVectorStore(ann={"enable": True, "nlist": 32, "nprobe": 1, "min_train": 0})
+    exact = NumpyVectorStore()
+    store.add(nodes)
+    exact.add(nodes)
+
+    def _recall(nprobe):
+        store.ann.nprobe = nprobe
+        hits = 0
+        for v in vectors[:50]:
+            query = VectorStoreQuery(query_embedding=v.tolist(), similarity_top_k=10)
+            hits += len(set(store.query(query).ids) & set(exact.query(query).ids))
+        return hits / 500
+
+    low, full = _recall(1), _recall(32)
+    assert full == 1.0 and low <= full
+
+
+def test_quantize_round_trips_within_a_step():
+    vectors = _clustered(50, dim=64).astype(np.float32)
+    codes, scales = quantize(vectors)
+    assert codes.dtype == np.int8 and codes.nbytes * 4 == vectors.nbytes
+    assert np.abs(codes * scales[:, None] - vectors).max() <= scales.max() / 2 + 1e-6
+
+
+def test_quantized_store_reranks_with_floats_and_persists(tmp_path):
+    vectors = _clustered(300, dim=32, topics=4, seed=2)
+    nodes = [_node(f"n{i}", v.tolist()) for i, v in enumerate(vectors)]
+    exact, store = NumpyVectorStore(), QuantizedVectorStore(rerank=4)
+    exact.add(nodes)
+    store.add(nodes)
+    assert store.matrix.dtype == np.int8
+
+    query = VectorStoreQuery(query_embedding=vectors[9].tolist(), similarity_top_k=5)
+    result = store.query(query)
+    assert result.ids == exact.query(query).ids
+    assert np.allclose(result.similarities, exact.query(query).similarities, atol=1e-5)
+
+    store.delete_nodes(["n0"])
+    store.persist(str(tmp_path / "default__vector_store.json"))
+    assert (tmp_path / "default__vector_store.int8.npy").exists()
+    loaded = QuantizedVectorStore.from_persist_dir(str(tmp_path), rerank=4)
+    assert loaded.query(query).ids == result.ids
+    assert np.allclose(loaded.get("n9"), vectors[9], atol=1e-6)
+
+    # the float store reads the quantized checkpoint through its float embeddings
+    assert NumpyVectorStore.from_persist_dir(str(tmp_path)).query(query).ids == result.ids
+
+
+def test_quantized_store_without_rerank_keeps_no_floats(tmp_path):
+    vectors = _clustered(100, dim=32, seed=3)
+    store = NumpyVectorStore()
+    store.add([_node(f"n{i}", v.tolist()) for i, v in enumerate(vectors)])
+    store.persist(str(tmp_path / "default__vector_store.json"))
+
+    # float checkpoints are quantized on load
+    quantized = QuantizedVectorStore.from_persist_dir(str(tmp_path), rerank=0)
+    (tmp_path / "default__vector_store.npy").unlink()
+    quantized.persist(str(tmp_path / "default__vector_store.json"))
+    assert not (tmp_path / "default__vector_store.npy").exists()
+
+    loaded = NumpyVectorStore.from_persist_dir(str(tmp_path))
+    assert np.allclose(loaded.get("n3"), vectors[3], atol=np.abs(vectors[3]).max() / 127)
+    query = VectorStoreQuery(query_embedding=vectors[3].tolist(), similarity_top_k=1)
+    assert quantized.query(query).ids == ["n3"]
+
+
+def test_shared_store_keeps_one_embedding_per_event(tmp_path):
+    shared = SharedEmbeddings(str(tmp_path / "_shared"))
+    alice, bob = SharedVectorStore(shared=shared), SharedVectorStore(shared=shared)
+    alice.add([_node("a0", [1.0, 0.0], text="bed is idle"), _node("a1", [0.0, 1.0], text="x")])
+    bob.add([_node("b0", [1.0, 0.0], text="bed is idle"), _node("b1", [1.0, 1.0], text="y")])
+    assert shared.size == 3 and alice.refs[0] == bob.refs[0]
+
+    query = VectorStoreQuery(query_embedding=[1.0, 0.1], similarity_top_k=2)
+    assert bob.query(query).ids == ["b0", "b1"]
+    bob.delete_nodes(["b0"])
+    assert bob.query(query).ids == ["b1"] and alice.get("a0") == [1.0, 0.0]
+
+    alice.persist(str(tmp_path / "alice" / "default__vector_store.json"))
+    assert (tmp_path / "_shared" / "embeddings.npy").exists()
+    loaded = SharedVectorStore.from_persist_dir(
+        str(tmp_path / "alice"), shared=SharedEmbeddings(str(tmp_path / "_shared"))
+    )
+    assert loaded.query(query).ids == ["a0", "a1"] and loaded.get("a1") == [0.0, 1.0]
+
+
+def test_shared_store_converts_float_checkpoints(tmp_path):
+    nodes = [_node("a", [1.0, 0.0], text="same"), _node("b", [0.0, 1.0], text="other")]
+    store = NumpyVectorStore()
+    store.add(nodes)
+    store.persist(str(tmp_path / "default__vector_store.json"))
+    docstore = SimpleDocumentStore()
+    docstore.add_documents(nodes)
+
+    shared = SharedEmbeddings()
+    shared.add(["same"], [[1.0, 0.0]])
+    loaded = SharedVectorStore.from_persist_dir(str(tmp_path), shared=shared, docstore=docstore)
+    assert shared.size == 2 and loaded.refs.tolist() == [0, 1]
+    query = VectorStoreQuery(query_embedding=[0.0, 1.0], similarity_top_k=1)
+    assert loaded.query(query).ids == ["b"]
+
+
+def test_shared_store_resolves_refs_of_another_shared_store(tmp_path):
+    nodes = [_node("a", [1.0, 0.0], text="same"), _node("b", [0.0, 1.0], text="other")]
+    docstore = SimpleDocumentStore()
+    docstore.add_documents(nodes)
+    store = SharedVectorStore(shared=SharedEmbeddings(str(tmp_path / "shard0")))
+    store.add(nodes)
+    store.persist(str(tmp_path / "agent" / "default__vector_store.json"))
+
+    # the agent is loaded by another shard, whose shared store has other rows
+    shared = SharedEmbeddings()
+    shared.add(["unrelated", "same"], [[0.5, 0.5], [1.0, 0.0]])
+    embedded = []
+    loaded = SharedVectorStore.from_persist_dir(
+        str(tmp_path / "agent"),
+        shared=shared,
+        docstore=docstore,
+        embed=lambda texts: embedded.extend(texts) or [[0.0, 1.0] for _ in texts],
+    )
+    assert embedded == ["other"] and loaded.refs.tolist() == [1, 2]
+    assert loaded.get("a") == [1.0, 0.0] and loaded.get("b") == [0.0, 1.0]
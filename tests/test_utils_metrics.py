@@ -0,0 +1,50 @@
+from prometheus_client import REGISTRY
+
+from generative_agents.modules.utils.metrics import (
+    agent_scope,
+    current_agent,
+    get_or_create_counter,
+    profile,
+    profiled,
+)
+
+
+def _count(agent, phase, caller):
+    return REGISTRY.get_sample_value(
+        "generative_agents_phase_seconds_count",
+        {"agent": agent, "phase": phase, "caller": caller},
+    ) or 0
+
+
+def test_agent_scope_nests_and_resets():
+    assert current_agent() == ""
+    with agent_scope("A"):
+        assert current_agent() == "A"
+        with agent_scope("B"):
+            assert current_agent() == "B"
+        assert current_agent() == "A"
+    assert current_agent() == ""
+
+
+def test_profile_records_agent_phase_caller():
+    before = _count("A", "percept", "think")
+    with agent_scope("A"):
+        with profile("percept", "think"):
+            pass
+    assert _count("A", "percept", "think") == before + 1
+
+
+def test_profiled_defaults_caller_to_function_name():
+    @profiled("associate.retrieve")
+    def retrieve_events(x):
+        return x * 2
+
+    before = _count("", "associate.retrieve", "retrieve_events")
+    assert retrieve_events(3) == 6
+    assert _count("", "associate.retrieve", "retrieve_events") == before + 1
+
+
+def test_get_or_create_is_idempotent():
+    c1 = get_or_create_counter("test_metrics_idempotent_total", "doc", ["x"])
+    c2 = get_or_create_counter("test_metrics_idempotent_total", "doc", ["x"])
+    assert c1 is c2
@@ -1,6 +1,8 @@
 import datetime
 
-from generative_agents.modules.utils.timer import Timer
+import pytest
+
+from generative_agents.modules.utils.timer import Timer, encode_date, migrate_date, to_date, to_epoch
 
 
 def test_timer_weekday_and_formats_cn():
@@ -12,3 +14,27 @@ def test_timer_weekday_and_formats_cn():
     some_time = datetime.datetime(2024, 1, 3, 8, 15)
     tf = t.time_format_cn(some_time)
     assert "年" in tf and ":" in tf
+
+
+def test_fast_codec_matches_strptime():
+    for stamp in ["20240101-00:00:00", "20241231-23:59:59", "20240229-12:05:09"]:
+        date = to_date(stamp)
+        assert date == datetime.datetime.strptime(stamp, "%Y%m%d-%H:%M:%S")
+        assert encode_date(date) == stamp == date.strftime("%Y%m%d-%H:%M:%S")
+    assert to_date("7:05", "%H:%M") == datetime.datetime.strptime("7:05", "%H:%M")
+    assert to_date("24:30", "%H:%M") == datetime.datetime.strptime("0:30", "%H:%M")
+    # non padded stamps fall back to strptime
+    assert to_date("20240101-8:00:00") == datetime.datetime(2024, 1, 1, 8)
+    assert sorted(["20240102-00:00:00", "20231231-23:59:59"]) == [
+        "20231231-23:59:59",
+        "20240102-00:00:00",
+    ]
+
+
+def test_migrate_date_reads_old_stamps():
+    assert migrate_date("20240101-08:00:00") == "20240101-08:00:00"
+    assert migrate_date("20240101-8:00:00") == "20240101-08:00:00"
+    assert migrate_date("20240101-08:30") == "20240101-08:30:00"
+    assert migrate_date(to_epoch(to_date("20240101-08:30:00"))) == "20240101-08:30:00"
+    with pytest.raises(ValueError):
+        migrate_date("yesterday")